@@ -0,0 +1,380 @@
+"""
+Technology bill allocation of gauge bills and water entries.
+
+These are the follow-up writes of the billing routes:
+
+  allocate_gauge_bill()   a new gauge bill is added to the technology bills
+                          of its meter's stations (add_new_bill)
+  propagate_tech_bill()   once a station technology's water amount is in,
+                          the station meter's bill is split across sibling
+                          technologies by water share and a waiting intake
+                          (is_source) bill is distributed (edit_tech_bill,
+                          insert_or_edit_tech_bill); /tech-bills/import
+                          calls split_station_meter() and
+                          distribute_intake_bill() once per meter instead
+
+They write in the given session and leave the commit to the caller: the
+route itself when ALLOCATION_ASYNC is off, otherwise the allocation job
+(jobs.py).  Power and cost are never read into Python and written back:
+add_to_tech_bills() adds the shares with UPDATE ... SET x = x + :delta, so
+clerks entering bills for the same month at once cannot lose each other's
+additions.  The station meter split (split_station_meter) rescales the rows
+in place as well, with SET x = x * :share, and a later re-split after a
+water amount changed (resplit_station_meter) redistributes their summed
+amounts in a single UPDATE.
+"""
+
+from decimal import Decimal
+
+from sqlalchemy import and_, or_, tuple_, bindparam, case, func, Float
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import GuageBill, TechnologyBill, AlumChlorineReference
+from topology import topology_cache
+
+# every technology an intake (is_source) meter feeds needs these before its bill is distributed
+INTAKE_REQUIRED_COLUMNS = ("technology_water_amount", "technology_bill_percentage")
+
+
+def get_season(month):
+    if month in range(4, 11):  # 11 is exclusive, so covers 4 to 10
+        return "summer"
+    else:
+        return "winter"
+
+
+def month_tech_bills(session, keys, bill_month, bill_year, lock=False):
+    """
+    {(station_id, technology_id): TechnologyBill} of the month for the
+    (station_id, technology_id) keys, in one query.  lock=True reads them
+    FOR UPDATE (UPDLOCK on SQL Server) until the transaction ends.
+    """
+    keys = set(keys)
+    if not keys:
+        return {}
+    if session.get_bind().dialect.name == "mssql":
+        # SQL Server has no row-value IN
+        match = or_(*(and_(TechnologyBill.station_id == station_id, TechnologyBill.technology_id == technology_id)
+                      for station_id, technology_id in keys))
+    else:
+        match = tuple_(TechnologyBill.station_id, TechnologyBill.technology_id).in_(keys)
+    query = session.query(TechnologyBill).filter(
+        match,
+        TechnologyBill.bill_month == bill_month,
+        TechnologyBill.bill_year == bill_year
+    )
+    if lock:
+        query = query.with_for_update().with_hint(TechnologyBill, "WITH (UPDLOCK, ROWLOCK)", "mssql")
+    return {(b.station_id, b.technology_id): b for b in query.all()}
+
+
+def month_gauge_bill(session, account_number, bill_month, bill_year, lock=False):
+    """
+    The gauge's bill of the month, or None.  lock=True reads it FOR UPDATE
+    (UPDLOCK on SQL Server): an intake bill's distribution is serialized on
+    its own row, which exists before any of the technology bills it is
+    distributed over might.
+    """
+    query = session.query(GuageBill).filter(
+        GuageBill.account_number == account_number,
+        GuageBill.bill_month == bill_month,
+        GuageBill.bill_year == bill_year,
+    )
+    if lock:
+        query = query.with_for_update().with_hint(GuageBill, "WITH (UPDLOCK, ROWLOCK)", "mssql").populate_existing()
+    return query.first()
+
+
+def add_to_tech_bills(session, bill_month, bill_year, deltas, by_percentage=False):
+    """
+    Add power and total to the month's technology bills in place, as one
+    executemany UPDATE ... SET x = COALESCE(x, 0) + :delta, so allocations
+    committed concurrently to the same row add up instead of one overwriting
+    the other.  deltas are {"b_station_id", "b_technology_id", "b_power",
+    "b_total"} dicts; rows that do not exist are left alone.
+
+    by_percentage=True scales each delta by the row's own
+    technology_bill_percentage when it has one (a station meter already
+    split), decided by the database on the row it updates.
+    """
+    if not deltas:
+        return
+    techs = TechnologyBill.__table__
+    power = bindparam("b_power", type_=techs.c.technology_power_consump.type)
+    total = bindparam("b_total", type_=techs.c.technology_bill_total.type)
+    if by_percentage:
+        split = and_(techs.c.technology_bill_percentage != None, techs.c.technology_bill_percentage != 0)
+        power = case((split, power * techs.c.technology_bill_percentage / 100), else_=power)
+        total = case((split, total * techs.c.technology_bill_percentage / 100), else_=total)
+    session.execute(
+        techs.update().where(and_(
+            techs.c.station_id == bindparam("b_station_id"),
+            techs.c.technology_id == bindparam("b_technology_id"),
+            techs.c.bill_month == bill_month,
+            techs.c.bill_year == bill_year,
+        )).values(
+            technology_power_consump=func.coalesce(techs.c.technology_power_consump, 0) + power,
+            technology_bill_total=func.coalesce(techs.c.technology_bill_total, 0) + total,
+        ),
+        deltas,
+    )
+
+
+def _delta(bill, power, total):
+    return {"b_station_id": bill.station_id, "b_technology_id": bill.technology_id, "b_power": power,
+            "b_total": total}
+
+
+def intake_ready(bill):
+    """Whether an intake meter's bill can be distributed over this technology bill (may be None)."""
+    return bill is not None and all(getattr(bill, column) is not None for column in INTAKE_REQUIRED_COLUMNS)
+
+
+def allocate_gauge_bill(session, new_bill, gauge_sgts, month_bills):
+    """
+    Add new_bill's power and total to the technology bills of its active
+    relations (gauge_sgts, from the topology index).  month_bills is
+    month_tech_bills() of those relations; existing rows are only read and
+    get their share through add_to_tech_bills().  Returns False when an
+    intake bill has to wait because some technology has no water amount yet.
+
+    An intake bill is distributed once: it is marked is_distributed, and one
+    already marked is left alone (see distribute_intake_bill).
+    """
+    if gauge_sgts[0].is_source:
+        if new_bill.is_distributed:
+            return True
+        related_bills = [month_bills.get((g_sgt.station_id, g_sgt.technology_id)) for g_sgt in gauge_sgts]
+        if not all(intake_ready(bill) for bill in related_bills):
+            return False
+        total_water = sum(related_bill.technology_water_amount for related_bill in related_bills)
+        deltas = []
+        for r_b in related_bills:
+            if total_water:
+                deltas.append(_delta(r_b, new_bill.power_consump * r_b.technology_water_amount / total_water,
+                                     new_bill.bill_total * Decimal(r_b.technology_water_amount / total_water)))
+            else:
+                deltas.append(_delta(r_b, new_bill.power_consump / len(gauge_sgts),
+                                     new_bill.bill_total / Decimal(len(gauge_sgts))))
+        add_to_tech_bills(session, new_bill.bill_month, new_bill.bill_year, deltas)
+        new_bill.is_distributed = True
+        return True
+
+    #  search station gauge technology relation then insert in technology bill the corresponding data
+    # one to one relations or many to one relations
+    if len(gauge_sgts) == 1:
+        # check if a single or multi gauges are providing for same tech
+        current_tech_bill = month_bills.get((gauge_sgts[0].station_id, gauge_sgts[0].technology_id))
+        if current_tech_bill:
+            add_to_tech_bills(session, new_bill.bill_month, new_bill.bill_year,
+                              [_delta(current_tech_bill, new_bill.power_consump, new_bill.bill_total)])
+        else:
+            session.add(TechnologyBill(
+                station_id=gauge_sgts[0].station_id,
+                technology_id=gauge_sgts[0].technology_id,
+                bill_month=new_bill.bill_month,
+                bill_year=new_bill.bill_year,
+                technology_power_consump=new_bill.power_consump,
+                technology_bill_total=new_bill.bill_total,
+                technology_bill_percentage=100
+            ))
+        return True
+
+    # one to many and many to many relations: the full bill to rows not split yet (divided later according
+    # to water amount), the row's percentage of it otherwise
+    deltas = []
+    for gauge_sgt in gauge_sgts:
+        current_tech_bill = month_bills.get((gauge_sgt.station_id, gauge_sgt.technology_id))
+        if current_tech_bill:
+            deltas.append(_delta(current_tech_bill, new_bill.power_consump, new_bill.bill_total))
+        else:
+            session.add(TechnologyBill(
+                station_id=gauge_sgt.station_id,
+                technology_id=gauge_sgt.technology_id,
+                bill_month=new_bill.bill_month,
+                bill_year=new_bill.bill_year,
+                technology_power_consump=new_bill.power_consump,    # add it any way and divide it according to water amount
+                technology_bill_total=new_bill.bill_total           # add it any way and divide it according to water amount
+            ))
+    add_to_tech_bills(session, new_bill.bill_month, new_bill.bill_year, deltas, by_percentage=True)
+    return True
+
+
+def set_chemical_ranges(bill, chemicals_ref):
+    """Copy the season's reference ranges (an AlumChlorineReference, or None) onto the bill."""
+    if chemicals_ref:
+        bill.chlorine_range_from = chemicals_ref.chlorine_range_from
+        bill.chlorine_range_to = chemicals_ref.chlorine_range_to
+        bill.liquid_alum_range_from = chemicals_ref.liquid_alum_range_from
+        bill.liquid_alum_range_to = chemicals_ref.liquid_alum_range_to
+        bill.solid_alum_range_from = chemicals_ref.solid_alum_range_from
+        bill.solid_alum_range_to = chemicals_ref.solid_alum_range_to
+
+
+def split_station_meter(session, gauge_sgts, month_bills):
+    """
+    Split a station meter's bill over its technologies (gauge_sgts, its
+    station relations) by water share, once every one has its water amount.
+    month_bills must hold the relations' tech bills of the month, flushed.
+
+    The rows hold the meter's whole bill until now (see allocate_gauge_bill);
+    they are rescaled in SQL, SET x = x * :share on the rows still without a
+    percentage, so a share added concurrently is scaled with them instead of
+    overwritten.  The in-memory bills get their new percentage, and their
+    power and total are expired.
+    """
+    related_bills = [month_bills[(r.station_id, r.technology_id)] for r in gauge_sgts
+                     if (r.station_id, r.technology_id) in month_bills]
+    if len(gauge_sgts) != len(related_bills):
+        return False
+    if any(b.technology_water_amount == None for b in related_bills):
+        return False
+
+    total_water_amount = sum(b.technology_water_amount for b in related_bills)
+    shares = []
+    for each_bill in related_bills:
+        if total_water_amount == 0:
+            percentage = 100 / len(related_bills)
+        else:
+            percentage = each_bill.technology_water_amount / total_water_amount * 100
+        shares.append({"b_station_id": each_bill.station_id, "b_technology_id": each_bill.technology_id,
+                       "b_percentage": percentage, "b_share": percentage / 100})
+
+    techs = TechnologyBill.__table__
+    share = bindparam("b_share", type_=Float)
+    session.execute(
+        techs.update().where(and_(
+            techs.c.station_id == bindparam("b_station_id"),
+            techs.c.technology_id == bindparam("b_technology_id"),
+            techs.c.bill_month == related_bills[0].bill_month,
+            techs.c.bill_year == related_bills[0].bill_year,
+            or_(techs.c.technology_bill_percentage == None, techs.c.technology_bill_percentage == 0),
+        )).values(
+            technology_bill_percentage=bindparam("b_percentage"),
+            technology_power_consump=techs.c.technology_power_consump * share,
+            technology_bill_total=techs.c.technology_bill_total * share,
+        ),
+        shares,
+    )
+    for each_bill, row in zip(related_bills, shares):
+        set_committed_value(each_bill, "technology_bill_percentage", row["b_percentage"])
+        session.expire(each_bill, ["technology_power_consump", "technology_bill_total"])
+    return True
+
+
+def resplit_station_meter(session, related_bills):
+    """
+    Split a station meter's bill again after a water amount changed:
+    related_bills are the month's tech bills of the meter's station
+    relations, all already split.  Each row gets the siblings' summed power
+    and total times its new water share, in one UPDATE whose sum subquery
+    sees the rows as they are when it runs, so a share added concurrently
+    is redistributed instead of lost.  While some sibling has no power yet,
+    only the percentages change.
+    """
+    total_water_amount = sum(b.technology_water_amount or 0 for b in related_bills)
+    shares = {}
+    for each_bill in related_bills:
+        if total_water_amount == 0:
+            shares[(each_bill.station_id, each_bill.technology_id)] = 100 / len(related_bills)
+        else:
+            shares[(each_bill.station_id, each_bill.technology_id)] = \
+                (each_bill.technology_water_amount or 0) / total_water_amount * 100
+
+    techs = TechnologyBill.__table__
+    siblings = techs.alias("siblings")
+    bill_month, bill_year = related_bills[0].bill_month, related_bills[0].bill_year
+
+    def of(table):
+        return and_(or_(*(and_(table.c.station_id == station_id, table.c.technology_id == technology_id)
+                          for station_id, technology_id in shares)),
+                    table.c.bill_month == bill_month, table.c.bill_year == bill_year)
+
+    percentage = case(*((and_(techs.c.station_id == station_id, techs.c.technology_id == technology_id),
+                         bindparam(None, value, type_=Float)) for (station_id, technology_id), value in shares.items()))
+    all_allocated = (func.count().select().select_from(siblings).where(of(siblings)).scalar_subquery()
+                     == func.count(siblings.c.technology_power_consump).select().select_from(siblings)
+                     .where(of(siblings)).scalar_subquery())
+    total_power = func.sum(siblings.c.technology_power_consump).select().where(of(siblings)).scalar_subquery()
+    total_bill = func.sum(siblings.c.technology_bill_total).select().where(of(siblings)).scalar_subquery()
+    session.execute(techs.update().where(of(techs)).values(
+        technology_bill_percentage=percentage,
+        technology_power_consump=case((all_allocated, total_power * percentage / 100),
+                                      else_=techs.c.technology_power_consump),
+        technology_bill_total=case((all_allocated, total_bill * percentage / 100),
+                                   else_=techs.c.technology_bill_total),
+    ))
+    for each_bill in related_bills:
+        session.expire(each_bill, ["technology_bill_percentage", "technology_power_consump", "technology_bill_total"])
+
+
+def distribute_intake_bill(session, gauge_bill, source_sgts, month_bills):
+    """
+    Distribute an intake meter's bill over the technologies it feeds
+    (source_sgts) by water share, once every one has its water amount and
+    percentage, and mark it is_distributed; a bill already marked is left
+    alone.  Read gauge_bill with month_gauge_bill(lock=True) so the bill's
+    own allocation and the water entries can't both (or neither) distribute
+    it.  The shares are added with add_to_tech_bills(), so the session must
+    not hold unflushed power/total changes of those rows.
+    """
+    if gauge_bill.is_distributed:
+        return False
+    source_related_bills = []
+    for each_rel in source_sgts:
+        s_b = month_bills.get((each_rel.station_id, each_rel.technology_id))
+        if not intake_ready(s_b):
+            return False
+        source_related_bills.append(s_b)
+
+    total_water_for_resource = sum(s_b.technology_water_amount for s_b in source_related_bills)
+    deltas = []
+    for s_r_b in source_related_bills:
+        if total_water_for_resource:
+            power = gauge_bill.power_consump * s_r_b.technology_water_amount / total_water_for_resource
+            total = gauge_bill.bill_total * Decimal(s_r_b.technology_water_amount / total_water_for_resource)
+        else:
+            power = gauge_bill.power_consump / len(source_related_bills)
+            total = gauge_bill.bill_total / Decimal(len(source_related_bills))
+        deltas.append(_delta(s_r_b, power, total))
+    add_to_tech_bills(session, gauge_bill.bill_month, gauge_bill.bill_year, deltas)
+    gauge_bill.is_distributed = True
+    return True
+
+
+def propagate_tech_bill(session, station_id, technology_id, bill_month, bill_year, lock=False):
+    """
+    Follow-up of a technology bill's water/chemical entry: power per water,
+    the season's chemical ranges, the station meter split and the intake
+    meter distribution.  With lock=True the intake bill is locked first,
+    then the technology bills, in the order the bill's own allocation job
+    takes them.  Returns what was done, or None if the bill is gone.
+    """
+    topology = topology_cache.get()
+    source_stg = topology.intake_meter(station_id, technology_id)
+    gauge_bill = source_stg and month_gauge_bill(session, source_stg.account_number, bill_month, bill_year,
+                                                 lock=lock)
+    bill = month_tech_bills(session, [(station_id, technology_id)], bill_month, bill_year,
+                            lock=lock).get((station_id, technology_id))
+    if bill is None:
+        return None
+
+    bill.power_per_water = bill.technology.power_per_water
+    set_chemical_ranges(bill, session.get(AlumChlorineReference, (
+        bill.technology_id, bill.station.water_source_id, get_season(bill.bill_month))))
+
+    station_split = False
+    sgt = topology.station_meter(bill.station_id, bill.technology_id)
+    if not bill.technology_bill_percentage and sgt:
+        gauge_sgts = topology.relations(sgt.account_number, is_source=False)
+        month_bills = month_tech_bills(session, [(r.station_id, r.technology_id) for r in gauge_sgts],
+                                       bill_month, bill_year, lock=lock)
+        station_split = split_station_meter(session, gauge_sgts, month_bills)
+
+    intake_split = False
+    if gauge_bill:
+        source_sgts = topology.relations(gauge_bill.account_number, is_source=True)
+        month_bills = month_tech_bills(session, [(r.station_id, r.technology_id) for r in source_sgts],
+                                       bill_month, bill_year, lock=lock)
+        intake_split = distribute_intake_bill(session, gauge_bill, source_sgts, month_bills)
+    return {"station_split": station_split, "intake_split": intake_split}
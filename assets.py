@@ -0,0 +1,76 @@
+"""
+Read-only assets loaded once per process, ideally before the server forks.
+
+With a preloading server (gunicorn.conf.py sets preload_app) create_app()
+calls preload() in the master: master-data catalogs that no route edits,
+the persisted forecast model and the lazy analytics stack are loaded there
+and shared copy-on-write by every worker instead of being rebuilt per worker.
+Without preloading, each piece is still loaded on first use.
+"""
+
+import os
+import threading
+
+from models import db, Branch, WaterSource
+import lazy_imports
+
+# catalogs served from memory: there are no routes that write these tables,
+# so a restart (or assets.reload_catalogs()) picks up manual DB edits
+CATALOG_MODELS = {
+    "branches": Branch,
+    "water_sources": WaterSource,
+}
+
+_lock = threading.Lock()
+_catalogs = {}
+_forecast = {"loaded": False, "model": None, "metadata": None}
+
+
+def load_catalogs():
+    catalogs = {name: [row.to_dict() for row in db.session.query(model).all()]
+                for name, model in CATALOG_MODELS.items()}
+    with _lock:
+        _catalogs.clear()
+        _catalogs.update(catalogs)
+
+
+reload_catalogs = load_catalogs
+
+
+def catalog(name):
+    """to_dict() rows of a catalog table; treat the returned list as read-only."""
+    rows = _catalogs.get(name)
+    if rows is None:
+        load_catalogs()
+        rows = _catalogs[name]
+    return rows
+
+
+def load_forecast_model():
+    """The last model saved by water_demand_forecast.run_forecast, or (None, None)."""
+    from water_demand_forecast import MODEL_PATH, METADATA_PATH
+    model = metadata = None
+    if os.path.exists(MODEL_PATH):
+        import joblib
+        model = joblib.load(MODEL_PATH)
+        metadata = joblib.load(METADATA_PATH) if os.path.exists(METADATA_PATH) else None
+    with _lock:
+        _forecast.update(loaded=True, model=model, metadata=metadata)
+    return model, metadata
+
+
+def forecast_model():
+    if not _forecast["loaded"]:
+        load_forecast_model()
+    return _forecast["model"], _forecast["metadata"]
+
+
+def preload(app):
+    with app.app_context():
+        load_catalogs()
+        db.session.remove()
+        db.engine.dispose()  # don't hand pooled connections to forked workers
+    lazy_imports.preload()
+    load_forecast_model()
+    app.logger.info(f"preloaded assets: catalogs={sorted(_catalogs)} analytics={lazy_imports.loaded()} "
+                    f"forecast_model={'yes' if _forecast['model'] is not None else 'no'}")
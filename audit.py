@@ -0,0 +1,469 @@
+"""
+Background writer for the auditing table.
+
+after_commit hands the collected entries to audit_writer.enqueue(); a daemon
+thread drains the bounded queue and writes them with one multi-row
+executemany per batch.  A batch is flushed when it reaches
+AUDIT_BATCH_SIZE entries, when AUDIT_FLUSH_INTERVAL seconds have passed since
+its first entry, and on interpreter shutdown.
+
+When the queue is full the entries are written synchronously on the caller's
+thread (counted as "overflow") so audit rows are never silently lost under a
+burst; entries are only "dropped" when a batch still fails after a retry.
+"""
+
+import atexit
+import base64
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, date
+from decimal import Decimal
+
+from sqlalchemy import text, inspect, and_, or_, select
+from sqlalchemy.orm.base import NO_VALUE
+
+try:
+    import orjson
+except ImportError:  # pinned in requirements.txt; the stdlib encoder keeps old installs working
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+AUDIT_QUEUE_SIZE = 10000
+AUDIT_BATCH_SIZE = 200
+AUDIT_FLUSH_INTERVAL = 1.0  # seconds
+
+AUDIT_INSERT = text("""
+    INSERT INTO auditing (username, audit_date, action, table_name, old_data, new_data)
+    VALUES (:u, :d, :a, :t, :old, :new)
+""")
+
+_STOP = object()
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def dump_audit_data(data):
+    if not data:
+        return None
+    if orjson is not None:
+        # orjson encodes datetime itself; Decimal keeps its exact digits via _json_default
+        return orjson.dumps(data, default=_json_default).decode()
+    return json.dumps(data, ensure_ascii=False, default=_json_default)
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  Change capture (called from before_commit)
+# ═══════════════════════════════════════════════════════════════════════════
+
+class _MapperInfo:
+    """Column keys and primary-key keys of one mapped class, computed once."""
+
+    __slots__ = ("table_name", "columns", "column_set", "primary_key")
+
+    def __init__(self, cls):
+        mapper = inspect(cls)
+        self.table_name = cls.__tablename__
+        self.columns = tuple(attr.key for attr in mapper.column_attrs)
+        self.column_set = frozenset(self.columns)
+        self.primary_key = tuple(mapper.get_property_by_column(col).key for col in mapper.primary_key)
+
+
+_mapper_infos = {}
+
+
+def mapper_info(cls):
+    info = _mapper_infos.get(cls)
+    if info is None:
+        info = _mapper_infos[cls] = _MapperInfo(cls)
+    return info
+
+
+def precompute_mapper_infos(base):
+    """Build the per-class column lists for every mapped model up front."""
+    for mapper in base.registry.mappers:
+        if hasattr(mapper.class_, "__tablename__"):
+            mapper_info(mapper.class_)
+
+
+def _value(state_dict, obj, key):
+    value = state_dict.get(key, NO_VALUE)
+    if value is NO_VALUE:
+        # expired/unloaded attribute (rare here); load it like the old getattr() did
+        return getattr(obj, key)
+    return value
+
+
+def capture_changes(session, username, skip_tables=()):
+    """
+    Audit entries for the pending inserts/updates/deletes of session.
+
+    Updates only carry the columns whose value actually changed (read from
+    the instance's committed_state, no attribute history objects) plus the
+    primary key so the row can be identified.
+    """
+    entries = []
+
+    # === INSERTS ===
+    for obj in session.new:
+        if not hasattr(obj, "__tablename__"):
+            continue
+        info = mapper_info(type(obj))
+        if info.table_name == "auditing" or info.table_name in skip_tables:
+            continue
+        state_dict = obj.__dict__
+        entries.append({
+            "username": username,
+            "action": "INSERT",
+            "table_name": info.table_name,
+            "old_data": None,
+            "new_data": {key: state_dict.get(key) for key in info.columns},
+        })
+
+    # === UPDATES ===
+    for obj in session.dirty:
+        if not hasattr(obj, "__tablename__"):
+            continue
+        info = mapper_info(type(obj))
+        if info.table_name == "auditing" or info.table_name in skip_tables:
+            continue
+        state = inspect(obj)
+        committed = state.committed_state
+        if not committed:
+            continue
+        state_dict = state.dict
+
+        old_data = {}
+        new_data = {}
+        for key, old_val in committed.items():
+            if key not in info.column_set:
+                continue  # relationship collections etc.
+            new_val = state_dict.get(key)
+            if old_val is NO_VALUE:
+                old_val = None
+            if old_val == new_val:
+                continue
+            old_data[key] = old_val
+            new_data[key] = new_val
+
+        if old_data or new_data:
+            for key in info.primary_key:
+                pk_value = _value(state_dict, obj, key)
+                old_data[key] = pk_value
+                new_data[key] = pk_value
+            entries.append({
+                "username": username,
+                "action": "UPDATE",
+                "table_name": info.table_name,
+                "old_data": old_data,
+                "new_data": new_data,
+            })
+
+    # === DELETES ===
+    for obj in session.deleted:
+        if not hasattr(obj, "__tablename__"):
+            continue
+        info = mapper_info(type(obj))
+        if info.table_name == "auditing" or info.table_name in skip_tables:
+            continue
+        state_dict = obj.__dict__
+        entries.append({
+            "username": username,
+            "action": "DELETE",
+            "table_name": info.table_name,
+            "old_data": {key: state_dict.get(key) for key in info.columns},
+            "new_data": None,
+        })
+
+    return entries
+
+
+def to_row(entry):
+    return {
+        "u": entry["username"],
+        "d": entry["audit_date"],
+        "a": entry["action"],
+        "t": entry["table_name"],
+        "old": dump_audit_data(entry["old_data"]),
+        "new": dump_audit_data(entry["new_data"]),
+    }
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  Reading the log (/audit)
+# ═══════════════════════════════════════════════════════════════════════════
+
+AUDIT_PAGE_SIZE = 50
+AUDIT_MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(audit_date, audit_id):
+    raw = f"{audit_date.isoformat()}|{audit_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        audit_date, audit_id = raw.split("|")
+        return datetime.fromisoformat(audit_date), int(audit_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"invalid cursor: {cursor}") from e
+
+
+def parse_audit_date(value, end_of_day=False):
+    """ISO date or datetime; a bare date used as an upper bound covers the whole day."""
+    parsed = datetime.fromisoformat(value)
+    if end_of_day and len(value) == 10:
+        parsed = parsed.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return parsed
+
+
+def _audit_page(session, table, filters, after, limit):
+    conditions = []
+    if filters["table_name"]:
+        conditions.append(table.c.table_name == filters["table_name"])
+    if filters["action"]:
+        conditions.append(table.c.action == filters["action"])
+    if filters["username"]:
+        conditions.append(table.c.username == filters["username"])
+    if filters["date_from"]:
+        conditions.append(table.c.audit_date >= filters["date_from"])
+    if filters["date_to"]:
+        conditions.append(table.c.audit_date <= filters["date_to"])
+    if after:
+        after_date, after_id = after
+        # row-value comparison spelled out: SQL Server has no (a, b) < (x, y)
+        conditions.append(or_(
+            table.c.audit_date < after_date,
+            and_(table.c.audit_date == after_date, table.c.audit_id < after_id),
+        ))
+    stmt = (
+        select(table)
+        .where(*conditions)
+        .order_by(table.c.audit_date.desc(), table.c.audit_id.desc())
+        .limit(limit)
+    )
+    return session.execute(stmt).mappings().all()
+
+
+def _audit_row_dict(row, decompress=None):
+    old_data, new_data = row["old_data"], row["new_data"]
+    if decompress is not None:
+        old_data, new_data = decompress(old_data), decompress(new_data)
+    return {
+        "audit_id": row["audit_id"],
+        "username": row["username"],
+        "audit_date": row["audit_date"].isoformat() if row["audit_date"] else None,
+        "action": row["action"],
+        "table_name": row["table_name"],
+        "old_data": old_data,
+        "new_data": new_data,
+    }
+
+
+def query_audit_log(session, table_name=None, action=None, username=None, date_from=None, date_to=None,
+                    cursor=None, limit=AUDIT_PAGE_SIZE):
+    """
+    One page of audit entries, newest first, and the cursor of the next page.
+
+    Keyset pagination on (audit_date, audit_id): each page seeks straight to
+    its first row through the idx_auditing_* indexes instead of OFFSET
+    scanning, so deep pages cost the same as the first one.  Once the live
+    table runs out, the page continues into the per-year archive tables
+    (audit_retention), newest year first, skipping years outside the range.
+    """
+    from models import Auditing
+    from audit_retention import archived_years, archive_table, decompress_payload
+
+    filters = {
+        "table_name": table_name,
+        "action": action.upper() if action else None,
+        "username": username,
+        "date_from": date_from,
+        "date_to": date_to,
+    }
+    after = decode_cursor(cursor) if cursor else None
+
+    items = [_audit_row_dict(row) for row in _audit_page(session, Auditing.__table__, filters, after, limit + 1)]
+
+    if len(items) <= limit:
+        for year in archived_years(session.get_bind()):
+            if len(items) > limit:
+                break
+            year_start = datetime(year, 1, 1)
+            if date_from and date_from >= datetime(year + 1, 1, 1):
+                break  # this and every older year is before the range
+            if (date_to and date_to < year_start) or (after and after[0] < year_start):
+                continue
+            rows = _audit_page(session, archive_table(year), filters, after, limit + 1 - len(items))
+            items.extend(_audit_row_dict(row, decompress_payload) for row in rows)
+
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(datetime.fromisoformat(last["audit_date"]), last["audit_id"])
+    return items, next_cursor
+
+
+class AuditWriter:
+    def __init__(self, queue_size=AUDIT_QUEUE_SIZE, batch_size=AUDIT_BATCH_SIZE,
+                 flush_interval=AUDIT_FLUSH_INTERVAL):
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.app = None
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._thread = None
+        self.counters = {
+            "enqueued": 0,
+            "written": 0,
+            "overflow": 0,
+            "dropped": 0,
+            "batches": 0,
+            "errors": 0,
+        }
+
+    def init_app(self, app):
+        self.app = app
+        self.queue_size = app.config.get("AUDIT_QUEUE_SIZE", self.queue_size)
+        self.batch_size = app.config.get("AUDIT_BATCH_SIZE", self.batch_size)
+        self.flush_interval = app.config.get("AUDIT_FLUSH_INTERVAL", self.flush_interval)
+        self.enabled = app.config.get("AUDIT_ASYNC", True)
+        self._reset()
+        atexit.register(self.stop)
+
+    # --- producer side -----------------------------------------------------
+
+    def enqueue(self, entries):
+        if not entries:
+            return
+        now = datetime.now()
+        for entry in entries:
+            entry.setdefault("audit_date", now)
+
+        if not self.enabled:
+            self._write_sync(entries)
+            return
+
+        self._ensure_started()
+        overflow = []
+        for entry in entries:
+            try:
+                self._queue.put_nowait(entry)
+                self._count("enqueued")
+            except queue.Full:
+                overflow.append(entry)
+        if overflow:
+            self._count("overflow", len(overflow))
+            self._write_sync(overflow)
+
+    def _ensure_started(self):
+        if self._pid != os.getpid():
+            # forked worker: the parent's thread and queue don't exist here
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                    self._thread.start()
+
+    # --- consumer side -----------------------------------------------------
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._write_batch(batch)
+                return
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write_batch(batch)
+                batch = []
+                deadline = None
+
+    def _execute(self, rows):
+        with self.app.app_context():
+            from models import db
+            with db.engine.begin() as conn:
+                conn.execute(AUDIT_INSERT, rows)
+
+    def _write_batch(self, batch):
+        if not batch:
+            return
+        rows = [to_row(entry) for entry in batch]
+        for attempt in (1, 2):
+            try:
+                self._execute(rows)
+            except Exception as e:
+                self._count("errors")
+                logger.error(f"[AUDIT writer] batch of {len(rows)} failed (attempt {attempt}): {e}")
+            else:
+                self._count("written", len(rows))
+                self._count("batches")
+                return
+        self._count("dropped", len(rows))
+
+    def _write_sync(self, entries):
+        self._write_batch(entries)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    # --- lifecycle / reporting ----------------------------------------------
+
+    def stop(self, timeout=5.0):
+        """Flush what is queued and stop the thread (registered with atexit)."""
+        thread = self._thread
+        if thread is None or not thread.is_alive() or self._pid != os.getpid():
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def flush(self, timeout=5.0):
+        """Block until everything queued so far has been written."""
+        self.stop(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["queue_size"] = self.queue_size
+        stats["batch_size"] = self.batch_size
+        stats["flush_interval"] = self.flush_interval
+        stats["writer_alive"] = bool(self._thread and self._thread.is_alive())
+        return stats
+
+
+audit_writer = AuditWriter()
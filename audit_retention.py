@@ -0,0 +1,166 @@
+"""
+Audit log retention: moves old auditing rows into per-year archive tables.
+
+`flask audit-archive` moves every entry older than AUDIT_RETENTION_DAYS
+(whole days) out of the live auditing table into auditing_archive_<year>,
+with old_data/new_data zlib-compressed. It can also add the moved entries to
+the auditing_daily_rollup counts. The live table then holds only recent
+history, so its indexes, audit inserts and /audit lookups stay small.
+
+Archive tables are created on first use and are not part of the models'
+metadata. include_object() keeps alembic autogenerate from proposing to drop
+them. /audit reads them through query_audit_log() once the live rows of a
+page run out.
+"""
+
+import time
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, Table, Column, Integer, String, DateTime, LargeBinary, Index, select, update, \
+    inspect, and_, func
+
+from models import Auditing, AuditingDailyRollup
+
+ARCHIVE_PREFIX = "auditing_archive_"
+AUDIT_RETENTION_DAYS = 365
+AUDIT_ARCHIVE_BATCH_SIZE = 2000
+ARCHIVED_YEARS_TTL = 300  # seconds between re-listing archive tables
+
+archive_metadata = MetaData()
+_archive_tables = {}
+_archived_years = {"years": None, "at": 0.0}
+
+
+def archive_table(year):
+    table = _archive_tables.get(year)
+    if table is None:
+        name = f"{ARCHIVE_PREFIX}{year}"
+        table = Table(
+            name, archive_metadata,
+            Column("audit_id", Integer, primary_key=True, autoincrement=False),
+            Column("username", String(30), nullable=False),
+            Column("audit_date", DateTime, nullable=False),
+            Column("action", String(10), nullable=False),
+            Column("table_name", String(100), nullable=False),
+            Column("old_data", LargeBinary, nullable=True),   # zlib-compressed JSON
+            Column("new_data", LargeBinary, nullable=True),
+            Index(f"idx_{name}_date_id", "audit_date", "audit_id"),
+            Index(f"idx_{name}_table_date_id", "table_name", "audit_date", "audit_id"),
+            Index(f"idx_{name}_user_date_id", "username", "audit_date", "audit_id"),
+        )
+        _archive_tables[year] = table
+    return table
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """alembic hook: archive tables are managed here, not by migrations."""
+    return not (type_ == "table" and name.startswith(ARCHIVE_PREFIX))
+
+
+def compress_payload(value):
+    if value is None:
+        return None
+    return zlib.compress(value.encode("utf-8"), 6)
+
+
+def decompress_payload(value):
+    if value is None:
+        return None
+    return zlib.decompress(value).decode("utf-8")
+
+
+def archived_years(bind):
+    """Years that have an archive table, newest first (cached for ARCHIVED_YEARS_TTL)."""
+    if _archived_years["years"] is None or time.monotonic() - _archived_years["at"] > ARCHIVED_YEARS_TTL:
+        years = []
+        for name in inspect(bind).get_table_names():
+            suffix = name[len(ARCHIVE_PREFIX):]
+            if name.startswith(ARCHIVE_PREFIX) and suffix.isdigit():
+                years.append(int(suffix))
+        _archived_years["years"] = sorted(years, reverse=True)
+        _archived_years["at"] = time.monotonic()
+    return _archived_years["years"]
+
+
+def _add_to_rollup(conn, counts):
+    rollup = AuditingDailyRollup.__table__
+    for (audit_day, table_name, username, action), n in counts.items():
+        key = and_(
+            rollup.c.audit_day == audit_day,
+            rollup.c.table_name == table_name,
+            rollup.c.username == username,
+            rollup.c.action == action,
+        )
+        result = conn.execute(update(rollup).where(key).values(entry_count=rollup.c.entry_count + n))
+        if result.rowcount == 0:
+            conn.execute(rollup.insert().values(
+                audit_day=audit_day, table_name=table_name, username=username, action=action, entry_count=n,
+            ))
+
+
+def archive_audit_entries(engine, retention_days=AUDIT_RETENTION_DAYS, batch_size=AUDIT_ARCHIVE_BATCH_SIZE,
+                          rollup=True, dry_run=False):
+    """
+    Move auditing rows dated before midnight `retention_days` ago into the
+    archive tables, one transaction per batch of `batch_size` rows (oldest
+    audit_id first), so an interrupted run can simply be started again.
+    """
+    live = Auditing.__table__
+    cutoff = datetime.combine(datetime.now().date() - timedelta(days=retention_days), datetime.min.time())
+    stats = {"cutoff": cutoff.isoformat(), "dry_run": dry_run, "moved": 0, "batches": 0, "years": set()}
+
+    if dry_run:
+        with engine.connect() as conn:
+            stats["moved"] = conn.execute(
+                select(func.count()).select_from(live).where(live.c.audit_date < cutoff)
+            ).scalar()
+        stats["years"] = []
+        return stats
+
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(live)
+                .where(live.c.audit_date < cutoff)
+                .order_by(live.c.audit_id)
+                .limit(batch_size)
+            ).mappings().all()
+            if not rows:
+                break
+
+            by_year = {}
+            counts = Counter()
+            for row in rows:
+                by_year.setdefault(row["audit_date"].year, []).append({
+                    "audit_id": row["audit_id"],
+                    "username": row["username"],
+                    "audit_date": row["audit_date"],
+                    "action": row["action"],
+                    "table_name": row["table_name"],
+                    "old_data": compress_payload(row["old_data"]),
+                    "new_data": compress_payload(row["new_data"]),
+                })
+                counts[(row["audit_date"].date(), row["table_name"], row["username"], row["action"])] += 1
+
+            for year, year_rows in by_year.items():
+                table = archive_table(year)
+                table.create(conn, checkfirst=True)
+                conn.execute(table.insert(), year_rows)
+                stats["years"].add(year)
+
+            if rollup:
+                _add_to_rollup(conn, counts)
+
+            # every row below cutoff up to the batch's last id was selected above
+            conn.execute(live.delete().where(
+                live.c.audit_id <= rows[-1]["audit_id"],
+                live.c.audit_date < cutoff,
+            ))
+        stats["moved"] += len(rows)
+        stats["batches"] += 1
+
+    _archived_years["years"] = None
+    stats["years"] = sorted(stats["years"])
+    return stats
@@ -0,0 +1,179 @@
+"""
+Per-commit audit capture overhead: the old before_commit walk vs audit.capture_changes.
+
+Builds the session state of the two hot flows on an in-memory SQLite copy of
+the schema and times "capture + JSON encode" for each, without committing:
+
+  new-bill        GuageBill insert, Gauge.final_reading update, three
+                  TechnologyBill allocation updates (the three commits of /new-bill)
+  edit-tech-bill  one TechnologyBill with water/chemicals/ranges edited and
+                  two sibling percentages recomputed
+
+Run from the repository root:
+
+    python benchmarks/bench_audit_capture.py --iterations 5000
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import Session
+
+from models import db, Gauge, GuageBill, TechnologyBill
+from audit import capture_changes, dump_audit_data, precompute_mapper_infos
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  Legacy capture (main.before_commit before the change, kept for comparison)
+# ═══════════════════════════════════════════════════════════════════════════
+
+def legacy_capture(session, username):
+    audit_entries = []
+    for obj in session.new:
+        if hasattr(obj, '__tablename__') and obj.__tablename__ != 'auditing':
+            new_data = {col.name: getattr(obj, col.name) for col in obj.__table__.columns}
+            audit_entries.append({'username': username, 'action': 'INSERT', 'table_name': obj.__tablename__,
+                                  'old_data': None, 'new_data': new_data})
+    for obj in session.dirty:
+        if hasattr(obj, '__tablename__') and obj.__tablename__ != 'auditing':
+            insp = inspect(obj)
+            if not insp.attrs:
+                continue
+            old_data = {}
+            new_data = {}
+            pk_values = {key.name: getattr(obj, key.name) for key in inspect(obj.__class__).primary_key}
+            for attr in insp.attrs:
+                hist = attr.history
+                if hist.has_changes():
+                    old_data[attr.key] = hist.deleted[0] if hist.deleted else None
+                    new_data[attr.key] = hist.added[0] if hist.added else None
+            if old_data or new_data:
+                old_data.update(pk_values)
+                new_data.update(pk_values)
+                audit_entries.append({'username': username, 'action': 'UPDATE', 'table_name': obj.__tablename__,
+                                      'old_data': old_data, 'new_data': new_data})
+    for obj in session.deleted:
+        if hasattr(obj, '__tablename__') and obj.__tablename__ != 'auditing':
+            state = inspect(obj)
+            old_data = {col.name: state.dict.get(col.name) for col in obj.__table__.columns}
+            audit_entries.append({'username': username, 'action': 'DELETE', 'table_name': obj.__tablename__,
+                                  'old_data': old_data, 'new_data': None})
+    return audit_entries
+
+
+def legacy_encode(entries):
+    # the old code used plain json.dumps, which raises on Decimal; default=str keeps it comparable
+    for entry in entries:
+        json.dumps(entry["old_data"], ensure_ascii=False, default=str) if entry["old_data"] else None
+        json.dumps(entry["new_data"], ensure_ascii=False, default=str) if entry["new_data"] else None
+
+
+def new_encode(entries):
+    for entry in entries:
+        dump_audit_data(entry["old_data"])
+        dump_audit_data(entry["new_data"])
+
+
+# ═══════════════════════════════════════════════════════════════════════════
+#  Scenarios
+# ═══════════════════════════════════════════════════════════════════════════
+
+def seed(session):
+    session.add(Gauge(account_number="100200300", meter_id="M-1", meter_factor=40,
+                      final_reading=15230.0, voltage_id=1))
+    for tech_id in (1, 2, 3):
+        session.add(TechnologyBill(
+            tech_bill_id=tech_id, bill_month=5, bill_year=2025, station_id=7, technology_id=tech_id,
+            technology_bill_percentage=33.3, technology_power_consump=1200.0,
+            technology_water_amount=54000.0, technology_bill_total=Decimal("18350.2500"),
+            technology_chlorine_consump=120.0, technology_solid_alum_consump=800.0,
+            technology_liquid_alum_consump=0.0,
+        ))
+    session.commit()
+
+
+def insert_bill(session):
+    session.add(GuageBill(
+        account_number="100200300", bill_month=6, bill_year=2025, prev_reading=15230.0,
+        current_reading=15890.0, reading_factor=40, power_consump=26400.0, voltage_id=1,
+        voltage_cost="1.94", consump_cost=Decimal("51216.0000"), fixed_installment=Decimal("0"),
+        settlements=Decimal("0"), settlement_qty=0.0, stamp=Decimal("12.5000"),
+        prev_payments=Decimal("0"), rounding=0.0, bill_total=Decimal("51228.5000"), is_paid=False,
+    ))
+
+
+def update_reading(session):
+    session.get(Gauge, "100200300").final_reading = 15890.0
+
+
+def allocate(session):
+    # load first: a get() between edits would autoflush the earlier ones out of session.dirty
+    tech_bills = [session.get(TechnologyBill, (5, 2025, 7, t)) for t in (1, 2, 3)]
+    for tb in tech_bills:
+        tb.technology_power_consump = tb.technology_power_consump + 8800.0
+        tb.technology_bill_total = tb.technology_bill_total + Decimal("17076.1666")
+
+
+def edit_tech_bill(session):
+    tech_bills = [session.get(TechnologyBill, (5, 2025, 7, t)) for t in (1, 2, 3)]
+    tb = tech_bills[0]
+    tb.technology_water_amount = 61000.0
+    tb.technology_chlorine_consump = 140.0
+    tb.technology_solid_alum_consump = 900.0
+    tb.power_per_water = 0.02
+    tb.chlorine_range_from, tb.chlorine_range_to = 1.5, 3.0
+    tb.solid_alum_range_from, tb.solid_alum_range_to = 10.0, 20.0
+    for sibling in tech_bills:
+        sibling.technology_bill_percentage = 38.0 if sibling is tb else 31.0
+
+
+FLOWS = {
+    "new-bill": [("insert bill", insert_bill), ("final_reading", update_reading), ("allocations", allocate)],
+    "edit-tech-bill": [("edit + percentages", edit_tech_bill)],
+}
+
+
+def time_capture(session, capture, encode, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        encode(capture(session))
+    return (time.perf_counter() - start) / iterations
+
+
+def run(iterations):
+    engine = create_engine("sqlite://")
+    db.metadata.create_all(engine)
+    precompute_mapper_infos(db.Model)
+    with Session(engine) as session:
+        seed(session)
+
+    print(f"{'flow':<16}{'commit':<22}{'entries':>8}{'legacy µs':>12}{'new µs':>10}{'speedup':>9}")
+    for flow, commits in FLOWS.items():
+        legacy_total = new_total = 0.0
+        for name, apply_changes in commits:
+            with Session(engine) as session:
+                apply_changes(session)
+                entries = capture_changes(session, "bench")
+                legacy = time_capture(session, lambda s: legacy_capture(s, "bench"), legacy_encode, iterations)
+                new = time_capture(session, lambda s: capture_changes(s, "bench"), new_encode, iterations)
+                session.rollback()
+            legacy_total += legacy
+            new_total += new
+            print(f"{flow:<16}{name:<22}{len(entries):>8}{legacy * 1e6:>12.1f}{new * 1e6:>10.1f}"
+                  f"{legacy / new:>8.1f}x")
+        print(f"{flow:<16}{'per request':<22}{'':>8}{legacy_total * 1e6:>12.1f}{new_total * 1e6:>10.1f}"
+              f"{legacy_total / new_total:>8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    run(args.iterations)
@@ -0,0 +1,209 @@
+"""
+Chart rendering cost: every chart in charts.py on synthetic series of
+--points lengths (12, 120 and 600 by default), without a database.
+
+  consumption   /analysis-single, four matplotlib twin-axis charts
+  prediction    /prediction, seaborn regplot
+  balance       /balance-plot-calc, demand vs capacity lines
+  financial     /financial-analysis, five plotly sunbursts in one HTML page
+                (points = station technologies in the hierarchy)
+
+For each chart and length: median render time over --runs, size of the
+encoded payload (base64 PNGs or HTML) and peak Python allocation of one
+render (tracemalloc, in a separate render).  Figures still open afterwards
+are reported too; there should be none.
+
+    python benchmarks/bench_charts.py --save         # write the baseline
+    python benchmarks/bench_charts.py                # compare against it
+
+Comparing exits with status 1 when render time grows by more than
+--tolerance (and more than --min-delta-ms), or payload size or peak memory by
+more than --size-tolerance, and with status 2 when there is no baseline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import pandas as pd
+
+import charts
+from lazy_imports import plt
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "chart_baseline.json")
+
+
+def consumption_frame(n, rng):
+    date = pd.date_range(end="2025-12-01", periods=n, freq="MS")
+    water = rng.uniform(500_000, 2_000_000, n)
+    chlorine_from = np.where(date.month.isin(range(4, 11)), 3.0, 2.5)
+    alum_from = np.where(date.month.isin(range(4, 11)), 22.0, 26.0)
+    return pd.DataFrame({
+        "date": date,
+        "technology_water_amount": water,
+        "technology_power_consump": water * rng.uniform(0.22, 0.3, n),
+        "power_per_water": np.full(n, 0.25),
+        "technology_chlorine_consump": water * rng.uniform(2.5, 5.0, n),
+        "chlorine_range_from": chlorine_from,
+        "chlorine_range_to": chlorine_from * 1.5,
+        "technology_solid_alum_consump": water * rng.uniform(20, 40, n),
+        "solid_alum_range_from": alum_from,
+        "solid_alum_range_to": alum_from * 1.4,
+        "technology_liquid_alum_consump": water * rng.uniform(20, 40, n),
+        "liquid_alum_range_from": alum_from,
+        "liquid_alum_range_to": alum_from * 1.4,
+    })
+
+
+def prediction_frame(n, rng):
+    time_index = np.arange(2025 * 12 - n + 1, 2025 * 12 + 1)
+    trend = np.linspace(1_000_000, 1_400_000, n)
+    return pd.DataFrame({
+        "time_index": time_index,
+        "technology_water_amount": trend * rng.normal(1, 0.05, n),
+    })
+
+
+def balance_frame(n, rng):
+    year = np.arange(2025, 2025 + n)
+    need = 40_000 * 1.02 ** (year - 2025)
+    return pd.DataFrame({
+        "year": year,
+        "Q_demanded_monthly_avg": need * 1.2,
+        "current_production": np.full(n, 55_000.0),
+        "max_production": np.full(n, 70_000.0),
+    })
+
+
+def financial_frame(n, rng):
+    rows = []
+    for i in range(n):
+        water = rng.uniform(100_000, 2_000_000)
+        rows.append({
+            "branch_name": f"فرع {i % max(1, n // 20) + 1}",
+            "station_name": f"محطة {i // 2 + 1}",
+            "technology_name": ("مرشحات سريعة", "وحدات مدمجة")[i % 2],
+            "technology_water_amount": water,
+            "technology_power_consump": water * 0.25,
+            "technology_chlorine_consump": water * 3.0,
+            "technology_liquid_alum_consump": water * 25.0,
+            "technology_solid_alum_consump": water * 10.0,
+        })
+    return pd.DataFrame(rows)
+
+
+CHARTS = {
+    "consumption": (consumption_frame, charts.consumption_charts),
+    "prediction": (prediction_frame, charts.prediction_chart),
+    "balance": (balance_frame, lambda df: charts.balance_chart(df, "منطقة 1", "equation")),
+    "financial": (financial_frame, charts.financial_dashboard_html),
+}
+
+
+def payload_size(result):
+    if isinstance(result, dict):
+        return sum(len(v) for v in result.values())
+    return len(result)
+
+
+def measure(name, n, runs, seed):
+    make_frame, render = CHARTS[name]
+    frame = make_frame(n, np.random.default_rng(seed))
+
+    timings = []
+    for _ in range(runs):
+        df = frame.copy()   # financial_dashboard_html converts units in place
+        start = time.perf_counter()
+        result = render(df)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    render(frame.copy())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "render_ms": round(statistics.median(timings), 3),
+        "min_ms": round(min(timings), 3),
+        "payload_kb": round(payload_size(result) / 1024, 1),
+        "peak_kb": round(peak / 1024, 1),
+        "open_figures": len(plt.get_fignums()),
+    }
+
+
+def compare(baseline, current, tolerance, size_tolerance, min_delta_ms):
+    problems = []
+    for key, r in current.items():
+        b = baseline.get(key)
+        if b is None:
+            continue
+        if r["render_ms"] > b["render_ms"] * (1 + tolerance) and r["render_ms"] - b["render_ms"] > min_delta_ms:
+            problems.append(f"{key}: render {b['render_ms']:.1f}ms -> {r['render_ms']:.1f}ms")
+        if r["payload_kb"] > b["payload_kb"] * (1 + size_tolerance):
+            problems.append(f"{key}: payload {b['payload_kb']:.0f}KB -> {r['payload_kb']:.0f}KB")
+        if r["peak_kb"] > b["peak_kb"] * (1 + size_tolerance):
+            problems.append(f"{key}: peak memory {b['peak_kb']:.0f}KB -> {r['peak_kb']:.0f}KB")
+        if r["open_figures"] > b["open_figures"]:
+            problems.append(f"{key}: {r['open_figures']} figures left open")
+    return problems
+
+
+def run(args):
+    names = args.charts.split(",") if args.charts else list(CHARTS)
+    current = {}
+    print(f"{'chart':<24}{'render ms':>11}{'min ms':>10}{'payload KB':>12}{'peak KB':>11}{'open figs':>11}")
+    for name in names:
+        for n in [int(p) for p in args.points.split(",")]:
+            key = f"{name}:{n}"
+            r = current[key] = measure(name, n, args.runs, args.seed)
+            print(f"{key:<24}{r['render_ms']:>11.1f}{r['min_ms']:>10.1f}{r['payload_kb']:>12.1f}"
+                  f"{r['peak_kb']:>11.0f}{r['open_figures']:>11}")
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.platform(),
+                "runs": args.runs,
+                "results": current,
+            }, f, indent=2)
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --save first", file=sys.stderr)
+        return 2
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    problems = compare(baseline, current, args.tolerance, args.size_tolerance, args.min_delta_ms)
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    if not problems:
+        print("no regressions against the baseline")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--points", default="12,120,600", help="Comma separated series lengths.")
+    parser.add_argument("--charts", help=f"Comma separated subset of {', '.join(CHARTS)}.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed render time increase (0.25 = 25%%).")
+    parser.add_argument("--size-tolerance", type=float, default=0.10)
+    parser.add_argument("--min-delta-ms", type=float, default=5.0)
+    sys.exit(run(parser.parse_args()))
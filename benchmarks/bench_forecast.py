@@ -0,0 +1,143 @@
+"""
+Forecast pipeline cost per stage: wall time, CPU time and peak memory of each
+stage of water_demand_forecast.run_forecast on synthetic multi-area frames.
+
+Every --areas x --months combination gets a frame shaped like the one
+/balance-plot-calc builds (year, month, total_water, population, area_id,
+total_capacity): population growing at a per-area rate, a summer peak and
+noise, so the model race, tuning and saturation search all have real work
+to do.  Stages are timed through run_forecast's stage_hook; the model files
+it saves go to a temporary directory instead of the working tree.
+
+    python benchmarks/bench_forecast.py --areas 10,100 --months 24,120
+    python benchmarks/bench_forecast.py --areas 2000 --months 240 --no-memory --json forecast.json
+
+Peak memory comes from tracemalloc, which slows numpy/sklearn-heavy stages
+down; --no-memory gives cleaner timings.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+import water_demand_forecast
+
+
+def synthetic_frame(n_areas, n_months, seed=42, end_year=2025):
+    """One row per area and month, ending December of end_year."""
+    rng = np.random.default_rng(seed)
+    n_years = -(-n_months // 12)
+    months = [(y, m) for y in range(end_year - n_years + 1, end_year + 1) for m in range(1, 13)][-n_months:]
+    t = np.arange(n_months)
+    month = np.array([m for _, m in months])
+    season = 1 + 0.2 * np.sin(2 * np.pi * (month - 4) / 12)   # summer peak
+
+    frames = []
+    for area_id in range(1, n_areas + 1):
+        base_pop = rng.uniform(5_000, 500_000)
+        growth = rng.uniform(0.01, 0.03) / 12
+        population = base_pop * (1 + growth) ** t
+        per_capita = rng.uniform(0.12, 0.2) * 30   # m3 per person per month
+        water = population * per_capita * season * rng.normal(1, 0.04, n_months)
+        capacity = water.max() * rng.uniform(1.1, 1.8)
+        frames.append(pd.DataFrame({
+            "year": [y for y, _ in months],
+            "month": month,
+            "total_water": water,
+            "population": population.round(),
+            "area_id": area_id,
+            "total_capacity": capacity,
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+class StageTimer:
+    """stage_hook for run_forecast: closes the running stage and opens the next."""
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.stages = {}
+        self._current = None
+
+    def __call__(self, name):
+        now_wall, now_cpu = time.perf_counter(), time.process_time()
+        if self._current is not None:
+            stage, wall, cpu = self._current
+            peak = tracemalloc.get_traced_memory()[1] if self.memory else 0
+            self.stages[stage] = {
+                "wall_s": now_wall - wall,
+                "cpu_s": now_cpu - cpu,
+                "peak_mb": peak / 1024 / 1024,
+            }
+        if self.memory:
+            tracemalloc.reset_peak()
+        self._current = (name, time.perf_counter(), time.process_time()) if name else None
+
+
+def run_once(df, memory):
+    capacities = df.groupby("area_id")["total_capacity"].first().to_dict()
+    timer = StageTimer(memory)
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = water_demand_forecast.run_forecast(df, capacities, requested_area_id=1, stage_hook=timer)
+    finally:
+        if memory:
+            tracemalloc.stop()
+    return timer.stages, time.perf_counter() - start, result["best_model"]
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        water_demand_forecast.MODEL_PATH = os.path.join(tmp, "water_model.pkl")
+        water_demand_forecast.METADATA_PATH = os.path.join(tmp, "water_model_meta.pkl")
+
+        report = []
+        for n_areas in [int(a) for a in args.areas.split(",")]:
+            for n_months in [int(m) for m in args.months.split(",")]:
+                df = synthetic_frame(n_areas, n_months, seed=args.seed)
+                runs = [run_once(df, not args.no_memory) for _ in range(args.runs)]
+                stages = {
+                    name: {key: statistics.median(r[0][name][key] for r in runs)
+                           for key in ("wall_s", "cpu_s", "peak_mb")}
+                    for name in runs[0][0]
+                }
+                total = statistics.median(r[1] for r in runs)
+                report.append({"areas": n_areas, "months": n_months, "rows": len(df), "total_s": total,
+                               "best_model": runs[-1][2], "stages": stages})
+
+                print(f"\n{n_areas} areas x {n_months} months ({len(df)} rows): {total:.2f}s, best {runs[-1][2]}")
+                print(f"  {'stage':<22}{'wall s':>10}{'cpu s':>10}{'share':>8}{'peak MB':>10}")
+                for name, s in stages.items():
+                    print(f"  {name:<22}{s['wall_s']:>10.3f}{s['cpu_s']:>10.3f}{s['wall_s'] / total:>8.1%}"
+                          f"{s['peak_mb']:>10.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nresults written to {args.json}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--areas", default="10,50", help="Comma separated area counts (10 to 2000).")
+    parser.add_argument("--months", default="24,60", help="Comma separated month counts (12 to 240).")
+    parser.add_argument("--runs", type=int, default=1, help="Runs per combination; stage medians are reported.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-memory", action="store_true", help="Skip tracemalloc.")
+    parser.add_argument("--json", help="Also write the results to this file.")
+    run(parser.parse_args())
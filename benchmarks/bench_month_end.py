@@ -0,0 +1,254 @@
+"""
+Month-end write throughput: concurrent bill entry through the real routes.
+
+Generates a dataset with datagen.py, then replays the month(s) after its
+last bill month the way the clerks enter them at month close, through the
+Flask test client from --threads client threads:
+
+  1. /new-bill/<account_number>     for every metered gauge
+  2. /insert-or-edit-tech-bill      water and chemicals for every station technology
+  3. /new-bill/<account_number>     for the intake (is_source) gauges, which
+                                    need the water amounts of step 2
+
+Each station is replayed in that order by one thread; threads take stations
+from a shared queue, so different stations' writes run concurrently and
+contend on the same tables.  Reported: sustained requests/second, latency
+percentiles per endpoint, status codes, lock timeouts and deadlocks (counted
+from the engine's handle_error event), and gauges whose final_reading does
+not match the bill just entered (lost updates).  With ALLOCATION_ASYNC the
+technology bill allocation runs as background jobs (jobs.py); the run waits
+for the queue to drain and reports how long that took after the last
+response (--inline-allocation compares with allocating inside the requests).
+
+    python benchmarks/bench_month_end.py --scale 4 --threads 8
+    python benchmarks/bench_month_end.py --url mssql+pyodbc://... --threads 16   # empty database
+
+SQLite serialises writers, so its numbers mostly show lock waits; point --url
+at an empty SQL Server database for production-like concurrency.
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("FLASK_KEY", "bench-month-end-secret-key-0123456789")
+
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+
+import main
+from datagen import create_tables, generate_dataset, GEN_DATA_END_YEAR
+from models import db, Group, User, Gauge, Voltage, StationGaugeTechnology, GuageBill
+
+LOCK_MARKERS = {
+    "deadlock": ("deadlock", "(1205)"),
+    "lock_timeout": ("database is locked", "lock request time out", "(1222)"),
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[k]
+
+
+class LockCounter:
+    """Counts DBAPI errors that are lock timeouts or deadlocks."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def handle_error(self, context):
+        text = str(context.original_exception).lower()
+        for kind, markers in LOCK_MARKERS.items():
+            if any(marker in text for marker in markers):
+                with self._lock:
+                    self.counts[kind] += 1
+                return
+        with self._lock:
+            self.counts["other_db_errors"] += 1
+
+
+def build_app(args, workdir):
+    uri = args.url or "sqlite:///" + os.path.join(workdir, "bench_month_end.db")
+    app = main.create_app({
+        "SQLALCHEMY_DATABASE_URI": uri,
+        "SLOW_QUERY_LOG_FILE": None,
+        "DB_POOL_SIZE": args.threads,
+        "ALLOCATION_ASYNC": not args.inline_allocation,
+    })
+    app.logger.setLevel(logging.CRITICAL)
+    with app.app_context():
+        create_tables(db.engine)
+        generate_dataset(db.engine, scale=args.scale, seed=args.seed, years=args.years)
+        db.session.add(Group(group_id=1, group_name="admin"))
+        db.session.add(User(emp_code="B0000001", emp_name="bench", username="bench",
+                            userpassword=generate_password_hash("bench"), group_id=1, is_active=True))
+        db.session.commit()
+    return app
+
+
+def gauge_bill_payload(gauge, voltage, reading, year, month, rng):
+    diff = rng.randint(200, 5000)
+    current = reading + diff
+    power = diff * gauge.meter_factor
+    stamp = Decimal("1.80")
+    rounding = round(rng.uniform(-0.99, 0.99), 2)
+    total = (Decimal(str(diff)) * Decimal(str(gauge.meter_factor)) * Decimal(str(voltage.voltage_cost))
+             + Decimal(str(voltage.fixed_fee)) + stamp + Decimal(str(rounding)))
+    return current, {
+        "bill_month": month, "bill_year": year,
+        "prev_reading": reading, "current_reading": current,
+        "reading_factor": gauge.meter_factor, "power_consump": power,
+        "fixed_installment": 0, "settlements": 0, "settlement_qty": 0, "stamp": float(stamp),
+        "prev_payments": 0, "rounding": rounding, "bill_total": float(round(total, 2)),
+        "is_paid": False, "notes": None, "delay_month": None, "delay_year": None,
+    }
+
+
+def month_end_plan(app, months, seed):
+    """{station_id: [(endpoint, path, body), ...]} in entry order, plus {account_number: expected final reading}."""
+    rng = random.Random(seed)
+    end_year = GEN_DATA_END_YEAR
+    periods = [(end_year + 1 + m // 12, m % 12 + 1) for m in range(months)]   # January onwards after the dataset
+
+    with app.app_context():
+        voltages = {v.voltage_id: v for v in db.session.query(Voltage)}
+        gauges = {g.account_number: g for g in db.session.query(Gauge)}
+        relations = db.session.query(StationGaugeTechnology).filter(
+            StationGaugeTechnology.relation_status == True).order_by(
+            StationGaugeTechnology.station_id, StationGaugeTechnology.technology_id).all()
+        relations = [(r.station_id, r.technology_id, r.account_number, r.is_source) for r in relations]
+        readings = {a: g.final_reading for a, g in gauges.items()}
+
+        plan = defaultdict(list)
+        for year, month in periods:
+            metered, techs, intakes = defaultdict(list), defaultdict(list), defaultdict(list)
+            for station_id, technology_id, account_number, is_source in relations:
+                target = intakes if is_source else metered
+                if account_number not in target[station_id]:
+                    target[station_id].append(account_number)
+                if not is_source and technology_id not in techs[station_id]:
+                    techs[station_id].append(technology_id)
+
+            for station_id in sorted(set(metered) | set(intakes)):
+                for account_number in metered[station_id] + ["intake"] + intakes[station_id]:
+                    if account_number == "intake":
+                        for technology_id in techs[station_id]:
+                            water = rng.randint(50_000, 2_000_000)
+                            measured = rng.randint(water // 2, water)
+                            plan[station_id].append(("tech-bill", "/insert-or-edit-tech-bill", {
+                                "bill_year": year, "bill_month": month,
+                                "station_id": station_id, "technology_id": technology_id,
+                                "technology_water_amount": water, "measured_water": measured,
+                                "calculated_water": water - measured,
+                                "technology_chlorine_consump": round(water * 3e-6, 3),
+                                "technology_liquid_alum_consump": round(water * 25e-6, 3),
+                                "technology_solid_alum_consump": 0,
+                            }))
+                        continue
+                    gauge = gauges[account_number]
+                    readings[account_number], body = gauge_bill_payload(
+                        gauge, voltages[gauge.voltage_id], readings[account_number], year, month, rng)
+                    endpoint = "intake-bill" if account_number in intakes[station_id] else "new-bill"
+                    plan[station_id].append((endpoint, f"/new-bill/{account_number}", body))
+    return plan, readings
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        app = build_app(args, workdir)
+        locks = LockCounter()
+        with app.app_context():
+            event.listen(db.engine, "handle_error", locks.handle_error)
+        plan, expected = month_end_plan(app, args.months, args.seed)
+        n_requests = sum(len(steps) for steps in plan.values())
+        print(f"dataset scale {args.scale} ready in {time.perf_counter() - start:.1f}s; "
+              f"replaying {n_requests} requests over {len(plan)} stations with {args.threads} threads")
+
+        token = app.test_client().post("/login", json={"username": "bench", "password": "bench"}).get_json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        stations = queue.Queue()
+        for station_id in plan:
+            stations.put(station_id)
+        latencies = defaultdict(list)
+        statuses = Counter()
+        results_lock = threading.Lock()
+
+        def clerk():
+            client = app.test_client()
+            while True:
+                try:
+                    station_id = stations.get_nowait()
+                except queue.Empty:
+                    return
+                for endpoint, path, body in plan[station_id]:
+                    t0 = time.perf_counter()
+                    response = client.post(path, json=body, headers=headers)
+                    elapsed = (time.perf_counter() - t0) * 1000
+                    with results_lock:
+                        latencies[endpoint].append(elapsed)
+                        statuses[(endpoint, response.status_code)] += 1
+
+        threads = [threading.Thread(target=clerk) for _ in range(args.threads)]
+        # the routes print a lot; sys.stdout is process-wide, so silence it around all threads at once
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            t_start = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            wall = time.perf_counter() - t_start
+            main.allocation_queue.wait()
+            drained = time.perf_counter() - t_start
+
+        main.audit_writer.flush()   # before the temporary database goes away
+        with app.app_context():
+            finals = dict(db.session.query(Gauge.account_number, Gauge.final_reading))
+            lost = sum(1 for a, reading in expected.items() if finals.get(a) != reading)
+            bills = db.session.query(GuageBill).filter(GuageBill.bill_year > GEN_DATA_END_YEAR).count()
+            db.engine.dispose()
+
+    all_latencies = sorted(x for values in latencies.values() for x in values)
+    print(f"\n{n_requests} requests in {wall:.2f}s: {n_requests / wall:.1f} req/s sustained")
+    print(f"  {'endpoint':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for endpoint, values in sorted(latencies.items()) + [("all", all_latencies)]:
+        values = sorted(values)
+        print(f"  {endpoint:<14}{len(values):>8}{percentile(values, 50):>10.1f}{percentile(values, 95):>10.1f}"
+              f"{percentile(values, 99):>10.1f}{values[-1]:>10.1f}")
+    print("  status codes: " + ", ".join(f"{e} {s}: {n}" for (e, s), n in sorted(statuses.items())))
+    print(f"  deadlocks: {locks.counts['deadlock']}, lock timeouts: {locks.counts['lock_timeout']}, "
+          f"other DB errors: {locks.counts['other_db_errors']}")
+    print(f"  gauge bills stored: {bills}, gauges with a lost final_reading update: {lost}")
+    jobs = main.allocation_queue.stats()
+    if jobs["async"]:
+        print(f"  allocation jobs: {jobs['done']} done, {jobs['failed']} failed, {jobs['retried']} retries; "
+              f"queue drained {drained - wall:.2f}s after the last response")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=2, help="gen-data scale of the dataset.")
+    parser.add_argument("--years", type=int, default=2, help="Years of history before the replayed month(s).")
+    parser.add_argument("--months", type=int, default=1, help="Month-ends to replay.")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", help="Empty target database (default: a temporary SQLite file).")
+    parser.add_argument("--inline-allocation", action="store_true",
+                        help="Allocate inside the requests (ALLOCATION_ASYNC off) instead of background jobs.")
+    run(parser.parse_args())
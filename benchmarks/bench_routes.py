@@ -0,0 +1,234 @@
+"""
+Route benchmarks: the real read routes through the Flask test client against
+generated SQLite datasets (datagen.py), one dataset per --scales entry.
+
+For every route it records latency percentiles over --runs requests (after
+--warmup), the SQL statement count (the X-Query-Count header set by
+metrics.py) and the peak Python allocation of one request (tracemalloc,
+measured in a separate request so it does not slow the timed ones).
+
+    python benchmarks/bench_routes.py --scales 1,4 --save        # write the baseline
+    python benchmarks/bench_routes.py --scales 1,4               # compare against it
+
+Comparing exits with status 1 when a route regresses against the baseline:
+p50 latency up by more than --tolerance (and by more than --min-delta-ms, so
+sub-millisecond noise is ignored), more SQL statements than before, or peak
+memory up by more than --memory-tolerance, and with status 2 when there is
+no baseline to compare against.  Latency baselines only mean something on
+the machine that wrote them; query counts are exact anywhere.
+
+Routes that use SQL Server functions (DATEFROMPARTS/EOMONTH in the balance
+calculation, for example) fail on SQLite; they are still listed with their
+status code, and a status change counts as a regression.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("FLASK_KEY", "bench-routes-secret-key-0123456789")
+
+from werkzeug.security import generate_password_hash
+
+import main
+from datagen import create_tables, generate_dataset
+from models import db, Group, User, StationGaugeTechnology, AreaOfService, PlaceType
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks", "route_baseline.json")
+# /financial-analysis reads bill_year 2025, so the dataset runs up to it
+BENCH_END_YEAR = 2025
+BENCH_SEED = 42
+
+REPORT_NAMES = [
+    "branch_per_month", "branch_total", "station_per_month", "station_total", "technology_per_month",
+    "technology_total", "station-bills", "water-techs-3-month", "sanity-techs-3-month", "bills",
+    "over_power_consumption", "over_chlorine_consumption", "over_solid_alum_consumption",
+    "over_liquid_alum_consumption", "power_for_zero_water", "all_anomalies_summary",
+]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values) + 0.5) - 1))
+    return sorted_values[k]
+
+
+def build_app(scale, workdir):
+    uri = "sqlite:///" + os.path.join(workdir, f"bench_routes_scale{scale}.db")
+    app = main.create_app({
+        "SQLALCHEMY_DATABASE_URI": uri,
+        "SLOW_QUERY_LOG_FILE": None,
+    })
+    app.logger.setLevel(logging.CRITICAL)   # failing routes show up by status code, not tracebacks
+    with app.app_context():
+        create_tables(db.engine)
+        generate_dataset(db.engine, scale=scale, seed=BENCH_SEED, end_year=BENCH_END_YEAR)
+        db.session.add(Group(group_id=1, group_name="admin"))
+        db.session.add(User(emp_code="B0000001", emp_name="bench", username="bench",
+                            userpassword=generate_password_hash("bench"), group_id=1, is_active=True))
+        db.session.commit()
+    return app
+
+
+def route_cases(app):
+    """(name, method, path, json body) for every benchmarked request."""
+    with app.app_context():
+        sgt = db.session.query(StationGaugeTechnology).order_by(
+            StationGaugeTechnology.station_id, StationGaugeTechnology.technology_id).first()
+        area = db.session.query(AreaOfService).filter(AreaOfService.stations.any()).order_by(
+            AreaOfService.area_id).first()
+        place_types = [p.place_type_id for p in db.session.query(PlaceType)]
+
+    period = {"from_date": f"{BENCH_END_YEAR - 1}-01-01", "to_date": f"{BENCH_END_YEAR}-12-31"}
+    cases = [
+        ("home", "GET", "/", None),
+        ("view-bills", "GET", "/view-bills", None),
+        ("gauges", "GET", "/gauges", None),
+        ("stg-relations", "GET", "/stg-relations", None),
+        ("analysis-single", "GET", f"/analysis-single/{sgt.station_id}/{sgt.technology_id}", None),
+        ("financial-analysis", "GET", "/financial-analysis", None),
+        ("prediction", "POST", f"/prediction/{sgt.station_id}", {}),
+        ("balance-plot-calc", "POST", f"/balance-plot-calc/{area.area_id}", {
+            "calc_type": "equation", "is_modified": False, "goal_year": BENCH_END_YEAR + 10, "increasable": 0,
+            **{str(t): 150 for t in place_types},
+        }),
+    ]
+    cases += [(f"reports:{name}", "POST", "/reports", {"report_name": name, **period}) for name in REPORT_NAMES]
+    return cases
+
+
+def measure_route(client, headers, method, path, body, runs, warmup):
+    def call():
+        # the routes print a lot; keep it out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            return client.open(path, method=method, json=body, headers=headers)
+
+    for _ in range(warmup):
+        call()
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = call()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "status": response.status_code,
+        "queries": int(response.headers.get("X-Query-Count", -1)),
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+        "max_ms": round(timings[-1], 3),
+        "peak_kb": round(peak / 1024, 1),
+        "bytes": response.calculate_content_length() or 0,
+    }
+
+
+def run_scale(scale, runs, warmup, only, workdir):
+    start = time.perf_counter()
+    app = build_app(scale, workdir)
+    print(f"scale {scale}: dataset ready in {time.perf_counter() - start:.1f}s")
+    print(f"  {'route':<40}{'code':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>8}{'peak KB':>11}")
+
+    client = app.test_client()
+    token = client.post("/login", json={"username": "bench", "password": "bench"}).get_json()["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    results = {}
+    for name, method, path, body in route_cases(app):
+        if only and not any(o in name for o in only):
+            continue
+        results[name] = measure_route(client, headers, method, path, body, runs, warmup)
+        r = results[name]
+        print(f"  {name:<40}{r['status']:>5}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+              f"{r['queries']:>8}{r['peak_kb']:>11.0f}")
+    with app.app_context():
+        db.engine.dispose()
+    return results
+
+
+def compare(baseline, current, tolerance, memory_tolerance, min_delta_ms):
+    """List of regression messages of current against baseline."""
+    problems = []
+    for scale, routes in current.items():
+        for name, r in routes.items():
+            b = baseline.get(scale, {}).get(name)
+            if b is None:
+                continue
+            label = f"scale {scale} {name}"
+            if r["status"] != b["status"]:
+                problems.append(f"{label}: status {b['status']} -> {r['status']}")
+            if r["p50_ms"] > b["p50_ms"] * (1 + tolerance) and r["p50_ms"] - b["p50_ms"] > min_delta_ms:
+                problems.append(f"{label}: p50 {b['p50_ms']:.1f}ms -> {r['p50_ms']:.1f}ms")
+            if r["queries"] > b["queries"]:
+                problems.append(f"{label}: {b['queries']} -> {r['queries']} SQL statements")
+            if r["peak_kb"] > b["peak_kb"] * (1 + memory_tolerance):
+                problems.append(f"{label}: peak memory {b['peak_kb']:.0f}KB -> {r['peak_kb']:.0f}KB")
+    return problems
+
+
+def run(args):
+    scales = [int(s) for s in args.scales.split(",")]
+    only = [o for o in (args.only or "").split(",") if o]
+    current = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale in scales:
+            current[str(scale)] = run_scale(scale, args.runs, args.warmup, only, workdir)
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "machine": platform.platform(),
+                "runs": args.runs,
+                "results": current,
+            }, f, indent=2, ensure_ascii=False)
+        print(f"baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}; run with --save first", file=sys.stderr)
+        return 2
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    problems = compare(baseline, current, args.tolerance, args.memory_tolerance, args.min_delta_ms)
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    if not problems:
+        print("no regressions against the baseline")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="1", help="Comma separated gen-data scales.")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--only", help="Comma separated substrings of route names to run.")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="Write the results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p50 latency increase (0.25 = 25%%).")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25)
+    parser.add_argument("--min-delta-ms", type=float, default=2.0)
+    sys.exit(run(parser.parse_args()))
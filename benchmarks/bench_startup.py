@@ -0,0 +1,82 @@
+"""
+Worker start-up cost: time and peak RSS of building the app in a fresh interpreter.
+
+Two modes are measured, each in its own subprocess so nothing is shared:
+
+  lazy   what a worker does now; the analytics stack stays unimported
+  eager  every lazy_imports module loaded before create_app(), i.e. the
+         cost of the old top-of-file imports
+
+FLASK_KEY and DB_URI are taken from the environment; when DB_URI is unset a
+throwaway SQLite file is used so the benchmark runs without SQL Server
+(numbers then exclude connecting to the real database).
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = r"""
+import json, resource, sys, time
+start = time.perf_counter()
+if {eager}:
+    import lazy_imports
+    lazy_imports.preload()
+import main
+main.create_app()
+elapsed = time.perf_counter() - start
+heavy = [m for m in ("numpy", "pandas", "matplotlib", "seaborn", "plotly", "sklearn", "arabic_reshaper", "bidi")
+         if m in sys.modules]
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(sys.modules),
+    "heavy": heavy,
+}}))
+"""
+
+
+def measure(eager, env):
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD.format(eager=eager)],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def run(runs):
+    env = dict(os.environ)
+    env.setdefault("FLASK_KEY", "bench-startup-secret-key-0123456789")
+    if "DB_URI" not in env:
+        env["DB_URI"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_startup.db")
+
+    results = {}
+    for mode, eager in (("eager", True), ("lazy", False)):
+        samples = [measure(eager, env) for _ in range(runs)]
+        results[mode] = {
+            "seconds": statistics.median(s["seconds"] for s in samples),
+            "max_rss_mb": statistics.median(s["max_rss_mb"] for s in samples),
+            "modules": samples[-1]["modules"],
+            "heavy": samples[-1]["heavy"],
+        }
+
+    print(f"{'mode':<8}{'import s':>10}{'max RSS MB':>12}{'modules':>9}  heavy modules loaded")
+    for mode, r in results.items():
+        print(f"{mode:<8}{r['seconds']:>10.2f}{r['max_rss_mb']:>12.1f}{r['modules']:>9}  {', '.join(r['heavy']) or '-'}")
+    eager, lazy = results["eager"], results["lazy"]
+    print(f"lazy saves {eager['seconds'] - lazy['seconds']:.2f}s and {eager['max_rss_mb'] - lazy['max_rss_mb']:.1f} MB per worker")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+    run(args.runs)
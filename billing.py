@@ -0,0 +1,466 @@
+"""
+Monthly bill import (`/bills/import`): the utility's statement for a month
+as CSV/XLSX, one row per meter.
+
+The whole file is validated in one vectorized pandas pass against the
+gauges, voltages and the month's existing bills (one query each) and the
+active relations in the topology index, with the same checks add_new_bill
+makes for a single bill:
+
+  409  gauge has no active station/technology relation
+  410  prev_reading != the gauge's final_reading
+  411  reading_factor != the gauge's meter_factor
+  412  bill_total differs from its items by more than 1 (after meter rollover)
+
+Rows that fail are reported with their spreadsheet row number; the valid
+ones are inserted together with their technology bill allocations (the
+same rules as add_new_bill) and the gauges' final_reading updates, all with
+executemany statements in the caller's transaction.  Existing technology
+bills get additive UPDATE ... SET x = x + :delta statements and
+final_reading moves with a compare-and-set (advance_final_readings), so an
+import running next to clerks entering the same month loses none of their
+writes; a gauge whose reading moved meanwhile fails the whole import.
+
+rollback_month() (`/bills/rollback`) takes a month's bills back out, for
+all gauges or one branch's, with set-based statements: the gauges'
+final_reading goes back to the bills' prev_reading, the bills are deleted
+and the technology bills those gauges feed (by any relation, active or not)
+lose their month's power and cost (rows that held nothing else, no water
+amount, are deleted).  Only their rows are touched, so other gauges'
+allocations survive relation changes made since the month; when a branch's
+technology bill is also fed by a gauge outside the branch the rollback is
+refused instead.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from sqlalchemy import select, and_, bindparam, exists, or_, delete, update
+
+from lazy_imports import np, pd
+from models import Gauge, Voltage, GuageBill, TechnologyBill, Station, StationGaugeTechnology, AllocationJob
+from allocation import add_to_tech_bills, INTAKE_REQUIRED_COLUMNS
+from topology import topology_cache
+
+REQUIRED_COLUMNS = ["account_number", "prev_reading", "current_reading", "reading_factor",
+                    "power_consump", "bill_total"]
+# columns a statement may leave out, with the value add_new_bill's form sends for an empty field
+OPTIONAL_COLUMNS = {
+    "fixed_installment": 0, "settlements": 0, "settlement_qty": 0, "stamp": 0,
+    "prev_payments": 0, "rounding": 0, "is_paid": False, "notes": None,
+    "delay_month": None, "delay_year": None,
+}
+NUMERIC_COLUMNS = REQUIRED_COLUMNS[1:] + ["fixed_installment", "settlements", "settlement_qty", "stamp",
+                                          "prev_payments", "rounding"]
+READING_CHECK_BATCH = 1000   # gauges per IN list when advance_final_readings re-reads their readings
+
+ERRORS = {
+    "missing_account": (400, "رقم الحساب غير موجود في الصف"),
+    "duplicate": (400, "رقم الحساب مكرر في الملف"),
+    "wrong_month": (400, "شهر أو سنة الفاتورة غير مطابقة لشهر الاستيراد"),
+    "unknown_gauge": (404, "رقم الحساب غير مسجل لدينا"),
+    "no_relation": (409, "هذا العداد غير مرتبط بمحطة، برجاء ربط العداد أولا"),
+    "exists": (400, "توجد فاتورة لهذا العداد عن نفس الشهر"),
+    "not_numeric": (400, "قيمة غير رقمية أو فارغة في الأعمدة: {}"),
+    "prev_reading": (410, "القراءة السابقة غير مطابقة لآخر قراءة مسجلة لدينا"),
+    "reading_factor": (411, "معامل العداد غير مطابق لبيانات العداد المسجلة لدينا"),
+    "bill_total": (412, "إجمالي الفاتورة غير مطابق لمجموع البنود المدخلة، برجاء مراجعة بنود الفاتورة وتعريفة الجهد لهذا العداد"),
+}
+
+
+def read_sheet(file_storage, required_columns, optional_columns, dtype=None):
+    """DataFrame of an uploaded .csv/.xlsx sheet with normalized column names and spreadsheet row numbers."""
+    filename = (file_storage.filename or "").lower()
+    if filename.endswith(".csv"):
+        df = pd.read_csv(file_storage.stream, dtype=dtype, encoding="utf-8-sig")
+    elif filename.endswith((".xlsx", ".xlsm")):
+        try:
+            df = pd.read_excel(file_storage.stream, dtype=dtype)
+        except ImportError as e:
+            raise ValueError(f"reading .xlsx needs openpyxl: {e}")
+    else:
+        raise ValueError("only .csv and .xlsx files are supported")
+
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    missing = [c for c in required_columns if c not in df.columns]
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(missing)}")
+    for column, default in optional_columns.items():
+        if column not in df.columns:
+            df[column] = default
+    df.index = df.index + 2   # spreadsheet row numbers, after the header row
+    return df
+
+
+def read_bill_file(file_storage):
+    """DataFrame of an uploaded .csv/.xlsx statement."""
+    return read_sheet(file_storage, REQUIRED_COLUMNS, OPTIONAL_COLUMNS, dtype={"account_number": str})
+
+
+def _decimal(value):
+    return Decimal(str(value))
+
+
+def bill_total_matches(row):
+    """add_new_bill's exact Decimal check, for the rows the float pass can't decide."""
+    calculated = (
+            _decimal(row.reading_diff) * _decimal(row.reading_factor) * _decimal(row.voltage_cost) +
+            _decimal(row.fixed_fee) + _decimal(row.fixed_installment) + _decimal(row.settlements) +
+            _decimal(row.stamp) - _decimal(row.prev_payments) + _decimal(row.rounding)
+    )
+    return int(calculated) - int(_decimal(row.bill_total)) in range(-1, 2)
+
+
+def validate_bills(session, df, bill_month, bill_year):
+    """
+    (valid rows, {row number: [(code, message), ...]}) for a statement frame.
+
+    Valid rows carry the gauge's voltage_id, voltage_cost and fixed_fee.
+    """
+    errors = defaultdict(list)
+
+    def fail(mask, key, *args):
+        code, message = ERRORS[key]
+        message = message.format(*args)
+        for row in df.index[mask]:
+            errors[row].append((code, message))
+
+    df = df.copy()
+    df["account_number"] = df["account_number"].astype("string").str.strip()
+    missing_account = df["account_number"].isna() | (df["account_number"] == "")
+    fail(missing_account, "missing_account")
+    fail(df["account_number"].duplicated(keep=False) & ~missing_account, "duplicate")
+    for column, expected in (("bill_month", bill_month), ("bill_year", bill_year)):
+        if column in df.columns:
+            fail(pd.to_numeric(df[column], errors="coerce") != expected, "wrong_month")
+
+    for column in NUMERIC_COLUMNS + ["delay_month", "delay_year"]:
+        df[column] = pd.to_numeric(df[column], errors="coerce")
+    not_numeric = df[NUMERIC_COLUMNS].isna()
+    for row in df.index[not_numeric.any(axis=1)]:
+        columns = ", ".join(not_numeric.columns[not_numeric.loc[row]])
+        errors[row].append((ERRORS["not_numeric"][0], ERRORS["not_numeric"][1].format(columns)))
+    df["is_paid"] = df["is_paid"].fillna(False).astype(str).str.strip().str.lower().isin(["1", "true", "yes", "نعم"])
+    df["notes"] = df["notes"].astype(object).where(df["notes"].notna(), None)
+
+    gauges = pd.DataFrame(session.execute(
+        select(Gauge.account_number, Gauge.meter_factor, Gauge.final_reading, Gauge.voltage_id,
+               Voltage.voltage_cost, Voltage.fixed_fee)
+        .join(Voltage, Gauge.voltage_id == Voltage.voltage_id)
+    ).all(), columns=["account_number", "meter_factor", "final_reading", "voltage_id", "voltage_cost",
+                      "fixed_fee"])
+    gauges["account_number"] = gauges["account_number"].astype("string")
+    topology = topology_cache.get()
+    billed = set(session.scalars(
+        select(GuageBill.account_number).where(GuageBill.bill_month == bill_month,
+                                               GuageBill.bill_year == bill_year)
+    ))
+
+    df = df.join(gauges.set_index("account_number"), on="account_number")
+    known = df["meter_factor"].notna()
+    fail(~known & ~missing_account, "unknown_gauge")
+    fail(known & ~df["account_number"].map(lambda account: bool(topology.relations(account))), "no_relation")
+    fail(known & df["account_number"].isin(billed), "exists")
+
+    checkable = known & ~not_numeric.any(axis=1)
+    fail(checkable & (df["prev_reading"] != df["final_reading"]), "prev_reading")
+    fail(checkable & (df["reading_factor"] != df["meter_factor"]), "reading_factor")
+
+    # meter rollover: a reading that went back wrapped around 10**digits(prev_reading) - 1
+    diff = df["current_reading"] - df["prev_reading"]
+    digits = df["prev_reading"].fillna(0).astype("int64").astype(str).str.len()
+    df["reading_diff"] = diff.where(diff >= 0, diff + (10.0 ** digits - 1))
+    calculated = (df["reading_diff"] * df["reading_factor"] * df["voltage_cost"] + df["fixed_fee"]
+                  + df["fixed_installment"] + df["settlements"] + df["stamp"] - df["prev_payments"]
+                  + df["rounding"])
+    gap = (np.trunc(calculated) - np.trunc(df["bill_total"])).abs()
+    # float truncation can only be one unit off the Decimal result, so only gaps of 1 or 2 need the exact check
+    wrong_total = checkable & (gap > 2)
+    borderline = df.index[checkable & gap.isin([1, 2])]
+    wrong_total.loc[borderline] = [not bill_total_matches(row) for row in df.loc[borderline].itertuples()]
+    fail(wrong_total, "bill_total")
+
+    valid = df[~df.index.isin(list(errors))]
+    return valid, dict(errors)
+
+
+def _add(bill, power, total):
+    if bill["technology_power_consump"] is None:
+        bill["technology_power_consump"] = power
+        bill["technology_bill_total"] = total
+    else:
+        bill["technology_power_consump"] += power
+        bill["technology_bill_total"] += total
+    bill["power_delta"] += power
+    bill["total_delta"] += total
+    bill["changed"] = True
+
+
+def advance_final_readings(session, readings):
+    """
+    Move gauges' final_reading from the reading their bill was checked
+    against to the bill's current_reading, with a compare-and-set
+    UPDATE ... WHERE final_reading = :prev per gauge, so a reading another
+    clerk advanced in the meantime is never overwritten.  readings are
+    (account_number, expected final_reading, current_reading) tuples;
+    returns the account numbers whose reading had moved on (nothing was
+    changed for them and the caller should roll back).
+    """
+    if not readings:
+        return []
+    gauges = Gauge.__table__
+    result = session.execute(
+        gauges.update().where(and_(
+            gauges.c.account_number == bindparam("b_account_number"),
+            gauges.c.final_reading == bindparam("b_expected"),
+        )).values(final_reading=bindparam("b_final_reading")),
+        [{"b_account_number": account_number, "b_expected": expected, "b_final_reading": current}
+         for account_number, expected, current in readings],
+    )
+    if (len(readings) == 1 or session.get_bind().dialect.supports_sane_multi_rowcount) \
+            and result.rowcount == len(readings):
+        return []
+    # a reading had moved, or executemany gave no reliable row count (pyodbc): look at what is stored
+    accounts = [account_number for account_number, _, _ in readings]
+    current = {}
+    for start in range(0, len(accounts), READING_CHECK_BATCH):   # SQL Server takes 2100 parameters at most
+        current.update(session.execute(select(Gauge.account_number, Gauge.final_reading).where(
+            Gauge.account_number.in_(accounts[start:start + READING_CHECK_BATCH]))).all())
+    return [account_number for account_number, expected, reading in readings
+            if current.get(account_number) != reading]
+
+
+def allocate(session, bills, bill_month, bill_year):
+    """
+    The month's technology bills after allocating bills (dicts of GuageBill
+    columns) the way add_new_bill does, as {(station_id, technology_id): row}.
+
+    Metered gauges go first, then the is_source intake gauges, whose split
+    needs every related technology bill to already have its water amount
+    and percentage; the ones distributed are marked is_distributed.  Rows
+    carry "new" and "changed" flags.
+    """
+    topology = topology_cache.get()
+    tech_bills = {}
+    for tb in session.execute(select(TechnologyBill.__table__).where(
+            TechnologyBill.bill_month == bill_month, TechnologyBill.bill_year == bill_year)).mappings():
+        row = {key: tb[key] for key in ("station_id", "technology_id", "technology_bill_percentage",
+                                        "technology_power_consump", "technology_bill_total",
+                                        "technology_water_amount")}
+        if row["technology_bill_total"] is not None:
+            row["technology_bill_total"] = Decimal(row["technology_bill_total"])
+        row.update(new=False, changed=False, power_delta=0, total_delta=Decimal(0))
+        tech_bills[(tb["station_id"], tb["technology_id"])] = row
+
+    def new_bill(station_id, technology_id, percentage):
+        row = tech_bills[(station_id, technology_id)] = {
+            "station_id": station_id, "technology_id": technology_id, "technology_bill_percentage": percentage,
+            "technology_power_consump": None, "technology_bill_total": None, "technology_water_amount": None,
+            "new": True, "changed": False, "power_delta": 0, "total_delta": Decimal(0),
+        }
+        return row
+
+    sgts_of = {bill["account_number"]: topology.relations(bill["account_number"]) for bill in bills}
+    metered = [b for b in bills if not sgts_of[b["account_number"]][0].is_source]
+    sources = [b for b in bills if sgts_of[b["account_number"]][0].is_source]
+
+    for bill in metered:
+        sgts = sgts_of[bill["account_number"]]
+        power, total = bill["power_consump"], bill["bill_total"]
+        if len(sgts) == 1:
+            station_id, technology_id = sgts[0].station_id, sgts[0].technology_id
+            current = tech_bills.get((station_id, technology_id)) or new_bill(station_id, technology_id, 100)
+            _add(current, power, total)
+            continue
+        for sgt in sgts:
+            station_id, technology_id = sgt.station_id, sgt.technology_id
+            current = tech_bills.get((station_id, technology_id))
+            if current is None:
+                _add(new_bill(station_id, technology_id, None), power, total)
+            elif not current["technology_bill_percentage"]:
+                _add(current, power, total)
+            else:
+                percentage = current["technology_bill_percentage"]
+                _add(current, power * percentage / 100, total * Decimal(percentage / 100))
+
+    for bill in sources:
+        sgts = sgts_of[bill["account_number"]]
+        related = [tech_bills.get((sgt.station_id, sgt.technology_id)) for sgt in sgts]
+        if any(r is None or any(r[column] is None for column in INTAKE_REQUIRED_COLUMNS) for r in related):
+            continue   # add_new_bill stores the bill and leaves the split for later too
+        total_water = sum(r["technology_water_amount"] for r in related)
+        power, total = bill["power_consump"], bill["bill_total"]
+        for r in related:
+            if total_water:
+                share = r["technology_water_amount"] / total_water
+                _add(r, power * share, total * Decimal(share))
+            else:
+                _add(r, power / len(sgts), total / Decimal(len(sgts)))
+        bill["is_distributed"] = True
+
+    return tech_bills
+
+
+def import_bills(session, valid, bill_month, bill_year, username, dry_run=False):
+    """
+    Insert the validated rows and their allocations with executemany
+    statements in session's transaction (the caller commits).
+
+    Returns (summary counts, audit entries for the gauge bills and
+    final_reading updates).  Technology bill allocations are not audited,
+    like add_new_bill's automatic updates.
+    """
+    bills = []
+    for row in valid.itertuples():
+        bills.append({
+            "account_number": row.account_number,
+            "bill_month": bill_month,
+            "bill_year": bill_year,
+            "prev_reading": float(row.prev_reading),
+            "current_reading": float(row.current_reading),
+            "reading_factor": int(row.reading_factor),
+            "power_consump": float(row.power_consump),
+            "voltage_id": int(row.voltage_id),
+            "voltage_cost": str(row.voltage_cost),
+            "consump_cost": _decimal(row.power_consump * row.voltage_cost + row.fixed_fee),
+            "fixed_installment": _decimal(row.fixed_installment),
+            "settlements": _decimal(row.settlements),
+            "settlement_qty": float(row.settlement_qty),
+            "stamp": _decimal(row.stamp),
+            "prev_payments": _decimal(row.prev_payments),
+            "rounding": float(row.rounding),
+            "bill_total": _decimal(row.bill_total),
+            "is_paid": bool(row.is_paid),
+            "notes": None if row.notes is None else str(row.notes),
+            "delay_month": None if pd.isna(row.delay_month) else int(row.delay_month),
+            "delay_year": None if pd.isna(row.delay_year) else int(row.delay_year),
+            "is_distributed": False,
+        })
+
+    tech_bills = allocate(session, bills, bill_month, bill_year)
+    created = [b for b in tech_bills.values() if b["new"]]
+    updated = [b for b in tech_bills.values() if b["changed"] and not b["new"]]
+    summary = {"imported": len(bills), "tech_bills_created": len(created), "tech_bills_updated": len(updated)}
+    if dry_run or not bills:
+        return summary, []
+
+    session.execute(GuageBill.__table__.insert(), bills)
+    moved = advance_final_readings(session, [(row.account_number, float(row.final_reading), float(row.current_reading))
+                                             for row in valid.itertuples()])
+    if moved:
+        raise ValueError(f"final_reading changed while importing, gauges: {', '.join(map(str, moved))}")
+    techs = TechnologyBill.__table__
+    if created:
+        session.execute(techs.insert(), [{
+            "station_id": b["station_id"], "technology_id": b["technology_id"], "bill_month": bill_month,
+            "bill_year": bill_year, "technology_bill_percentage": b["technology_bill_percentage"],
+            "technology_power_consump": b["technology_power_consump"],
+            "technology_bill_total": b["technology_bill_total"],
+        } for b in created])
+    # existing rows get what this file adds to them, not the totals computed from the snapshot
+    add_to_tech_bills(session, bill_month, bill_year, [
+        {"b_station_id": b["station_id"], "b_technology_id": b["technology_id"],
+         "b_power": b["power_delta"], "b_total": b["total_delta"]} for b in updated])
+
+    audit_entries = [{
+        "username": username, "action": "INSERT", "table_name": GuageBill.__tablename__,
+        "old_data": None, "new_data": bill,
+    } for bill in bills]
+    audit_entries += [{
+        "username": username, "action": "UPDATE", "table_name": Gauge.__tablename__,
+        "old_data": {"final_reading": float(row.final_reading), "account_number": row.account_number},
+        "new_data": {"final_reading": float(row.current_reading), "account_number": row.account_number},
+    } for row in valid.itertuples()]
+    return summary, audit_entries
+
+
+def rollback_month(session, bill_month, bill_year, username, branch_id=None):
+    """
+    Delete the period's gauge bills (of branch_id's gauges only, if given)
+    and reverse their effects in session's transaction (the caller commits,
+    or rolls back for a dry run).
+
+    Returns (summary, audit entries for the deleted gauge and technology
+    bills and the restored final readings).  Raises ValueError when a gauge in scope already has a
+    later bill, a technology bill it feeds is also fed by another gauge's
+    bill of the month, or the month still has unfinished allocation jobs.
+    """
+    in_scope = and_(GuageBill.bill_month == bill_month, GuageBill.bill_year == bill_year)
+    if branch_id is not None:
+        in_scope = and_(in_scope, GuageBill.account_number.in_(
+            select(StationGaugeTechnology.account_number)
+            .join(Station, Station.station_id == StationGaugeTechnology.station_id)
+            .where(Station.branch_id == branch_id)
+        ))
+    bills = session.execute(select(GuageBill.__table__).where(in_scope)).mappings().all()
+    summary = {"gauge_bills": len(bills), "gauges_restored": 0, "tech_bills_updated": 0, "tech_bills_deleted": 0,
+               "accounts": [b["account_number"] for b in bills]}
+    if not bills:
+        return summary, []
+
+    later = GuageBill.__table__.alias("later")
+    blocked = session.scalars(select(GuageBill.account_number).where(in_scope, exists().where(
+        later.c.account_number == GuageBill.account_number,
+        or_(later.c.bill_year > bill_year, and_(later.c.bill_year == bill_year, later.c.bill_month > bill_month)),
+    ))).all()
+    if blocked:
+        raise ValueError(f"later bills exist for: {', '.join(blocked)}")
+    if session.scalar(select(AllocationJob.job_id).where(
+            AllocationJob.bill_month == bill_month, AllocationJob.bill_year == bill_year,
+            AllocationJob.status.in_(("pending", "running"))).limit(1)):
+        raise ValueError("allocation jobs of this month are still running")
+
+    # the technology bills the deleted gauges fed, through relations of any status
+    deleted = select(GuageBill.account_number).where(in_scope)
+    targets = StationGaugeTechnology.__table__.alias("targets")
+    fed = select(targets.c.station_id, targets.c.technology_id).where(targets.c.account_number.in_(deleted))
+    feeders = StationGaugeTechnology.__table__.alias("feeders")
+    others = GuageBill.__table__.alias("others")
+    shared = session.scalars(select(others.c.account_number).distinct().join(
+        feeders, feeders.c.account_number == others.c.account_number,
+    ).where(
+        others.c.bill_month == bill_month, others.c.bill_year == bill_year,
+        others.c.account_number.notin_(deleted),
+        exists(fed.where(targets.c.station_id == feeders.c.station_id,
+                         targets.c.technology_id == feeders.c.technology_id)),
+    )).all()
+    if shared:
+        raise ValueError(f"technology bills of this scope are also fed by: {', '.join(shared)}")
+
+    techs = TechnologyBill.__table__
+    allocated = and_(
+        techs.c.bill_month == bill_month,
+        techs.c.bill_year == bill_year,
+        exists(fed.where(targets.c.station_id == techs.c.station_id,
+                         targets.c.technology_id == techs.c.technology_id)),
+        or_(techs.c.technology_power_consump.isnot(None), techs.c.technology_bill_total.isnot(None)),
+    )
+    # rows add_new_bill created for the allocation alone, with no water entered, go with it
+    dropped = session.execute(select(techs).where(allocated, techs.c.technology_water_amount.is_(None))).mappings().all()
+    summary["tech_bills_deleted"] = session.execute(
+        delete(techs).where(allocated, techs.c.technology_water_amount.is_(None))).rowcount
+    summary["tech_bills_updated"] = session.execute(
+        update(techs).where(allocated).values(technology_power_consump=None, technology_bill_total=None)).rowcount
+
+    gauges = Gauge.__table__
+    summary["gauges_restored"] = session.execute(
+        update(gauges).where(gauges.c.account_number.in_(select(GuageBill.account_number).where(in_scope)))
+        .values(final_reading=select(GuageBill.prev_reading).where(
+            in_scope, GuageBill.account_number == gauges.c.account_number).scalar_subquery())
+    ).rowcount
+    session.execute(delete(GuageBill).where(in_scope).execution_options(synchronize_session=False))
+
+    audit_entries = [{
+        "username": username, "action": "DELETE", "table_name": GuageBill.__tablename__,
+        "old_data": dict(bill), "new_data": None,
+    } for bill in bills]
+    audit_entries += [{
+        "username": username, "action": "UPDATE", "table_name": Gauge.__tablename__,
+        "old_data": {"final_reading": bill["current_reading"], "account_number": bill["account_number"]},
+        "new_data": {"final_reading": bill["prev_reading"], "account_number": bill["account_number"]},
+    } for bill in bills]
+    audit_entries += [{
+        "username": username, "action": "DELETE", "table_name": TechnologyBill.__tablename__,
+        "old_data": dict(row), "new_data": None,
+    } for row in dropped]
+    return summary, audit_entries
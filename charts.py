@@ -0,0 +1,691 @@
+"""
+Chart rendering for the analytics routes.
+
+The figures are built exactly as the routes always built them; the routes
+query the data and call these functions, and benchmarks/bench_charts.py
+renders them on synthetic series without a database.  matplotlib charts are
+returned as base64 PNG strings, the financial dashboard as an HTML page.
+Every pyplot figure is closed after it is saved, so a worker does not keep
+one figure per request alive.
+"""
+
+import base64
+import io
+
+from lazy_imports import plt, sns, px, arabic_reshaper, get_display
+
+
+def consumption_charts(df_bills):
+    """
+    /analysis-single: actual vs reference power, chlorine, solid alum and
+    liquid alum per m3 for one station technology; df_bills is sorted by its
+    date column.
+    """
+    # power plot
+    plt.figure(figsize=(12, 6), dpi=120)
+    plt.title(get_display(arabic_reshaper.reshape('منحنى تغير الرقم المرجعي للكهرباء عبر الزمن')), fontsize=18)
+    plt.xticks(fontsize=14, rotation=45)
+    plt.yticks(fontsize=14)
+    ax1 = plt.gca()  # get current axes
+    ax2 = ax1.twinx()  # Create another axis that shares the same x-axis
+
+    ax1.set_xticks(df_bills.date)
+    ax1.set_xticklabels(
+        [d.strftime('%m/%Y') for d in df_bills.date],
+        rotation=45,
+        fontsize=12
+    )
+
+    ax1.plot(df_bills.date, (df_bills.technology_power_consump / df_bills.technology_water_amount), color='blue',
+             linewidth=3, marker="o", label=get_display(arabic_reshaper.reshape('الرقم المرجعي الفعلي')))
+    ax2.plot(df_bills.date, df_bills.power_per_water, 'green', linewidth=3, linestyle='dashed',
+             label=get_display(arabic_reshaper.reshape('الرقم المرجعي القياسي')))
+    ax1.grid(color='grey', linestyle='--')
+    ax1.set_xlabel('شهر/سنة', fontsize=14)
+    ax1.set_ylabel(get_display(arabic_reshaper.reshape('الرقم المرجعي الفعلي')), color='blue', fontsize=14)
+    ax2.set_ylabel(get_display(arabic_reshaper.reshape('الرقم المرجعي القياسي')), color='green', fontsize=14)
+    # ax1.set_xlim([df_bills.date.min(), df_bills.date.max()])
+    # ax1.set_ylim([
+    #     (df_bills.technology_power_consump / df_bills.technology_water_amount).min(),
+    #     (df_bills.technology_power_consump / df_bills.technology_water_amount).max()
+    # ])
+    for x, y in zip(df_bills.date, df_bills.technology_power_consump / df_bills.technology_water_amount):
+        ax1.text(x, y, f"{y:.4f}", fontsize=9, color='blue', ha='center', va='bottom')
+    # Combine y-limits
+    y_min = min((df_bills.technology_power_consump / df_bills.technology_water_amount).min(),
+                df_bills.power_per_water.min())
+    y_max = max((df_bills.technology_power_consump / df_bills.technology_water_amount).max(),
+                df_bills.power_per_water.max())
+    y_pad = (y_max - y_min) * 0.1
+    y_min -= y_pad
+    y_max += y_pad
+    ax1.set_ylim(y_min, y_max)
+    ax2.set_ylim(y_min, y_max)
+
+    # Improve ticks
+    ax1.tick_params(axis='y', labelcolor='blue')
+    ax2.tick_params(axis='y', labelcolor='green')
+
+    # Axis labels
+    ax1.set_xlabel(get_display(arabic_reshaper.reshape('شهر/سنة')), fontsize=14)
+    ax1.set_ylabel(get_display(arabic_reshaper.reshape('الرقم المرجعي الفعلي')), fontsize=14, color='blue')
+    ax2.set_ylabel(get_display(arabic_reshaper.reshape('الرقم المرجعي القياسي')), fontsize=14, color='green')
+
+    # Grid
+    ax1.grid(color='grey', linestyle='--', alpha=0.5)
+
+    # Legend (outside)
+    lines1, labels1 = ax1.get_legend_handles_labels()
+    lines2, labels2 = ax2.get_legend_handles_labels()
+    ax1.legend(
+        lines1 + lines2,
+        labels1 + labels2,
+        loc='center left',
+        bbox_to_anchor=(1.05, 1),
+        fontsize=12
+    )
+
+    # Make room for legend
+    plt.subplots_adjust(right=0.78)
+    img = io.BytesIO()
+    plt.savefig(img, format='png', bbox_inches='tight', dpi=120)
+    img.seek(0)
+    power_plot = base64.b64encode(img.read()).decode('utf-8')
+    plt.close()
+    ###########################################################################################################
+    # chlorine plot
+    plt.figure(figsize=(12, 6), dpi=120)
+    plt.title(get_display(arabic_reshaper.reshape('منحنى تغير نسبة استهلاك الكلور عبر الزمن')), fontsize=18)
+    plt.xticks(fontsize=14, rotation=45)
+    plt.yticks(fontsize=14)
+    ax1 = plt.gca()  # get current axes
+    ax2 = ax1.twinx()  # Create another axis that shares the same x-axis
+
+    ax1.set_xticks(df_bills.date)
+    ax1.set_xticklabels(
+        [d.strftime('%m/%Y') for d in df_bills.date],
+        rotation=45,
+        fontsize=12
+    )
+
+    ax1.plot(df_bills.date, (df_bills.technology_chlorine_consump / df_bills.technology_water_amount), color='blue',
+             linewidth=3, marker="o", label=get_display(arabic_reshaper.reshape('الكلور الفعلي')))
+    ax2.plot(df_bills.date, df_bills.chlorine_range_from, 'green', linewidth=3, linestyle='dashed',
+             label=get_display(arabic_reshaper.reshape('الحد الأدنى الموصى به')))
+    ax2.plot(df_bills.date, df_bills.chlorine_range_to, 'red', linewidth=3, linestyle='dashed',
+             label=get_display(arabic_reshaper.reshape('الحد الأقصى الموصى به')))
+    ax1.grid(color='grey', linestyle='--')
+    ax1.set_xlabel(get_display(arabic_reshaper.reshape('شهر/سنة')), fontsize=14)
+    ax1.set_ylabel(get_display(arabic_reshaper.reshape('معامل استهلاك الكلور الفعلي')), color='blue', fontsize=14)
+    ax2.set_ylabel(get_display(arabic_reshaper.reshape('معامل استهلاك الكلور القياسي')), color='green', fontsize=14)
+    ax2.set_yticks(ax1.get_yticks())
+    ax2.fill_between(df_bills.date,
+                     df_bills.chlorine_range_from,
+                     df_bills.chlorine_range_to,
+                     color='green', alpha=0.1, label=get_display(arabic_reshaper.reshape('النطاق الموصى به')))
+    for x, y in zip(df_bills.date, df_bills.technology_chlorine_consump / df_bills.technology_water_amount):
+        ax1.text(x, y, f"{y:.4f}", fontsize=9, color='blue', ha='center', va='bottom')
+        # ax1.set_xlim([df_bills.date.min(), df_bills.date.max()])
+        # Get min and max of both series
+        # Combine y-limits
+        y_min = min((df_bills.technology_chlorine_consump / df_bills.technology_water_amount).min(),
+                    df_bills.chlorine_range_from.min())
+        y_max = max((df_bills.technology_chlorine_consump / df_bills.technology_water_amount).max(),
+                    df_bills.chlorine_range_to.max())
+        y_pad = (y_max - y_min) * 0.1
+        y_min -= y_pad
+        y_max += y_pad
+        ax1.set_ylim(y_min, y_max)
+        ax2.set_ylim(y_min, y_max)
+
+        # Improve ticks
+        ax1.tick_params(axis='y', labelcolor='blue')
+        ax2.tick_params(axis='y', labelcolor='green')
+
+    # Add combined legend
+    lines, labels = ax1.get_legend_handles_labels()
+    lines2, labels2 = ax2.get_legend_handles_labels()
+    ax1.legend(
+        lines + lines2, labels + labels2,
+        loc='center left',
+        bbox_to_anchor=(1.05, 1),
+        fontsize=12,
+        borderaxespad=0.
+    )
+    img = io.BytesIO()
+    plt.savefig(img, format='png', bbox_inches='tight', dpi=120)
+    img.seek(0)
+    chlorine_plot = base64.b64encode(img.read()).decode('utf-8')
+    plt.close()
+    ###########################################################################################################
+    # solid alum plot
+    plt.figure(figsize=(12, 6), dpi=120)
+    plt.title(get_display(arabic_reshaper.reshape('منحنى تغير نسبة استهلاك الشبة الصلبة عبر الزمن')), fontsize=18)
+    plt.xticks(fontsize=14, rotation=45)
+    plt.yticks(fontsize=14)
+    ax1 = plt.gca()  # get current axes
+    ax2 = ax1.twinx()  # Create another axis that shares the same x-axis
+
+    ax1.set_xticks(df_bills.date)
+    ax1.set_xticklabels(
+        [d.strftime('%m/%Y') for d in df_bills.date],
+        rotation=45,
+        fontsize=12
+    )
+
+    ax1.plot(df_bills.date, (df_bills.technology_solid_alum_consump / df_bills.technology_water_amount), color='blue',
+             linewidth=3, marker="o", label=get_display(arabic_reshaper.reshape('الشبة الصلبة الفعلية')))
+    ax2.plot(df_bills.date, df_bills.solid_alum_range_from, 'green', linewidth=3, linestyle='dashed',
+             label=get_display(arabic_reshaper.reshape('الحد الأدنى الموصى به')))
+    ax2.plot(df_bills.date, df_bills.solid_alum_range_to, 'red', linewidth=3, linestyle='dashed',
+             label=get_display(arabic_reshaper.reshape('الحد الأقصى الموصى به')))
+    ax1.grid(color='grey', linestyle='--')
+    ax1.set_xlabel(get_display(arabic_reshaper.reshape('شهر/سنة')), fontsize=14)
+    ax1.set_ylabel(get_display(arabic_reshaper.reshape('معامل استهلاك الشبة الصلبة الفعلي')), color='blue', fontsize=14)
+    ax2.set_ylabel(get_display(arabic_reshaper.reshape('معامل استهلاك الشبة الصلبة القياسي')), color='green',
+                   fontsize=14)
+    ax2.set_yticks(ax1.get_yticks())
+    ax2.fill_between(df_bills.date,
+                     df_bills.solid_alum_range_from,
+                     df_bills.solid_alum_range_to,
+                     color='green', alpha=0.1, label=get_display(arabic_reshaper.reshape('النطاق الموصى به')))
+    for x, y in zip(df_bills.date, df_bills.technology_solid_alum_consump / df_bills.technology_water_amount):
+        ax1.text(x, y, f"{y:.4f}", fontsize=9, color='blue', ha='center', va='bottom')
+        # ax1.set_xlim([df_bills.date.min(), df_bills.date.max()])
+        # ax1.set_ylim([
+        #     (df_bills.technology_solid_alum_consump / df_bills.technology_water_amount).min(),
+        #     (df_bills.technology_solid_alum_consump / df_bills.technology_water_amount).max()
+        # ])
+        # Combine y-limits
+        y_min = min((df_bills.technology_solid_alum_consump / df_bills.technology_water_amount).min(),
+                    df_bills.solid_alum_range_from.min())
+        y_max = max((df_bills.technology_solid_alum_consump / df_bills.technology_water_amount).max(),
+                    df_bills.solid_alum_range_to.max())
+        y_pad = (y_max - y_min) * 0.1
+        y_min -= y_pad
+        y_max += y_pad
+        ax1.set_ylim(y_min, y_max)
+        ax2.set_ylim(y_min, y_max)
+
+        # Improve ticks
+        ax1.tick_params(axis='y', labelcolor='blue')
+        ax2.tick_params(axis='y', labelcolor='green')
+
+        # Add combined legend
+        lines, labels = ax1.get_legend_handles_labels()
+        lines2, labels2 = ax2.get_legend_handles_labels()
+        ax1.legend(
+            lines + lines2, labels + labels2,
+            loc='center left',
+            bbox_to_anchor=(1.05, 1),
+            fontsize=12,
+            borderaxespad=0.
+        )
+    img = io.BytesIO()
+    plt.savefig(img, format='png', bbox_inches='tight', dpi=120)
+    img.seek(0)
+    solid_alum_plot = base64.b64encode(img.read()).decode('utf-8')
+    plt.close()
+    ###########################################################################################################
+    # liquid alum plot
+    plt.figure(figsize=(12, 6), dpi=120)
+    plt.title(get_display(arabic_reshaper.reshape('منحنى تغير نسبة استهلاك الشبة السائلة عبر الزمن')), fontsize=18)
+    plt.xticks(fontsize=14, rotation=45)
+    plt.yticks(fontsize=14)
+    ax1 = plt.gca()  # get current axes
+    ax2 = ax1.twinx()  # Create another axis that shares the same x-axis
+
+    ax1.set_xticks(df_bills.date)
+    ax1.set_xticklabels(
+        [d.strftime('%m/%Y') for d in df_bills.date],
+        rotation=45,
+        fontsize=12
+    )
+
+    ax1.plot(df_bills.date, (df_bills.technology_liquid_alum_consump / df_bills.technology_water_amount), color='blue',
+             linewidth=3, marker="o", label=get_display(arabic_reshaper.reshape('الشبة السائلة الفعلية')))
+    ax2.plot(df_bills.date, df_bills.liquid_alum_range_from, 'green', linewidth=3, linestyle='dashed',
+             label=get_display(arabic_reshaper.reshape('الحد الأدنى الموصى به')))
+    ax2.plot(df_bills.date, df_bills.liquid_alum_range_to, 'red', linewidth=3, linestyle='dashed',
+             label=get_display(arabic_reshaper.reshape('الحد الأقصى الموصى به')))
+    ax1.grid(color='grey', linestyle='--')
+    ax1.set_xlabel(get_display(arabic_reshaper.reshape('شهر/سنة')), fontsize=14)
+    ax1.set_ylabel(get_display(arabic_reshaper.reshape('معامل استهلاك الشبة السائلة الفعلي')), color='blue',
+                   fontsize=14)
+    ax2.set_ylabel(get_display(arabic_reshaper.reshape('معامل استهلاك الشبة السائلة القياسي')), color='green',
+                   fontsize=14)
+    ax2.set_yticks(ax1.get_yticks())
+    ax2.fill_between(df_bills.date,
+                     df_bills.liquid_alum_range_from,
+                     df_bills.liquid_alum_range_to,
+                     color='green', alpha=0.1, label=get_display(arabic_reshaper.reshape('النطاق الموصى به')))
+    for x, y in zip(df_bills.date, df_bills.technology_liquid_alum_consump / df_bills.technology_water_amount):
+        ax1.text(x, y, f"{y:.4f}", fontsize=9, color='blue', ha='center', va='bottom')
+        # ax1.set_xlim([df_bills.date.min(), df_bills.date.max()])
+        # ax1.set_ylim([
+        #     (df_bills.technology_liquid_alum_consump / df_bills.technology_water_amount).min(),
+        #     (df_bills.technology_liquid_alum_consump / df_bills.technology_water_amount).max()
+        # ])
+        # Combine y-limits
+        y_min = min((df_bills.technology_liquid_alum_consump / df_bills.technology_water_amount).min(),
+                    df_bills.liquid_alum_range_from.min())
+        y_max = max((df_bills.technology_liquid_alum_consump / df_bills.technology_water_amount).max(),
+                    df_bills.liquid_alum_range_to.max())
+        y_pad = (y_max - y_min) * 0.1
+        y_min -= y_pad
+        y_max += y_pad
+        ax1.set_ylim(y_min, y_max)
+        ax2.set_ylim(y_min, y_max)
+
+        # Improve ticks
+        ax1.tick_params(axis='y', labelcolor='blue')
+        ax2.tick_params(axis='y', labelcolor='green')
+
+        # Add combined legend
+        lines, labels = ax1.get_legend_handles_labels()
+        lines2, labels2 = ax2.get_legend_handles_labels()
+        ax1.legend(
+            lines + lines2, labels + labels2,
+            loc='center left',
+            bbox_to_anchor=(1.05, 1),
+            fontsize=12,
+            borderaxespad=0.
+        )
+    img = io.BytesIO()
+    plt.savefig(img, format='png', bbox_inches='tight', dpi=120)
+    img.seek(0)
+    liquid_alum_plot = base64.b64encode(img.read()).decode('utf-8')
+    plt.close()
+    return {
+        "power_plot": power_plot,
+        "chlorine_plot": chlorine_plot,
+        "solid_alum_plot": solid_alum_plot,
+        "liquid_alum_plot": liquid_alum_plot
+    }
+
+
+def prediction_chart(df_monthly_bills):
+    """/prediction: monthly produced water with its regression line."""
+    plt.figure(figsize=(8, 4), dpi=200)
+    with sns.axes_style("darkgrid"):
+        ax = sns.regplot(data=df_monthly_bills,
+                         x='time_index',
+                         y='technology_water_amount',
+                         scatter_kws={'alpha': 0.4,
+                                      'color': '#2f4b7c'},
+                         line_kws={'color': '#ff7c43'})
+    ax.set(
+        ylabel=get_display(arabic_reshaper.reshape('المياه المنتجة')),
+        xlabel=get_display(arabic_reshaper.reshape('الفترة الزمنية')),
+    )
+    # Save to BytesIO buffer
+    img = io.BytesIO()
+    plt.tight_layout()
+    plt.savefig(img, format='png', dpi=200, bbox_inches='tight')
+    img.seek(0)  # Rewind the buffer
+
+    # Encode image to Base64
+    prediction_base64 = base64.b64encode(img.read()).decode('utf-8')
+    plt.close()
+    return prediction_base64
+
+
+def balance_chart(df, area_name, calc_type):
+    """/balance-plot-calc: yearly demand vs actual and design capacity of an area."""
+    fig, ax = plt.subplots(figsize=(12, 7))
+
+    # --------------------
+    # Plot lines
+    # --------------------
+
+    # Water need (demand)
+    ax.plot(
+        df['year'],
+        df['Q_demanded_monthly_avg'],
+        linestyle='--',
+        color='green',
+        linewidth=2.5,
+        marker='o',
+        label=get_display(arabic_reshaper.reshape('الاحتياج المائي'))
+    )
+
+    # Current production
+    ax.plot(
+        df['year'],
+        df['current_production'],
+        color='lightblue',
+        linewidth=3,
+        marker='s',
+        label=get_display(arabic_reshaper.reshape('القدرة الفعلية'))
+    )
+
+    # Max production (capacity)
+    ax.plot(
+        df['year'],
+        df['max_production'],
+        color='black',
+        linewidth=3,
+        label=get_display(arabic_reshaper.reshape('القدرة التصميمية'))
+    )
+
+    # --------------------
+    # X-axis formatting
+    # --------------------
+    ax.set_xticks(df['year'])
+    ax.set_xticklabels(df['year'], rotation=45)
+
+    # --------------------
+    # Labels & title
+    # --------------------
+    ax.set_xlabel(get_display(arabic_reshaper.reshape('السنة')), fontsize=12)
+    ax.set_ylabel(get_display(arabic_reshaper.reshape('كمية المياه (م³ / يوم)')), fontsize=12)
+
+    if calc_type == "equation":
+        ax.set_title(
+            get_display(
+                arabic_reshaper.reshape(f" منحنى الاتزان ل{area_name} حسب معادلة نصيب الفرد ")),
+            fontsize=16,
+            fontweight='bold',
+            pad=15
+        )
+    else:
+        ax.set_title(
+            get_display(
+                arabic_reshaper.reshape(f" منحنى الاتزان ل{area_name} حسب قرار الوزارة لتحديد نصيب الفرد ")),
+            fontsize=16,
+            fontweight='bold',
+            pad=15
+        )
+
+    # --------------------
+    # Grid (soft & readable)
+    # --------------------
+    ax.grid(
+        True,
+        which='major',
+        linestyle='--',
+        linewidth=0.6,
+        alpha=0.6
+    )
+
+    # --------------------
+    # Legend (clean & clear)
+    # --------------------
+    ax.legend(
+        loc='upper left',
+        fontsize=11,
+        frameon=True,
+        shadow=True
+    )
+
+    # --------------------
+    # Visual limits (padding)
+    # --------------------
+    y_max = max(
+        df['Q_demanded_monthly_avg'].max(),
+        df['current_production'].max(),
+        df['max_production'].max()
+    )
+    ax.set_ylim(0, y_max * 1.15)
+
+    # --------------------
+    # Layout
+    # --------------------
+    plt.tight_layout()
+    # Save to BytesIO buffer
+    img = io.BytesIO()
+    plt.savefig(img, format='png', dpi=200, bbox_inches='tight')
+    img.seek(0)  # Rewind the buffer
+
+    # Encode image to Base64
+    chart_base64 = base64.b64encode(img.read()).decode('utf-8')
+    plt.close(fig)
+    return chart_base64
+
+
+def arabic_number(value):
+    if value >= 1_000_000_000:
+        return f"{value / 1_000_000_000:.1f} مليار"
+    elif value >= 1_000_000:
+        return f"{value / 1_000_000:.1f} مليون"
+    elif value >= 1_000:
+        return f"{value / 1000:.1f} ألف"
+    else:
+        return f"{value:,.0f}"
+
+
+def financial_dashboard_html(df):
+    """
+    /financial-analysis: KPI cards and the five sunburst charts (water, power,
+    chlorine, liquid and solid alum by branch/station/technology) as one page.
+    Chemical columns of df are in grams.
+    """
+    # Convert chlorine from grams → tons
+    df['technology_chlorine_consump'] = df['technology_chlorine_consump'] / 1_000_000
+
+    # Convert liquid alum from grams → tons (if needed)
+    df['technology_liquid_alum_consump'] = df['technology_liquid_alum_consump'] / 1_000_000
+
+    # Convert solid alum from grams → tons (if needed)
+    df['technology_solid_alum_consump'] = df['technology_solid_alum_consump'] / 1_000_000
+
+    total_water = df['technology_water_amount'].sum()
+    total_power = df['technology_power_consump'].sum()
+    total_chlorine = df['technology_chlorine_consump'].sum()
+    total_liquid_alum = df['technology_liquid_alum_consump'].sum()
+    total_solid_alum = df['technology_solid_alum_consump'].sum()
+
+    # Chart 1: Water Production
+    fig_water = px.sunburst(
+        df,
+        path=['branch_name', 'station_name', 'technology_name'],
+        values='technology_water_amount',
+        color='technology_name',
+        title='نسبة إنتاج المياه حسب الفرع والمحطة والتقنية'
+    )
+    fig_water.update_traces(
+        hovertemplate="<b>%{label}</b><br><br>كمية المياه: %{value:,.0f} م³<br>نسبة من الإجمالي: %{percentRoot:.2%}<br><extra></extra>"
+    )
+    fig_water.update_layout(
+        height=850,
+        font=dict(family="Arial", size=15),
+        coloraxis_showscale=False,
+        margin=dict(t=60, b=40, l=40, r=40)
+    )
+
+    # Chart 2: Power Consumption
+    fig_power = px.sunburst(
+        df,
+        path=['branch_name', 'station_name', 'technology_name'],
+        values='technology_power_consump',
+        color='technology_name',
+        title='نسبة استهلاك الكهرباء حسب الفرع والمحطة والتقنية'
+    )
+    fig_power.update_traces(
+        hovertemplate="<b>%{label}</b><br><br>استهلاك الكهرباء: %{value:,.0f} ك.و<br>نسبة من الإجمالي: %{percentRoot:.2%}<br><extra></extra>"
+    )
+    fig_power.update_layout(
+        height=850,
+        font=dict(family="Arial", size=15),
+        coloraxis_showscale=False,
+        margin=dict(t=60, b=40, l=40, r=40)
+    )
+
+    # Chart 3: Chlorine Consumption
+    fig_chlorine = px.sunburst(
+        df,
+        path=['branch_name', 'station_name', 'technology_name'],
+        values='technology_chlorine_consump',
+        color='technology_name',
+        title='نسبة استهلاك الكلور حسب الفرع والمحطة والتقنية'
+    )
+    fig_chlorine.update_traces(
+        hovertemplate="<b>%{label}</b><br><br>كمية الكلور: %{value:,.3f} طن<br>نسبة من الإجمالي: %{percentRoot:.2%}<br><extra></extra>"
+    )
+    fig_chlorine.update_layout(
+        height=850,
+        font=dict(family="Arial", size=15),
+        coloraxis_showscale=False,
+        margin=dict(t=60, b=40, l=40, r=40)
+    )
+
+    # Chart 4: Liquid Alum Consumption
+    fig_liquid = px.sunburst(
+        df,
+        path=['branch_name', 'station_name', 'technology_name'],
+        values='technology_liquid_alum_consump',
+        color='technology_name',
+        title='نسبة استهلاك الشبة السائلة حسب الفرع والمحطة والتقنية'
+    )
+    fig_liquid.update_traces(
+        hovertemplate="<b>%{label}</b><br><br>الشبة السائلة: %{value:,.3f} طن<br>نسبة من الإجمالي: %{percentRoot:.2%}<br><extra></extra>"
+    )
+    fig_liquid.update_layout(
+        height=850,
+        font=dict(family="Arial", size=15),
+        coloraxis_showscale=False,
+        margin=dict(t=60, b=40, l=40, r=40)
+    )
+
+    # Chart 5: Solid Alum Consumption
+    fig_solid = px.sunburst(
+        df,
+        path=['branch_name', 'station_name', 'technology_name'],
+        values='technology_solid_alum_consump',
+        color='technology_name',
+        title='نسبة استهلاك الشبة الصلبة حسب الفرع والمحطة والتقنية'
+    )
+    fig_solid.update_traces(
+        hovertemplate="<b>%{label}</b><br><br>الشبة الصلبة: %{value:,.3f} طن<br>نسبة من الإجمالي: %{percentRoot:.2%}<br><extra></extra>"
+    )
+    fig_solid.update_layout(
+        height=850,
+        font=dict(family="Arial", size=15),
+        coloraxis_showscale=False,
+        margin=dict(t=60, b=40, l=40, r=40)
+    )
+
+    # OR if you need HTML:
+    # return {
+    #     'sun_water': fig_water.to_html(full_html=False, include_plotlyjs=False),
+    #     'sun_power': fig_power.to_html(full_html=False, include_plotlyjs=False),
+    #     'sun_chlorine': fig_chlorine.to_html(full_html=False, include_plotlyjs=False),
+    #     'sun_liquid': fig_liquid.to_html(full_html=False, include_plotlyjs=False),
+    #     'sun_solid': fig_solid.to_html(full_html=False, include_plotlyjs=False)
+    # }
+    kpi_cards = f"""
+    <div class="row text-center" style="margin-top: 20px; margin-bottom: 20px;">
+
+        <div class="col-md-2">
+            <div class="card shadow-sm">
+                <div class="card-body">
+                    <h6 class="text-secondary">إجمالي المياه</h6>
+                    <h4 class="text-primary">{arabic_number(total_water)} (م³)</h4>
+                </div>
+            </div>
+        </div>
+
+        <div class="col-md-2">
+            <div class="card shadow-sm">
+                <div class="card-body">
+                    <h6 class="text-secondary">إجمالي الكهرباء</h6>
+                    <h4 class="text-primary">{arabic_number(total_power)} (KW)</h4>
+                </div>
+            </div>
+        </div>
+
+        <div class="col-md-2">
+            <div class="card shadow-sm">
+                <div class="card-body">
+                    <h6 class="text-secondary">إجمالي الكلور</h6>
+                    <h4 class="text-primary">{arabic_number(total_chlorine)} طن</h4>
+                </div>
+            </div>
+        </div>
+
+        <div class="col-md-3">
+            <div class="card shadow-sm">
+                <div class="card-body">
+                    <h6 class="text-secondary">إجمالي الشبة السائلة</h6>
+                    <h4 class="text-primary">{arabic_number(total_liquid_alum)} طن</h4>
+                </div>
+            </div>
+        </div>
+
+        <div class="col-md-3">
+            <div class="card shadow-sm">
+                <div class="card-body">
+                    <h6 class="text-secondary">إجمالي الشبة الصلبة</h6>
+                    <h4 class="text-primary">{arabic_number(total_solid_alum)} طن</h4>
+                </div>
+            </div>
+        </div>
+
+    </div>
+    """
+
+    tabs_html = f"""
+    <ul class="nav nav-tabs" id="dataTabs" role="tablist">
+      <li class="nav-item" role="presentation">
+        <button class="nav-link active" data-bs-toggle="tab" data-bs-target="#water" type="button">المياه</button>
+      </li>
+      <li class="nav-item" role="presentation">
+        <button class="nav-link" data-bs-toggle="tab" data-bs-target="#power" type="button">الكهرباء</button>
+      </li>
+      <li class="nav-item" role="presentation">
+        <button class="nav-link" data-bs-toggle="tab" data-bs-target="#chlorine" type="button">الكلور</button>
+      </li>
+      <li class="nav-item" role="presentation">
+        <button class="nav-link" data-bs-toggle="tab" data-bs-target="#liquid" type="button">الشبة السائلة</button>
+      </li>
+      <li class="nav-item" role="presentation">
+        <button class="nav-link" data-bs-toggle="tab" data-bs-target="#solid" type="button">الشبة الصلبة</button>
+      </li>
+    </ul>
+
+    <div class="tab-content" style="margin-top: 20px;">
+      <div class="tab-pane fade show active" id="water">{fig_water.to_html(full_html=False, include_plotlyjs='cdn')}</div>
+      <div class="tab-pane fade" id="power">{fig_power.to_html(full_html=False, include_plotlyjs=False)}</div>
+      <div class="tab-pane fade" id="chlorine">{fig_chlorine.to_html(full_html=False, include_plotlyjs=False)}</div>
+      <div class="tab-pane fade" id="liquid">{fig_liquid.to_html(full_html=False, include_plotlyjs=False)}</div>
+      <div class="tab-pane fade" id="solid">{fig_solid.to_html(full_html=False, include_plotlyjs=False)}</div>
+    </div>
+    """
+
+    full_dashboard_html = f"""
+    <html lang="ar" dir="rtl">
+    <head>
+        <meta charset="UTF-8">
+        <title>Dashboard</title>
+
+        <!-- Bootstrap -->
+        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
+
+        <style>
+            body {{
+                background-color: #f8f9fa;
+                font-family: 'Arial';
+            }}
+        </style>
+    </head>
+
+    <body>
+
+    <div class="container">
+
+        <h2 class="text-center mt-4 mb-4 text-primary">
+            لوحة تحليل استهلاك وإنتاج المحطات
+        </h2>
+
+        {kpi_cards}
+
+        {tabs_html}
+
+    </div>
+
+    <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"></script>
+
+    </body>
+    </html>
+    """
+    return full_dashboard_html
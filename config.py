@@ -0,0 +1,63 @@
+import os
+from datetime import timedelta
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def env_flag(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+class Config:
+    """Settings read from the environment (.env); pass another object/dict to create_app() to override."""
+
+    SECRET_KEY = os.getenv("FLASK_KEY")
+
+    # Connect to Database
+    SQLALCHEMY_DATABASE_URI = os.getenv("DB_URI")
+    # Engine/pool settings, turned into SQLALCHEMY_ENGINE_OPTIONS by pool_stats.engine_options()
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))  # whole seconds: engine_from_config casts it to int
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # SQL Server/firewalls drop idle connections
+    DB_POOL_PRE_PING = env_flag("DB_POOL_PRE_PING", True)
+    DB_FAST_EXECUTEMANY = env_flag("DB_FAST_EXECUTEMANY", True)  # mssql+pyodbc only
+
+    # JWT, access token: 30 days
+    JWT_SECRET_KEY = os.getenv("FLASK_KEY")
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(days=30)
+
+    CORS_ORIGINS = ["http://localhost:5000"]
+
+    # Audit rows are batched by a background writer (see audit.py)
+    AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", 10000))
+    AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", 200))
+    AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", 1.0))
+    AUDIT_RETENTION_DAYS = int(os.getenv("AUDIT_RETENTION_DAYS", 365))
+
+    # Technology bill allocation after /new-bill and the water entry routes runs as background jobs (see jobs.py)
+    ALLOCATION_ASYNC = env_flag("ALLOCATION_ASYNC", True)
+    ALLOCATION_WORKERS = int(os.getenv("ALLOCATION_WORKERS", 1))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+    # one gunicorn worker reruns abandoned jobs this often (seconds, 0 = only `flask resume-jobs`)
+    JOB_SWEEP_INTERVAL = int(os.getenv("JOB_SWEEP_INTERVAL", 60))
+
+    # /metrics: requests above this many SQL statements are flagged; it is only served with METRICS_TOKEN set, as bearer token
+    METRICS_QUERY_THRESHOLD = int(os.getenv("METRICS_QUERY_THRESHOLD", 50))
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+    # Slow-query log (slow_queries.py): record above SLOW_QUERY_MS, capture the plan above SLOW_QUERY_PLAN_MS
+    SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+    SLOW_QUERY_PLAN_MS = float(os.getenv("SLOW_QUERY_PLAN_MS", 500))
+    SLOW_QUERY_BUFFER = int(os.getenv("SLOW_QUERY_BUFFER", 500))
+    SLOW_QUERY_LOG_FILE = os.getenv("SLOW_QUERY_LOG_FILE", "logs/slow_queries.log")
+
+    # Schema is created with `flask init-db`; set to create missing tables at boot instead (dev only)
+    CREATE_ALL_ON_STARTUP = env_flag("CREATE_ALL_ON_STARTUP")
+    # Load catalogs, the forecast model and the analytics stack in create_app (see assets.py)
+    PRELOAD_ASSETS = env_flag("PRELOAD_ASSETS")
@@ -0,0 +1,500 @@
+"""
+Synthetic dataset generator for benchmarks and load tests (`flask gen-data`).
+
+Builds a dataset shaped like production into an empty database: branches,
+areas of service, water sources, technologies, voltages, stations, gauges
+and their station/gauge/technology relations, `years` of monthly gauge and
+technology bills, chemical reference ranges and place population history.
+The same scale and seed always give the same rows.
+
+Relations come in the shapes the billing code handles (see add_new_bill):
+
+  one_to_one    one gauge per technology, percentage 100
+  many_to_one   several gauges feeding the station's only technology
+  one_to_many   one gauge shared by every technology, split by fixed percentages
+  source        one gauge per technology plus an is_source intake gauge
+                whose bill is split by each technology's water amount
+
+Bills are consistent with the checks the routes make: readings chain from
+month to month and end at the gauge's final_reading, bill_total matches its
+items, technology bills hold the sum of their allocated gauge bills, water
+amount = measured + calculated, and chemical ranges are copied from
+alum_chlorine_reference for the bill's season and water source.
+
+Rows go in with Core executemany inserts of `batch_size` rows, bypassing
+the ORM session, so nothing is audited.
+"""
+
+import random
+import time
+from contextvars import ContextVar
+from decimal import Decimal
+
+from sqlalchemy import select, func, bindparam
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.schema import CreateColumn, FetchedValue
+
+from models import db, Branch, AreaOfService, WaterSource, Technology, Voltage, Station, Gauge, \
+    StationGaugeTechnology, GuageBill, TechnologyBill, AlumChlorineReference, PlaceType, Place, PlacePopulation
+
+GEN_DATA_SEED = 42
+GEN_DATA_YEARS = 12
+GEN_DATA_END_YEAR = 2024   # fixed, so a seed gives the same data whenever it runs
+GEN_DATA_BATCH_SIZE = 5000
+
+
+_server_generated_ids = ContextVar("datagen_server_generated_ids", default=False)
+
+
+@compiles(CreateColumn, "sqlite")
+def _sqlite_server_generated_ids(element, compiler, **kw):
+    # The unique *_id columns marked FetchedValue are IDENTITY columns on SQL Server. A SQLite
+    # database built by create_tables() has no generator for them, so give them a random default;
+    # any other create_all (init-db, tests) compiles the models' DDL unchanged.
+    text = compiler.visit_create_column(element, **kw)
+    column = element.element
+    if _server_generated_ids.get() and text is not None and type(column.server_default) is FetchedValue \
+            and not column.primary_key:
+        text += " DEFAULT (abs(random()))"
+    return text
+
+
+def create_tables(engine, tables=None):
+    """
+    create_all for generated/benchmark databases: on SQLite the server-generated
+    ids get a default, so the routes can insert bills into them later.
+    """
+    token = _server_generated_ids.set(True)
+    try:
+        db.metadata.create_all(engine, tables=tables)
+    finally:
+        _server_generated_ids.reset(token)
+
+
+# per unit of --scale
+STATIONS_PER_SCALE = 25
+AREAS_PER_SCALE = 4
+PLACES_PER_SCALE = 40
+
+WATER_STATION = "مياة"
+SEWAGE_STATION = "صرف"
+
+WATER_SOURCES = ["نهر النيل", "ترعة الإسماعيلية", "ترعة المحمودية", "بحر مويس", "ترعة الباجورية", "آبار جوفية"]
+
+# (name, main type, kWh per m3, station type, alum kind)
+TECHNOLOGIES = [
+    ("مرشحات سريعة", "تقليدي", 0.25, WATER_STATION, "liquid"),
+    ("مرشحات بطيئة", "تقليدي", 0.18, WATER_STATION, "solid"),
+    ("وحدات مدمجة", "مدمج", 0.32, WATER_STATION, "liquid"),
+    ("آبار ارتوازية", "آبار", 0.45, WATER_STATION, None),
+    ("تحلية مياه", "تحلية", 3.5, WATER_STATION, None),
+    ("معالجة ثنائية", "معالجة", 0.40, SEWAGE_STATION, None),
+    ("معالجة ثلاثية", "معالجة", 0.55, SEWAGE_STATION, None),
+    ("محطة رفع", "رفع", 0.15, SEWAGE_STATION, None),
+]
+
+# (type, kWh cost, monthly fixed fee)
+VOLTAGES = [("منخفض", 1.45, 20.0), ("متوسط", 1.15, 60.0), ("عالي", 0.95, 150.0)]
+
+# (name, litres per person per day from/to)
+PLACE_TYPES = [("مدينة", 200, 250), ("قرية", 120, 150), ("عزبة", 80, 100), ("منطقة صناعية", 250, 400)]
+
+METER_FACTORS = (1, 20, 40, 60, 120, 200)
+
+
+def get_season(month):
+    # same split as allocation.get_season
+    return "summer" if 4 <= month <= 10 else "winter"
+
+
+def _money(value):
+    return Decimal(str(value)).quantize(Decimal("0.01"))
+
+
+class _BatchInserter:
+    """Buffers rows per table and writes them with executemany every batch_size rows."""
+
+    def __init__(self, conn, batch_size):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.buffers = {}
+        self.counts = {}
+
+    def add(self, model, row):
+        rows = self.buffers.setdefault(model.__table__, [])
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush(model.__table__)
+
+    def flush(self, table=None):
+        for t in [table] if table is not None else list(self.buffers):
+            rows = self.buffers.get(t)
+            if rows:
+                self.conn.execute(t.insert(), rows)
+                self.counts[t.name] = self.counts.get(t.name, 0) + len(rows)
+                self.buffers[t] = []
+
+
+class DatasetGenerator:
+    def __init__(self, scale=1, seed=GEN_DATA_SEED, years=GEN_DATA_YEARS, end_year=GEN_DATA_END_YEAR,
+                 explicit_identity=True):
+        if scale < 1 or years < 1:
+            raise ValueError("scale and years must be at least 1")
+        self.scale = scale
+        self.rng = random.Random(seed)
+        self.years = years
+        self.end_year = end_year
+        # unique, server-generated ids (guage_bill_id, tech_bill_id, ...) are IDENTITY columns on
+        # SQL Server and must be left out there; other databases need them filled in
+        self.explicit_identity = explicit_identity
+        self.months = [(y, m) for y in range(end_year - years + 1, end_year + 1) for m in range(1, 13)]
+
+    def _identity(self, row, column, value):
+        if self.explicit_identity:
+            row[column] = value
+        return row
+
+    # --- reference data --------------------------------------------------------
+
+    def reference_rows(self, out):
+        rng = self.rng
+        n_branches = 3 + self.scale
+        self.branch_ids = list(range(1, n_branches + 1))
+        for branch_id in self.branch_ids:
+            out.add(Branch, {"branch_id": branch_id, "branch_name": f"فرع {branch_id:03d}"})
+
+        self.area_ids = list(range(1, AREAS_PER_SCALE * self.scale + 1))
+        for area_id in self.area_ids:
+            out.add(AreaOfService, {"area_id": area_id, "area_name": f"منطقة خدمة {area_id:03d}",
+                                    "increasable": rng.random() < 0.6})
+
+        self.water_source_ids = list(range(1, len(WATER_SOURCES) + 1))
+        for water_source_id, name in zip(self.water_source_ids, WATER_SOURCES):
+            out.add(WaterSource, {"water_source_id": water_source_id, "water_source_name": name})
+
+        self.technologies = {}
+        for technology_id, (name, main_type, ppw, station_type, alum) in enumerate(TECHNOLOGIES, start=1):
+            self.technologies[technology_id] = {"power_per_water": ppw, "station_type": station_type, "alum": alum}
+            out.add(Technology, {"technology_id": technology_id, "technology_name": name,
+                                 "power_per_water": ppw, "technology_main_type": main_type})
+
+        self.voltages = {}
+        for voltage_id, (voltage_type, cost, fixed_fee) in enumerate(VOLTAGES, start=1):
+            self.voltages[voltage_id] = (cost, fixed_fee)
+            out.add(Voltage, {"voltage_id": voltage_id, "voltage_type": voltage_type, "voltage_cost": cost,
+                              "fixed_fee": fixed_fee})
+
+        # chemical ranges per water technology, water source and season (g per m3)
+        self.chemicals = {}
+        chemical_id = 0
+        for technology_id, tech in self.technologies.items():
+            if tech["station_type"] != WATER_STATION:
+                continue
+            for water_source_id in self.water_source_ids:
+                for season in ("summer", "winter"):
+                    chemical_id += 1
+                    chlorine = rng.uniform(2.0, 4.0) * (1.2 if season == "summer" else 1.0)
+                    alum = rng.uniform(20.0, 35.0) * (1.15 if season == "winter" else 1.0)
+                    ref = {
+                        "technology_id": technology_id,
+                        "water_source_id": water_source_id,
+                        "season": season,
+                        "chlorine_range_from": round(chlorine, 2),
+                        "chlorine_range_to": round(chlorine * 1.5, 2),
+                        "solid_alum_range_from": round(alum, 2) if tech["alum"] == "solid" else 0.0,
+                        "solid_alum_range_to": round(alum * 1.4, 2) if tech["alum"] == "solid" else 0.0,
+                        "liquid_alum_range_from": round(alum, 2) if tech["alum"] == "liquid" else 0.0,
+                        "liquid_alum_range_to": round(alum * 1.4, 2) if tech["alum"] == "liquid" else 0.0,
+                    }
+                    self.chemicals[(technology_id, water_source_id, season)] = ref
+                    out.add(AlumChlorineReference, self._identity(dict(ref), "chemical_id", chemical_id))
+
+    # --- stations, gauges and relations -------------------------------------------
+
+    def topology_rows(self, out):
+        rng = self.rng
+        water_techs = [t for t, v in self.technologies.items() if v["station_type"] == WATER_STATION]
+        sewage_techs = [t for t, v in self.technologies.items() if v["station_type"] == SEWAGE_STATION]
+
+        self.stations = {}
+        self.gauges = {}   # account_number -> gauge dict, insertion order is bill order
+        sgt_id = 0
+
+        def new_gauge(branch_id):
+            n = len(self.gauges) + 1
+            account_number = f"{branch_id:02d}-{n:07d}"
+            factor = rng.choice(METER_FACTORS)
+            voltage_id = rng.choices(list(self.voltages), weights=(2, 5, 3))[0]
+            gauge = {
+                "account_number": account_number,
+                "meter_id": f"M{n:08d}",
+                "meter_factor": factor,
+                "voltage_id": voltage_id,
+                "monthly_kwh": rng.uniform(15_000, 400_000),
+                "start_reading": float(rng.randint(1_000, 400_000)),
+                "fixed_installment": _money(rng.choice((0, 0, 0, 150, 300, 750))),
+                "allocations": [],   # (station_id, technology_id, percentage)
+                "is_source": False,
+            }
+            self.gauges[account_number] = gauge
+            return gauge
+
+        for station_id in range(1, STATIONS_PER_SCALE * self.scale + 1):
+            branch_id = rng.choice(self.branch_ids)
+            station_type = WATER_STATION if rng.random() < 0.8 else SEWAGE_STATION
+            pool = water_techs if station_type == WATER_STATION else sewage_techs
+            techs = sorted(rng.sample(pool, rng.choices((1, 2, 3), weights=(5, 3, 1))[0]))
+            water_source_id = rng.choice(self.water_source_ids)
+            self.stations[station_id] = {"water_source_id": water_source_id, "station_type": station_type,
+                                         "techs": techs}
+            out.add(Station, {
+                "station_id": station_id,
+                "station_name": f"محطة {station_id:05d}",
+                "branch_id": branch_id,
+                "station_type": station_type,
+                "station_water_capacity": rng.randrange(5_000, 150_000, 500),
+                "water_source_id": water_source_id,
+                "area_id": rng.choice(self.area_ids),
+            })
+
+            if len(techs) == 1:
+                shape = "many_to_one" if rng.random() < 0.3 else "one_to_one"
+            elif station_type == WATER_STATION:
+                shape = rng.choices(("one_to_one", "one_to_many", "source"), weights=(5, 3, 2))[0]
+            else:
+                shape = rng.choices(("one_to_one", "one_to_many"), weights=(6, 4))[0]
+
+            if shape == "many_to_one":
+                for _ in range(rng.randint(2, 3)):
+                    new_gauge(branch_id)["allocations"].append((station_id, techs[0], 100.0))
+            elif shape == "one_to_many":
+                weights = [rng.uniform(1, 3) for _ in techs]
+                shares = [round(100 * w / sum(weights), 2) for w in weights]
+                shares[-1] = round(100 - sum(shares[:-1]), 2)
+                gauge = new_gauge(branch_id)
+                gauge["allocations"] = [(station_id, t, s) for t, s in zip(techs, shares)]
+            else:
+                for t in techs:
+                    new_gauge(branch_id)["allocations"].append((station_id, t, 100.0))
+                if shape == "source":
+                    intake = new_gauge(branch_id)
+                    intake["is_source"] = True
+                    intake["allocations"] = [(station_id, t, None) for t in techs]
+
+        for gauge in self.gauges.values():
+            out.add(Gauge, {
+                "account_number": gauge["account_number"],
+                "meter_id": gauge["meter_id"],
+                "meter_factor": gauge["meter_factor"],
+                "final_reading": gauge["start_reading"],   # moved to the last bill's reading afterwards
+                "voltage_id": gauge["voltage_id"],
+            })
+            for station_id, technology_id, _ in gauge["allocations"]:
+                sgt_id += 1
+                out.add(StationGaugeTechnology, self._identity({
+                    "station_id": station_id,
+                    "technology_id": technology_id,
+                    "account_number": gauge["account_number"],
+                    "relation_status": True,
+                    "is_source": gauge["is_source"],
+                }, "station_guage_technology_id", sgt_id))
+
+    # --- bills -------------------------------------------------------------------
+
+    def bill_rows(self, out):
+        rng = self.rng
+        tech_bills = {}   # (station_id, technology_id, year, month) -> dict
+        guage_bill_id = 0
+        first_year = self.months[0][0]
+
+        def gauge_bill(gauge, year, month, reading):
+            nonlocal guage_bill_id
+            guage_bill_id += 1
+            cost, fixed_fee = self.voltages[gauge["voltage_id"]]
+            season_factor = 1.25 if get_season(month) == "summer" else 1.0
+            growth = 1.02 ** (year - first_year)
+            kwh = gauge["monthly_kwh"] * season_factor * growth * rng.uniform(0.85, 1.15)
+            diff = max(1, round(kwh / gauge["meter_factor"]))
+            current = reading + diff
+            power = float(diff * gauge["meter_factor"])
+            settlements = _money(rng.choice((0, 0, 0, 0, rng.uniform(-500, 500))))
+            stamp = _money(rng.choice((0.9, 1.8, 2.7)))
+            prev_payments = _money(rng.choice((0, 0, 0, 0, rng.uniform(0, 1000))))
+            rounding = round(rng.uniform(-0.99, 0.99), 2)
+            # same arithmetic as the bill-total check in add_new_bill
+            total = (Decimal(str(diff)) * Decimal(str(gauge["meter_factor"])) * Decimal(str(cost))
+                     + Decimal(str(fixed_fee)) + gauge["fixed_installment"] + settlements + stamp
+                     - prev_payments + Decimal(str(rounding)))
+            row = self._identity({
+                "account_number": gauge["account_number"],
+                "bill_month": month,
+                "bill_year": year,
+                "prev_reading": reading,
+                "current_reading": current,
+                "reading_factor": gauge["meter_factor"],
+                "power_consump": power,
+                "voltage_id": gauge["voltage_id"],
+                "voltage_cost": str(cost),
+                "consump_cost": _money(power * cost + fixed_fee),
+                "fixed_installment": gauge["fixed_installment"],
+                "settlements": settlements,
+                "settlement_qty": 0.0,
+                "stamp": stamp,
+                "prev_payments": prev_payments,
+                "rounding": rounding,
+                "bill_total": total.quantize(Decimal("0.0001")),
+                "is_paid": (year, month) < self.months[-2] or rng.random() < 0.5,
+                "notes": None,
+                "delay_month": None,
+                "delay_year": None,
+                "is_distributed": gauge["is_source"],   # the history's intake bills are split below
+            }, "guage_bill_id", guage_bill_id)
+            out.add(GuageBill, row)
+            return row
+
+        def tech_bill(station_id, technology_id, year, month):
+            key = (station_id, technology_id, year, month)
+            bill = tech_bills.get(key)
+            if bill is None:
+                bill = tech_bills[key] = {"power": 0.0, "total": Decimal(0), "percentage": None}
+            return bill
+
+        # metered technologies first, then the intake gauges split by the resulting water amounts
+        intakes = [gauge for gauge in self.gauges.values() if gauge["is_source"]]
+        for gauge in self.gauges.values():
+            if gauge["is_source"]:
+                continue
+            reading = gauge["start_reading"]
+            for year, month in self.months:
+                row = gauge_bill(gauge, year, month, reading)
+                reading = row["current_reading"]
+                for station_id, technology_id, percentage in gauge["allocations"]:
+                    bill = tech_bill(station_id, technology_id, year, month)
+                    bill["power"] += row["power_consump"] * percentage / 100
+                    bill["total"] += row["bill_total"] * Decimal(percentage / 100)
+                    bill["percentage"] = percentage
+            gauge["final_reading"] = reading
+
+        for (station_id, technology_id, _, _), bill in tech_bills.items():
+            ppw = self.technologies[technology_id]["power_per_water"]
+            water = float(round(bill["power"] / (ppw * rng.uniform(0.9, 1.15))))
+            measured = float(round(water * rng.uniform(0.6, 1.0)))
+            bill["water"], bill["measured"], bill["calculated"] = water, measured, water - measured
+
+        for gauge in intakes:
+            reading = gauge["start_reading"]
+            for year, month in self.months:
+                row = gauge_bill(gauge, year, month, reading)
+                reading = row["current_reading"]
+                related = [tech_bill(s, t, year, month) for s, t, _ in gauge["allocations"]]
+                total_water = sum(b["water"] for b in related)
+                for bill in related:
+                    share = bill["water"] / total_water if total_water else 1 / len(related)
+                    bill["power"] += row["power_consump"] * share
+                    bill["total"] += row["bill_total"] * Decimal(share)
+            gauge["final_reading"] = reading
+
+        for tech_bill_id, ((station_id, technology_id, year, month), bill) in enumerate(tech_bills.items(), 1):
+            tech = self.technologies[technology_id]
+            station = self.stations[station_id]
+            row = {
+                "bill_month": month,
+                "bill_year": year,
+                "station_id": station_id,
+                "technology_id": technology_id,
+                "technology_bill_percentage": bill["percentage"],
+                "technology_power_consump": bill["power"],
+                "technology_bill_total": bill["total"].quantize(Decimal("0.0001")),
+                "technology_water_amount": bill["water"],
+                "measured_water": bill["measured"],
+                "calculated_water": bill["calculated"],
+                "power_per_water": tech["power_per_water"],
+                "technology_liquid_alum_consump": None,
+                "technology_solid_alum_consump": None,
+                "technology_chlorine_consump": None,
+                "chlorine_range_from": None,
+                "chlorine_range_to": None,
+                "solid_alum_range_from": None,
+                "solid_alum_range_to": None,
+                "liquid_alum_range_from": None,
+                "liquid_alum_range_to": None,
+            }
+            ref = self.chemicals.get((technology_id, station["water_source_id"], get_season(month)))
+            if ref:
+                for column in ("chlorine_range_from", "chlorine_range_to", "solid_alum_range_from",
+                               "solid_alum_range_to", "liquid_alum_range_from", "liquid_alum_range_to"):
+                    row[column] = ref[column]
+                # mostly inside the reference range, sometimes outside it
+                water = bill["water"]
+                row["technology_chlorine_consump"] = round(
+                    water * rng.uniform(ref["chlorine_range_from"] * 0.9, ref["chlorine_range_to"] * 1.1), 2)
+                row["technology_liquid_alum_consump"] = round(
+                    water * rng.uniform(ref["liquid_alum_range_from"] * 0.9, ref["liquid_alum_range_to"] * 1.1), 2)
+                row["technology_solid_alum_consump"] = round(
+                    water * rng.uniform(ref["solid_alum_range_from"] * 0.9, ref["solid_alum_range_to"] * 1.1), 2)
+            out.add(TechnologyBill, self._identity(row, "tech_bill_id", tech_bill_id))
+
+    # --- places ------------------------------------------------------------------
+
+    def place_rows(self, out):
+        rng = self.rng
+        for place_type_id, (name, portion_from, portion_to) in enumerate(PLACE_TYPES, start=1):
+            out.add(PlaceType, {"place_type_id": place_type_id, "place_type_name": name,
+                                "person_portion_from": portion_from, "person_portion_to": portion_to})
+
+        for place_id in range(1, PLACES_PER_SCALE * self.scale + 1):
+            place_type_id = rng.choices(range(1, len(PLACE_TYPES) + 1), weights=(2, 6, 3, 1))[0]
+            out.add(Place, {
+                "place_id": place_id,
+                "place_name": f"{PLACE_TYPES[place_type_id - 1][0]} {place_id:05d}",
+                "place_type_id": place_type_id,
+                "branch_id": rng.choice(self.branch_ids),
+                "area_id": rng.choice(self.area_ids),
+            })
+            population = rng.randint(800, 250_000)
+            growth = rng.uniform(0.012, 0.028)
+            for year in range(self.end_year - self.years + 1, self.end_year + 1):
+                out.add(PlacePopulation, {"place_id": place_id, "population_year": year,
+                                          "population": population})
+                population = round(population * (1 + growth * rng.uniform(0.8, 1.2)))
+
+    def generate(self, conn, batch_size=GEN_DATA_BATCH_SIZE):
+        out = _BatchInserter(conn, batch_size)
+        self.reference_rows(out)
+        self.topology_rows(out)
+        self.place_rows(out)
+        out.flush()   # parents before the bills that reference them
+        self.bill_rows(out)
+        out.flush()
+
+        gauge_table = Gauge.__table__
+        conn.execute(
+            gauge_table.update().where(gauge_table.c.account_number == bindparam("b_account_number")),
+            [{"b_account_number": g["account_number"], "final_reading": g["final_reading"]}
+             for g in self.gauges.values()],
+        )
+        return out.counts
+
+
+GENERATED_MODELS = [Branch, AreaOfService, WaterSource, Technology, Voltage, Station, Gauge, StationGaugeTechnology,
+                    AlumChlorineReference, PlaceType, Place, PlacePopulation, GuageBill, TechnologyBill]
+
+
+def generate_dataset(engine, scale=1, seed=GEN_DATA_SEED, years=GEN_DATA_YEARS, end_year=GEN_DATA_END_YEAR,
+                     batch_size=GEN_DATA_BATCH_SIZE):
+    """
+    Create the generated tables if missing and fill them in one transaction.
+    Returns ({table: rows}, seconds). Refuses to write into tables that already have rows.
+    """
+    tables = [model.__table__ for model in GENERATED_MODELS]
+    create_tables(engine, tables)
+
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        for table in tables:
+            if conn.execute(select(func.count()).select_from(table)).scalar():
+                raise ValueError(f"{table.name} is not empty; gen-data needs an empty database")
+        generator = DatasetGenerator(scale=scale, seed=seed, years=years, end_year=end_year,
+                                     explicit_identity=engine.dialect.name != "mssql")
+        counts = generator.generate(conn, batch_size=batch_size)
+    return counts, time.perf_counter() - start
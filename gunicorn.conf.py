@@ -0,0 +1,49 @@
+"""
+gunicorn settings for serving wsgi:app with several workers.
+
+preload_app builds the app once in the master; PRELOAD_ASSETS makes
+create_app() load catalogs, the forecast model and the analytics stack there
+too, so workers fork with them already in (copy-on-write shared) memory.
+
+The first worker to take JOB_SWEEPER_LOCK also runs the allocation job
+sweeper (jobs.py); when it exits the lock is released and the worker that
+replaces it takes over.
+"""
+import fcntl
+import multiprocessing
+import os
+import tempfile
+
+os.environ.setdefault("PRELOAD_ASSETS", "1")
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv("GUNICORN_THREADS", 1))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+preload_app = True
+
+sweeper_lock = os.getenv("JOB_SWEEPER_LOCK", os.path.join(tempfile.gettempdir(), "power_saving-job-sweeper.lock"))
+_sweeper_lock_file = None
+
+
+def _claim_sweeper():
+    global _sweeper_lock_file
+    lock_file = open(sweeper_lock, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _sweeper_lock_file = lock_file   # held open for the worker's lifetime
+    return True
+
+
+def post_fork(server, worker):
+    # never share the master's pooled DB connections with a worker
+    from models import db
+    from jobs import allocation_queue
+    app = server.app.wsgi()
+    with app.app_context():
+        db.engine.dispose(close=False)
+    if allocation_queue.enabled and _claim_sweeper():
+        allocation_queue.start_sweeper()
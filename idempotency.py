@@ -0,0 +1,68 @@
+"""
+Idempotency keys for write routes that clients retry (/new-bill).
+
+A client that may resend a request (timeouts, flaky links at month end)
+sends an Idempotency-Key header.  The route's successful response is stored
+under the key in the same transaction as the write, so a retry with the
+same key and body gets the stored response back, marked with an
+Idempotent-Replayed header, instead of applying the bill twice.  Reusing a
+key for a different request is refused.  Keys are forgotten after
+IDEMPOTENCY_KEY_TTL; `flask idempotency-purge` deletes the expired rows in
+bulk (a key nobody reuses is otherwise never removed).
+"""
+
+import hashlib
+import json
+from datetime import datetime, timedelta
+
+from flask import jsonify
+from sqlalchemy import delete
+
+from models import IdempotencyKey
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_TTL = timedelta(hours=24)
+IDEMPOTENCY_KEY_MAX_LENGTH = 100
+
+
+def request_hash(method, path, data):
+    payload = json.dumps([method, path, data], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def lookup(session, key, req_hash):
+    """
+    The stored response for key, or None when the key is new (or expired,
+    in which case its row is deleted so it can be reused).  Raises ValueError
+    when the key was used for a different request.
+    """
+    row = session.get(IdempotencyKey, key)
+    if row is None:
+        return None
+    if row.created_at < datetime.now() - IDEMPOTENCY_KEY_TTL:
+        session.delete(row)
+        return None
+    if row.request_hash != req_hash:
+        raise ValueError("idempotency key was already used for a different request")
+    response = jsonify(json.loads(row.response_body))
+    response.status_code = row.response_status
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def remember(session, key, req_hash, status, body):
+    """Store the response with the pending write; the caller's commit makes both durable."""
+    session.add(IdempotencyKey(
+        idempotency_key=key,
+        request_hash=req_hash,
+        response_status=status,
+        response_body=json.dumps(body, ensure_ascii=False, default=str),
+        created_at=datetime.now(),
+    ))
+
+
+def purge_expired(session, ttl=IDEMPOTENCY_KEY_TTL):
+    """Delete every key older than ttl in one statement; returns how many. The caller commits."""
+    return session.execute(delete(IdempotencyKey).where(
+        IdempotencyKey.created_at < datetime.now() - ttl
+    ).execution_options(synchronize_session=False)).rowcount
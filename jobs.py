@@ -0,0 +1,324 @@
+"""
+Background queue for technology bill allocation.
+
+Adding a gauge bill or a station's water amount used to update every
+sibling technology bill inside the request, so the clerk waited longer the
+more stations shared a meter.  With ALLOCATION_ASYNC on, the route instead
+writes an allocation_jobs row in the same transaction as its own row
+(enqueue()), commits, hands the job id to a thread pool (dispatch()) and
+returns it; GET /jobs/<job_id> reports the job's status and result.
+
+A job claims its row (pending -> running) with a conditional UPDATE, runs
+its handler from allocation.py and commits the allocation together with
+status "done".  Deadlocks, lock timeouts and key collisions with a
+concurrent job are retried with backoff up to JOB_MAX_ATTEMPTS times;
+anything else marks the job "failed" with the error.  Jobs still pending
+when a worker dies, or stuck "running" past JOB_STALE_AFTER, are picked up
+again by the sweeper thread one gunicorn worker starts (start_sweeper(),
+every JOB_SWEEP_INTERVAL seconds, see gunicorn.conf.py) or at once by
+`flask resume-jobs`; failed ones by `flask resume-jobs --failed` or
+POST /jobs/<job_id>/retry once the cause is fixed.
+
+Job commits happen outside a request, so the allocation writes are not
+audited, like the inline ones they replace.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+from models import db, AllocationJob
+from allocation import month_tech_bills, month_gauge_bill, allocate_gauge_bill, propagate_tech_bill
+from topology import topology_cache
+
+logger = logging.getLogger(__name__)
+
+ALLOCATION_WORKERS = 1        # threads per process; 1 keeps a worker's jobs in submission order
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 0.2         # seconds, doubled after every failed attempt
+JOB_STALE_AFTER = timedelta(minutes=10)
+JOB_SWEEP_INTERVAL = 60       # seconds between start_sweeper() runs of resume()
+
+# deadlock victim / lock timeout (SQL Server), serialization failure, busy SQLite file
+_RETRYABLE_ERRORS = ("1205", "1222", "40001", "deadlock", "database is locked")
+
+
+def is_retryable(exc):
+    if isinstance(exc, IntegrityError):
+        return True   # a concurrent job inserted the same technology bill first
+    if isinstance(exc, DBAPIError):
+        if exc.connection_invalidated:
+            return True
+        message = str(exc.orig).lower()
+        return any(marker in message for marker in _RETRYABLE_ERRORS)
+    return False
+
+
+def job_key(kind, payload):
+    return ":".join([kind] + [str(value) for value in payload.values()])
+
+
+def gauge_bill_payload(bill):
+    return {"account_number": bill.account_number, "bill_month": bill.bill_month, "bill_year": bill.bill_year}
+
+
+def tech_bill_payload(bill):
+    return {"station_id": bill.station_id, "technology_id": bill.technology_id,
+            "bill_month": bill.bill_month, "bill_year": bill.bill_year}
+
+
+class AllocationQueue:
+    def __init__(self, workers=ALLOCATION_WORKERS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.sweep_interval = JOB_SWEEP_INTERVAL
+        self.app = None
+        self.enabled = True
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._executor = None
+        self._sweeper = None
+        self._futures = set()
+        self.counters = {
+            "submitted": 0,
+            "done": 0,
+            "failed": 0,
+            "retried": 0,
+        }
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get("ALLOCATION_ASYNC", True)
+        self.workers = app.config.get("ALLOCATION_WORKERS", self.workers)
+        self.max_attempts = app.config.get("JOB_MAX_ATTEMPTS", self.max_attempts)
+        self.sweep_interval = app.config.get("JOB_SWEEP_INTERVAL", self.sweep_interval)
+        if (app.config.get("SQLALCHEMY_DATABASE_URI") or "").startswith("sqlite"):
+            self.workers = 1   # one writer at a time anyway
+        self._reset()
+        atexit.register(self.stop)
+
+    def handler(self, kind):
+        """Register fn(session, payload) -> JSON-able result for jobs of this kind."""
+        def decorator(fn):
+            self._handlers[kind] = fn
+            return fn
+        return decorator
+
+    # --- producer side -----------------------------------------------------
+
+    def enqueue(self, session, kind, payload, username=None):
+        """Add a pending job to session; it is only dispatched after the caller commits."""
+        job = AllocationJob(
+            job_id=uuid.uuid4().hex,
+            kind=kind,
+            job_key=job_key(kind, payload),
+            bill_month=payload["bill_month"],
+            bill_year=payload["bill_year"],
+            payload=json.dumps(payload, default=str),
+            status="pending",
+            attempts=0,
+            created_by=username,
+            created_at=datetime.now(),
+        )
+        session.add(job)
+        return job
+
+    def pending(self, session, kind, payload):
+        """True while a job for this row has not finished yet."""
+        return session.query(AllocationJob.job_id).filter(
+            AllocationJob.job_key == job_key(kind, payload),
+            AllocationJob.status.in_(("pending", "running")),
+        ).first() is not None
+
+    def latest(self, session, kind, payload):
+        """The row's most recent job, or None (allocated inline, or before the queue existed)."""
+        return session.query(AllocationJob).filter(
+            AllocationJob.job_key == job_key(kind, payload),
+        ).order_by(AllocationJob.created_at.desc()).first()
+
+    def retry(self, session, job_id):
+        """Put a failed job back to pending; the caller commits and dispatches it.  False if it isn't failed."""
+        return session.execute(update(AllocationJob).where(
+            AllocationJob.job_id == job_id,
+            AllocationJob.status == "failed",
+        ).values(status="pending", error=None, finished_at=None)).rowcount == 1
+
+    def dispatch(self, job_id):
+        self._ensure_started()
+        future = self._executor.submit(self.run, job_id)
+        with self._lock:
+            self.counters["submitted"] += 1
+            self._futures.add(future)
+        future.add_done_callback(self._discard)
+
+    def _discard(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def _ensure_started(self):
+        if self._pid != os.getpid():
+            # forked worker: the parent's threads don't exist here
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._reset()
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix="allocation")
+
+    # --- consumer side -----------------------------------------------------
+
+    def run(self, job_id):
+        """Claim and run one job; returns its final status, or None if another worker has it."""
+        with self.app.app_context():
+            claimed = db.session.execute(
+                update(AllocationJob).where(
+                    AllocationJob.job_id == job_id,
+                    AllocationJob.status == "pending",
+                ).values(status="running", started_at=datetime.now(), attempts=AllocationJob.attempts + 1)
+            ).rowcount
+            db.session.commit()
+            if not claimed:
+                return None
+
+            attempt = 1
+            while True:
+                try:
+                    job = db.session.get(AllocationJob, job_id)
+                    result = self._handlers[job.kind](db.session, json.loads(job.payload))
+                    job.status = "done"
+                    job.result = json.dumps(result, default=str)
+                    job.error = None
+                    job.finished_at = datetime.now()
+                    db.session.commit()
+                    self._count("done")
+                    return "done"
+                except Exception as e:
+                    db.session.rollback()
+                    if attempt < self.max_attempts and is_retryable(e):
+                        logger.warning(f"[ALLOCATION job {job_id}] attempt {attempt} failed, retrying: {e}")
+                        time.sleep(JOB_RETRY_DELAY * 2 ** (attempt - 1))
+                        attempt += 1
+                        self._set(job_id, attempts=AllocationJob.attempts + 1)
+                        self._count("retried")
+                        continue
+                    logger.error(f"[ALLOCATION job {job_id}] failed after {attempt} attempt(s): {e}")
+                    self._set(job_id, status="failed", error=str(e)[:4000], finished_at=datetime.now())
+                    self._count("failed")
+                    return "failed"
+
+    def _set(self, job_id, **values):
+        db.session.execute(update(AllocationJob).where(AllocationJob.job_id == job_id).values(**values))
+        db.session.commit()
+
+    def resume(self, stale_after=JOB_STALE_AFTER, failed=False, pending_after=None):
+        """
+        Put jobs stuck in "running" (and with failed=True the failed ones)
+        back to pending and run every pending job on this thread; with
+        pending_after only those created at least that long ago.
+        """
+        with self.app.app_context():
+            db.session.execute(update(AllocationJob).where(
+                AllocationJob.status == "running",
+                AllocationJob.started_at < datetime.now() - stale_after,
+            ).values(status="pending"))
+            if failed:
+                db.session.execute(update(AllocationJob).where(
+                    AllocationJob.status == "failed",
+                ).values(status="pending", error=None, finished_at=None))
+            db.session.commit()
+            query = db.select(AllocationJob.job_id).where(AllocationJob.status == "pending")
+            if pending_after is not None:
+                query = query.where(AllocationJob.created_at < datetime.now() - pending_after)
+            job_ids = db.session.scalars(query.order_by(AllocationJob.created_at)).all()
+        return {job_id: self.run(job_id) for job_id in job_ids}
+
+    def start_sweeper(self):
+        """
+        Run resume() now and every sweep_interval seconds on a daemon thread.
+        Start it in one process only; a job dispatched to a live worker is
+        left alone until it is JOB_STALE_AFTER old, and run() claims
+        atomically, so an overlap only costs a wasted claim.
+        """
+        if not self.enabled or not self.sweep_interval or self._sweeper is not None:
+            return
+        self._sweeper = threading.Thread(target=self._sweep, name="allocation-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def _sweep(self):
+        while True:
+            try:
+                results = self.resume(pending_after=JOB_STALE_AFTER)
+                if results:
+                    logger.warning(f"[ALLOCATION sweeper] resumed {len(results)} job(s): {results}")
+            except Exception as e:
+                logger.error(f"[ALLOCATION sweeper] {e}")
+            time.sleep(self.sweep_interval)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    # --- lifecycle / reporting ----------------------------------------------
+
+    def wait(self, timeout=None):
+        """Block until every job dispatched so far has finished (benchmarks, tests, shutdown)."""
+        with self._lock:
+            futures = list(self._futures)
+        wait_futures(futures, timeout=timeout)
+
+    def stop(self, timeout=None):
+        """Let the dispatched jobs finish and shut the pool down (registered with atexit)."""
+        executor = self._executor
+        if executor is None or self._pid != os.getpid():
+            return
+        self.wait(timeout)
+        executor.shutdown(wait=False)
+        self._executor = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats["in_flight"] = len(self._futures)
+        stats["workers"] = self.workers
+        stats["async"] = self.enabled
+        return stats
+
+
+allocation_queue = AllocationQueue()
+
+
+@allocation_queue.handler("gauge_bill")
+def run_gauge_bill(session, payload):
+    # locked first, like propagate_tech_bill does, so an intake bill is distributed exactly once
+    bill = month_gauge_bill(session, payload["account_number"], payload["bill_month"], payload["bill_year"],
+                            lock=True)
+    if bill is None:
+        return {"allocated": False, "reason": "bill deleted"}
+    gauge_sgts = topology_cache.get().relations(bill.account_number)
+    if not gauge_sgts:
+        return {"allocated": False, "reason": "no active relations"}
+    month_bills = month_tech_bills(session, [(r.station_id, r.technology_id) for r in gauge_sgts],
+                                   bill.bill_month, bill.bill_year, lock=True)
+    return {"allocated": allocate_gauge_bill(session, bill, gauge_sgts, month_bills)}
+
+
+@allocation_queue.handler("tech_bill")
+def run_tech_bill(session, payload):
+    result = propagate_tech_bill(session, payload["station_id"], payload["technology_id"],
+                                 payload["bill_month"], payload["bill_year"], lock=True)
+    return result if result is not None else {"reason": "bill deleted"}
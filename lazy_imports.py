@@ -0,0 +1,85 @@
+"""
+Deferred imports for the analytics stack (pandas, matplotlib, seaborn,
+plotly, sklearn, arabic_reshaper, bidi).
+
+Only the chart, prediction and report routes need these libraries, and
+importing them eagerly dominated worker start-up.  Each name exported here
+is a proxy that imports the real module the first time one of its
+attributes is used, so route code keeps writing `pd.DataFrame(...)` or
+`plt.subplots(...)` unchanged.
+
+    from lazy_imports import pd, plt
+    lazy_imports.loaded()            # names imported so far
+    lazy_imports.preload("pd", "plt")  # import up front (e.g. in a preforking master)
+"""
+
+import importlib
+import threading
+
+_lock = threading.Lock()
+
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use("Agg")  # ← force headless, non‑GUI backend
+
+
+class LazyModule:
+    def __init__(self, module_name, setup=None):
+        self._module_name = module_name
+        self._setup = setup
+        self._module = None
+
+    def _load(self):
+        module = self._module
+        if module is None:
+            with _lock:
+                module = self._module
+                if module is None:
+                    if self._setup is not None:
+                        self._setup()
+                    module = importlib.import_module(self._module_name)
+                    self._module = module
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._module_name!r} ({state})>"
+
+
+REGISTRY = {}
+
+
+def lazy(alias, module_name, setup=None):
+    module = REGISTRY[alias] = LazyModule(module_name, setup)
+    return module
+
+
+np = lazy("np", "numpy")
+pd = lazy("pd", "pandas")
+plt = lazy("plt", "matplotlib.pyplot", setup=_use_agg)
+sns = lazy("sns", "seaborn", setup=_use_agg)
+px = lazy("px", "plotly.express")
+linear_model = lazy("linear_model", "sklearn.linear_model")
+arabic_reshaper = lazy("arabic_reshaper", "arabic_reshaper")
+bidi_algorithm = lazy("bidi_algorithm", "bidi.algorithm")
+
+
+def get_display(*args, **kwargs):
+    """bidi.algorithm.get_display, imported on first call."""
+    return bidi_algorithm.get_display(*args, **kwargs)
+
+
+def loaded():
+    return sorted(alias for alias, module in REGISTRY.items() if module._module is not None)
+
+
+def preload(*aliases):
+    for alias in aliases or REGISTRY:
+        REGISTRY[alias]._load()
@@ -1,39 +1,47 @@
 import os
 from collections import defaultdict
 from decimal import Decimal
-import numpy as np
-from flask import Flask, abort, jsonify, render_template, request, make_response, current_app, g, has_request_context, session as flask_session
-from numpy.ma.extras import unique
-from seaborn._marks.area import Area
-from sklearn.metrics import r2_score, mean_absolute_error
-from sqlalchemy import and_, or_, not_, func, case, event, inspect, desc, exists
+from flask import Flask, Blueprint, abort, jsonify, render_template, request, make_response, current_app, g, has_request_context, session as flask_session
+from sqlalchemy import and_, or_, not_, func, case, event, inspect, desc, exists, create_engine
+from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError, DataError
 from flask_cors import CORS
 from models import *
 # from flask_login import login_user, LoginManager, current_user, logout_user
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from dotenv import load_dotenv
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt, verify_jwt_in_request
+from user_cache import user_cache, resolve_user
+from permissions import permission_matrix, seed_permissions
+from topology import topology_cache, bump_version
+from allocation import month_tech_bills, allocate_gauge_bill, propagate_tech_bill, add_to_tech_bills, \
+    resplit_station_meter
+from jobs import allocation_queue, gauge_bill_payload, tech_bill_payload
+from metrics import request_metrics
+from slow_queries import slow_query_log
+from pool_stats import engine_options, attach as attach_pool_stats, pool_stats
+from audit_retention import archive_audit_entries, include_object
+from recompute import recompute_month
+from datagen import generate_dataset, GEN_DATA_SEED, GEN_DATA_YEARS, GEN_DATA_END_YEAR, GEN_DATA_BATCH_SIZE
+from audit import audit_writer, capture_changes, precompute_mapper_infos, query_audit_log, parse_audit_date, \
+    AUDIT_PAGE_SIZE, AUDIT_MAX_PAGE_SIZE
+from config import Config
+import assets
+import charts
+import billing
+import tech_billing
+import idempotency
 from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
+import click
+import hmac
 from datetime import datetime, timedelta
-import pandas as pd
-import matplotlib
+# analytics stack is imported on first use (see lazy_imports.py)
+from lazy_imports import np, pd, plt, sns, px, linear_model, arabic_reshaper, get_display
 import json
-import plotly.express as px
 
-matplotlib.use("Agg")  # ← force headless, non‑GUI backend
-import matplotlib.pyplot as plt
-import matplotlib.dates as mdates
 import io
 import base64
-import arabic_reshaper
-from bidi.algorithm import get_display
-import seaborn as sns
-from sklearn.linear_model import LinearRegression
-import pyodbc
 from flask_migrate import Migrate  # Add this import
 from sqlalchemy import text
-import plotly.graph_objects as go
 
 # import secrets
 #
@@ -52,31 +60,9 @@ pip3 install -r requirements.txt
 This will install the packages from requirements.txt for this project.
 '''
 
-load_dotenv()
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv("FLASK_KEY")
-CORS(app)
-CORS(app, supports_credentials=True, origins=["http://localhost:5000"])
-
-# # Configure Flask-Login
-# login_manager = LoginManager()
-# login_manager.init_app(app)
-#
-#
-# @login_manager.user_loader
-# def load_user(emp_code):
-#     print("Loading user", emp_code)
-#     return db.get_or_404(User, emp_code)
-
-
-# Connect to Database
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv("DB_URI")
-db.init_app(app)
-# Initialize JWT
-app.config['JWT_SECRET_KEY'] = os.getenv("FLASK_KEY")
-# Access token: 30 days
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=30)
-jwt = JWTManager(app)
+bp = Blueprint("main", __name__, cli_group=None)
+jwt = JWTManager()
+migrate = Migrate()
 
 
 @event.listens_for(db.session, "before_commit")
@@ -89,76 +75,8 @@ def before_commit(session):
             return
         if not has_request_context():
             return
-        username = getattr(g, 'current_user_username', None) or flask_session.get('username', 'system')
-        audit_entries = []
-
-        # === INSERTS ===
-        for obj in session.new:
-            if hasattr(obj, '__tablename__') and obj.__tablename__ != 'auditing':
-                new_data = {
-                    col.name: getattr(obj, col.name)
-                    for col in obj.__table__.columns
-                }
-                audit_entries.append({
-                    'username': username,
-                    'action': 'INSERT',
-                    'table_name': obj.__tablename__,
-                    'old_data': None,
-                    'new_data': new_data
-                })
-
-        # === UPDATES ===
-        for obj in session.dirty:
-            if hasattr(obj, '__tablename__') and obj.__tablename__ != 'auditing':
-                insp = inspect(obj)
-                if not insp.attrs:
-                    continue
-
-                old_data = {}
-                new_data = {}
-
-                # Include primary keys in both old/new for clear identification
-                pk_values = {
-                    key.name: getattr(obj, key.name)
-                    for key in inspect(obj.__class__).primary_key
-                }
-
-                for attr in insp.attrs:
-                    hist = attr.history
-                    if hist.has_changes():
-                        old_val = hist.deleted[0] if hist.deleted else None
-                        new_val = hist.added[0] if hist.added else None
-                        old_data[attr.key] = old_val
-                        new_data[attr.key] = new_val
-
-                if old_data or new_data:
-                    # Merge PKs into old_data and new_data
-                    old_data.update(pk_values)
-                    new_data.update(pk_values)
-
-                    audit_entries.append({
-                        'username': username,
-                        'action': 'UPDATE',
-                        'table_name': obj.__tablename__,
-                        'old_data': old_data,
-                        'new_data': new_data,
-                    })
-        # === DELETES ===
-        for obj in session.deleted:
-            if hasattr(obj, '__tablename__') and obj.__tablename__ != 'auditing':
-                state = inspect(obj)
-                # Read column values from the instance’s internal state dictionary
-                old_data = {
-                    col.name: state.dict.get(col.name)
-                    for col in obj.__table__.columns
-                }
-                audit_entries.append({
-                    'username': username,
-                    'action': 'DELETE',
-                    'table_name': obj.__tablename__,
-                    'old_data': old_data,
-                    'new_data': None,
-                })
+        username = current_username()
+        audit_entries = capture_changes(session, username, getattr(g, "skip_audit_tables", ()))
 
         # Save for after_commit
         g.audit_entries = audit_entries
@@ -181,25 +99,9 @@ def after_commit(session):
 
         if not audit_entries:
             return
-        with db.engine.begin() as conn:
-            for entry in audit_entries:
-                print(f"[AUDIT DEBUG] Writing {len(audit_entries)} audit entries...")
-                print(json.dumps(entry, indent=2, ensure_ascii=False))
-
-                conn.execute(
-                    text("""
-                                        INSERT INTO auditing (username, audit_date, action, table_name, old_data, new_data)
-                                        VALUES (:u, :d, :a, :t, :old, :new)
-                                    """),
-                    {
-                        "u": entry["username"],
-                        "d": datetime.now(),
-                        "a": entry["action"],
-                        "t": entry["table_name"],
-                        "old": json.dumps(entry["old_data"], ensure_ascii=False) if entry["old_data"] else None,
-                        "new": json.dumps(entry["new_data"], ensure_ascii=False) if entry["new_data"] else None,
-                    }
-                )
+        # handed to the background writer; batched INSERTs happen off the request thread
+        audit_writer.enqueue(audit_entries)
+        g.audit_entries = []
 
     except Exception as e:
         if has_request_context():
@@ -213,8 +115,6 @@ def after_rollback(session):
         delattr(g, 'audit_entries')
 
 
-with app.app_context():
-    db.create_all()
 
     # # # Enable auditing for insert, update and delete actions
     # @event.listens_for(db.engine, "after_execute")
@@ -267,7 +167,6 @@ with app.app_context():
     #         current_app.logger.exception("Audit listener failed")
 
 
-migrate = Migrate(app, db)
 
 # # Add these error handlers
 # @jwt.expired_token_loader
@@ -303,7 +202,101 @@ migrate = Migrate(app, db)
 #         print(f"Auth header present: {auth_header[:30]}...")
 #     else:
 #         print("No Authorization header!")
-@app.errorhandler(422)
+@bp.cli.command("seed-permissions")
+def seed_permissions_command():
+    """Create a permission per protected route, granted to the groups in its decorator."""
+    added_permissions, added_grants = seed_permissions()
+    print(f"added {added_permissions} permissions and {added_grants} group grants")
+
+
+@bp.cli.command("audit-archive")
+@click.option("--days", type=int, default=None, help="Keep this many days in the live table (AUDIT_RETENTION_DAYS).")
+@click.option("--batch-size", type=int, default=2000)
+@click.option("--rollup/--no-rollup", default=True, help="Add archived entries to auditing_daily_rollup.")
+@click.option("--dry-run", is_flag=True, help="Only count the entries that would move.")
+def audit_archive_command(days, batch_size, rollup, dry_run):
+    """Move audit entries past the retention horizon into per-year compressed archive tables."""
+    if days is None:
+        days = current_app.config['AUDIT_RETENTION_DAYS']
+    stats = archive_audit_entries(db.engine, retention_days=days, batch_size=batch_size, rollup=rollup,
+                                  dry_run=dry_run)
+    print(stats)
+
+
+@bp.cli.command("idempotency-purge")
+@click.option("--hours", type=int, default=None, help="Keep keys this many hours old (IDEMPOTENCY_KEY_TTL).")
+def idempotency_purge_command(hours):
+    """Delete expired Idempotency-Key records (see idempotency.py)."""
+    ttl = timedelta(hours=hours) if hours is not None else idempotency.IDEMPOTENCY_KEY_TTL
+    try:
+        deleted = idempotency.purge_expired(db.session, ttl)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    print(f"{deleted} expired idempotency keys deleted")
+
+
+@bp.cli.command("gen-data")
+@click.option("--scale", type=int, default=1, help="Size multiplier; 1 is 25 stations with their gauges and bills.")
+@click.option("--seed", type=int, default=GEN_DATA_SEED)
+@click.option("--years", type=int, default=GEN_DATA_YEARS, help="Years of monthly bills.")
+@click.option("--end-year", type=int, default=GEN_DATA_END_YEAR, help="Last year of bills.")
+@click.option("--url", default=None, help="Target database URL (default: the app's database).")
+@click.option("--batch-size", type=int, default=GEN_DATA_BATCH_SIZE)
+def gen_data_command(scale, seed, years, end_year, url, batch_size):
+    """Fill an empty database with a synthetic dataset, deterministic by seed (see datagen.py)."""
+    if url:
+        engine = create_engine(url, **engine_options({**current_app.config, 'SQLALCHEMY_DATABASE_URI': url}))
+    else:
+        engine = db.engine
+    try:
+        counts, seconds = generate_dataset(engine, scale=scale, seed=seed, years=years, end_year=end_year,
+                                           batch_size=batch_size)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    finally:
+        if url:
+            engine.dispose()
+    for table_name, n in counts.items():
+        print(f"{table_name:<28}{n:>10}")
+    print(f"{sum(counts.values())} rows in {seconds:.1f}s")
+
+
+@bp.cli.command("recompute-month")
+@click.option("--year", type=int, required=True)
+@click.option("--month", type=click.IntRange(1, 12), required=True)
+@click.option("--branch", type=int, default=None, help="Only this branch's stations.")
+@click.option("--dry-run", is_flag=True, help="Only count the technology bills that would change.")
+@click.option("--current-relations", is_flag=True,
+              help="Rebuild with today's relations even if they changed after the month.")
+def recompute_month_command(year, month, branch, dry_run, current_relations):
+    """Rebuild a month's technology bill allocations from its gauge bills (see recompute.py)."""
+    try:
+        summary = recompute_month(db.session, year, month, branch_id=branch, dry_run=dry_run,
+                                  current_relations=current_relations)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+    except (ValueError, SQLAlchemyError) as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    print(summary)
+
+
+@bp.cli.command("resume-jobs")
+@click.option("--stale-minutes", type=int, default=10, help="Rerun jobs left running longer than this.")
+@click.option("--failed", is_flag=True, help="Also rerun the jobs that failed.")
+def resume_jobs_command(stale_minutes, failed):
+    """Run the allocation jobs a stopped worker left pending or running (see jobs.py)."""
+    results = allocation_queue.resume(timedelta(minutes=stale_minutes), failed=failed)
+    for job_id, status in results.items():
+        print(f"{job_id}  {status}")
+    print(f"{len(results)} jobs")
+
+
+@bp.app_errorhandler(422)
 def handle_422(e):
     print("💥 422 error:", e)
     return {"error": "Unprocessable Entity", "message": str(e)}, 422
@@ -330,8 +323,34 @@ def handle_422(e):
 #         db.session.commit()
 
 
-def private_route(allowed_groups):
+def current_username():
+    """Username for audit rows: private_route's user, else the token's username claim."""
+    username = getattr(g, 'current_user_username', None)
+    if username:
+        return username
+    try:
+        # routes without private_route (e.g. /new-bill) may still be called with a token
+        if verify_jwt_in_request(optional=True):
+            username = get_jwt().get('username')
+    except Exception:
+        username = None
+    return username or flask_session.get('username', 'system')
+
+
+def load_user(emp_code):
+    return db.session.get(User, emp_code)
+
+
+def private_route(allowed_groups, permission=None):
+    """
+    allowed_groups is the fallback when the permission (default: the route
+    function's name) has no row in premessions; otherwise the group/permission
+    matrix decides.
+    """
     def decorator(f):
+        permission_name = permission or f.__name__
+        permission_matrix.declare(permission_name, allowed_groups)
+
         # print(f"JWT_SECRET_KEY is set: {os.getenv('FLASK_KEY') is not None}")
         # print(f"JWT_ACCESS_TOKEN_EXPIRES: {app.config.get('JWT_ACCESS_TOKEN_EXPIRES')}")
         @wraps(f)
@@ -340,24 +359,26 @@ def private_route(allowed_groups):
             # Get user identity from JWT token
             current_user_id = get_jwt_identity()
 
-            # Load user from database
-            user = db.session.get(User, current_user_id)
+            # Resolve user from token claims + user cache; None for a deleted account or a revoked token
+            user = resolve_user(current_user_id, get_jwt(), load_user)
 
-            if not user:
+            if user is None:
+                return jsonify({'error': 'Token revoked, please log in again'}), 401
+            if not user.is_active:
                 return jsonify({'error': 'User not found'}), 403
 
-            # Check if user's group is allowed
-            if user.group_id not in allowed_groups:
-                return jsonify({'error': 'Access forbidden', 'required_groups': allowed_groups}), 403
+            # Check if user's group is allowed (single bit test once the matrix is loaded)
+            if not permission_matrix.is_allowed(user.group_id, permission_name, allowed_groups):
+                return jsonify({'error': 'Access forbidden',
+                                'required_groups': permission_matrix.allowed_groups(permission_name, allowed_groups)}), 403
 
             # Pass user to the route function (optional but useful)
             kwargs['current_user'] = user   # pass current_user or **kwargs as input to func to access the object
 
-            # ✅ Store username in g and flask_session for fallback
+            # ✅ Store username in g for the audit listeners
             g.current_user_username = user.username
             g.current_user_emp_code = user.emp_code
             g.current_user = user
-            flask_session['username'] = user.username
 
             return f(*args, **kwargs)
 
@@ -379,7 +400,7 @@ def private_route(allowed_groups):
 #     return decorator
 
 # Add this line to enable migrations
-def create_indexes_mssql():
+def create_indexes_mssql(app):
     with app.app_context():
         try:
             # Create indexes directly with SQL Server syntax
@@ -468,14 +489,7 @@ def create_indexes_mssql():
             db.session.rollback()
 
 
-def get_season(month):
-    if month in range(4, 11):  # 11 is exclusive, so covers 4 to 10
-        return "summer"
-    else:
-        return "winter"
-
-
-@app.route("/")
+@bp.route("/")
 @private_route([1, 2, 3, 4, 5, 7])
 def home(current_user):
     current_year = datetime.now().year
@@ -711,7 +725,7 @@ def home(current_user):
 
 
 
-@app.route("/stations")
+@bp.route("/stations")
 @private_route([1, 2, 3, 7])
 def stations(current_user):
     # print(current_user.emp_code) pass current_user as input to func to access the object
@@ -720,7 +734,7 @@ def stations(current_user):
     return jsonify(stations_list)
 
 
-@app.route("/edit-station/<station_id>", methods=["GET", "POST"])
+@bp.route("/edit-station/<station_id>", methods=["GET", "POST"])
 @private_route([1, 2])
 def edit_station(station_id, current_user):
     station = db.session.get(Station, station_id)
@@ -763,14 +777,12 @@ def edit_station(station_id, current_user):
     return jsonify({"response": {"success": "صل ع النبي"}})
 
 
-@app.route("/new-station", methods=["GET", "POST"])
+@bp.route("/new-station", methods=["GET", "POST"])
 @private_route([1, 2])
 def add_new_station(current_user):
-    branches = db.session.query(Branch).all()
-    branches_list = [branch.to_dict() for branch in branches]
+    branches_list = assets.catalog("branches")
 
-    sources = db.session.query(WaterSource).all()
-    sources_list = [source.to_dict() for source in sources]
+    sources_list = assets.catalog("water_sources")
     if request.method == "POST":
         data = request.get_json()
         print(data)
@@ -812,7 +824,7 @@ def add_new_station(current_user):
     return jsonify(branches=branches_list, water_sources=sources_list)
 
 
-@app.route("/technologies")
+@bp.route("/technologies")
 @private_route([1, 2, 3, 7])
 def technologies(current_user):
     all_techs = db.session.query(Technology).all()
@@ -820,7 +832,7 @@ def technologies(current_user):
     return jsonify(techs_list)
 
 
-@app.route("/edit-tech/<tech_id>", methods=["GET", "POST"])
+@bp.route("/edit-tech/<tech_id>", methods=["GET", "POST"])
 @private_route([1, 2, 3])
 def edit_tech(tech_id, current_user):
     tech = db.session.get(Technology, tech_id)
@@ -859,7 +871,7 @@ def edit_tech(tech_id, current_user):
     return jsonify({"respose": "اذكر الله"})  # current_user_permissions=current_user_permissions
 
 
-@app.route("/new-tech", methods=["GET", "POST"])
+@bp.route("/new-tech", methods=["GET", "POST"])
 @private_route([1, 2, 3])
 def add_new_tech(current_user):
     if request.method == "POST":
@@ -902,7 +914,7 @@ def add_new_tech(current_user):
         "response": "user permissions will be instead of this response"})  # current_user_permissions=current_user_permissions
 
 
-@app.route("/gauges")
+@bp.route("/gauges")
 @private_route([1, 3])
 def gauges(current_user):
     all_gauges = db.session.query(Gauge).all()
@@ -912,7 +924,7 @@ def gauges(current_user):
     return jsonify(gauges_list)
 
 
-@app.route("/edit-gauge", methods=["GET", "POST"])
+@bp.route("/edit-gauge", methods=["GET", "POST"])
 @private_route([1, 3])
 def edit_gauge(current_user):
     if request.method == "POST":
@@ -950,7 +962,7 @@ def edit_gauge(current_user):
     return jsonify({"response": "لا اله الا الله"})
 
 
-@app.route("/new-gauge", methods=["GET", "POST"])
+@bp.route("/new-gauge", methods=["GET", "POST"])
 @private_route([1, 3])
 def add_new_gauge(current_user):
     voltage_types = db.session.query(Voltage).all()
@@ -996,7 +1008,7 @@ def add_new_gauge(current_user):
     return jsonify(v_t_list)
 
 
-@app.route("/stg-relations")
+@bp.route("/stg-relations")
 @private_route([1, 3, 7])
 def stg_relations(current_user):
     all_stgs = db.session.query(StationGaugeTechnology).all()
@@ -1005,7 +1017,7 @@ def stg_relations(current_user):
     return jsonify(stgs_list)
 
 
-@app.route("/new-relation", methods=["GET", "POST"])
+@bp.route("/new-relation", methods=["GET", "POST"])
 @private_route([1, 3])
 def add_new_stg(current_user):
     all_stations = db.session.query(Station).all()
@@ -1035,9 +1047,11 @@ def add_new_stg(current_user):
             account_number=data['account_number'],
             relation_status=True,
             is_source=data['is_source'],
+            status_changed_at=datetime.now(),
         )
 
         db.session.add(new_stg)
+        bump_version(db.session)
         try:
             db.session.commit()
         except IntegrityError as e:
@@ -1055,6 +1069,7 @@ def add_new_stg(current_user):
             db.session.rollback()
             return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
         else:
+            topology_cache.invalidate()
             response = {
                 "response": {
                     "success": "تم ربط البيانات بنجاح"
@@ -1065,12 +1080,14 @@ def add_new_stg(current_user):
     return jsonify(stations=stations_list, gauges=gauges_list, techs=techs_list)
 
 
-@app.route("/edit-relation/<relation_id>", methods=["GET", "POST"])
+@bp.route("/edit-relation/<relation_id>", methods=["GET", "POST"])
 @private_route([1, 3])
 def cancel_relation(relation_id, current_user):
     current_relation = db.session.query(StationGaugeTechnology).filter(
         StationGaugeTechnology.station_guage_technology_id == relation_id).first()
     current_relation.relation_status = not current_relation.relation_status
+    current_relation.status_changed_at = datetime.now()
+    bump_version(db.session)
     try:
         db.session.commit()
     except IntegrityError as e:
@@ -1087,6 +1104,7 @@ def cancel_relation(relation_id, current_user):
         db.session.rollback()
         return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
     else:
+        topology_cache.invalidate()
         response = {
             "response": {
                 "success": "تم تعديل البيانات بنجاح"
@@ -1095,30 +1113,37 @@ def cancel_relation(relation_id, current_user):
         return jsonify(response), 200
 
 
-@app.route("/new-bill/<path:account_number>", methods=["GET", "POST"])
+@bp.route("/new-bill/<path:account_number>", methods=["GET", "POST"])
 # @private_route([1, 3])
 def add_new_bill(account_number):
     print(account_number)
     # show_percent = False
-    gauge_sgts = db.session.query(StationGaugeTechnology).filter(
-        and_(
-            StationGaugeTechnology.account_number == account_number,
-            StationGaugeTechnology.relation_status == True
-        )
-    ).all()
+    # active relations from the topology index
+    gauge_sgts = topology_cache.get().relations(account_number)
 
     # if len(gauge_sgts) > 1:
     #     show_percent = True
-    gauge_sgt_list = [r.to_dict() for r in gauge_sgts]
-    print(gauge_sgt_list)
     if not gauge_sgts:
-        return jsonify(gauge_sgt_list=gauge_sgt_list,
+        return jsonify(gauge_sgt_list=[],
                        error={"error": "هذا العداد غير مرتبط بمحطة، برجاء ربط العداد أولا"}), 409
     if request.method == "POST":
         data = request.get_json()
         print(data)
 
-        gauge = db.session.get(Gauge, account_number)
+        # optional: a retried request with the same key gets the first response back instead of a second bill
+        idempotency_key = request.headers.get(idempotency.IDEMPOTENCY_HEADER)
+        if idempotency_key:
+            if len(idempotency_key) > idempotency.IDEMPOTENCY_KEY_MAX_LENGTH:
+                return jsonify({"error": "مفتاح التكرار أطول من المسموح"}), 400
+            req_hash = idempotency.request_hash(request.method, request.path, data)
+            try:
+                replay = idempotency.lookup(db.session, idempotency_key, req_hash)
+            except ValueError as e:
+                return jsonify({"error": "مفتاح التكرار مستخدم لطلب مختلف", "details": str(e)}), 422
+            if replay is not None:
+                return replay
+
+        gauge = db.session.get(Gauge, account_number, options=[joinedload(Gauge.voltage)])
         # last_bill = (
         #     GuageBill.query
         #     .filter_by(account_number=account_number)
@@ -1158,7 +1183,7 @@ def add_new_bill(account_number):
             stamp=data['stamp'],
             prev_payments=data['prev_payments'],
             rounding=data['rounding'],
-            bill_total=data['bill_total'],
+            bill_total=Decimal(str(data['bill_total'])),   # Decimal like the stored value the allocation adds to
             is_paid=data['is_paid'],
             notes=data['notes'],
             delay_month=data['delay_month'],
@@ -1227,12 +1252,67 @@ def add_new_bill(account_number):
         #             or (round(sum(data['percent_money'])) != round(data['bill_total']))):
         #         return jsonify({"error": "توزيع كميات الطاقة أو القيمة لا يساوي المجموع المدخل"}), 413
 
+        # the bill, the gauge's final_reading, the allocation (or its job) and the idempotency record are
+        # one transaction.  The reading and existing tech bills change in place with Core UPDATEs, the rest
+        # is flushed once at commit.  The month's tech bills are read before anything is pending, so no
+        # autoflush pushes the bill out of session.new before the audit listener sees it.
+        if not allocation_queue.enabled:
+            month_bills = month_tech_bills(db.session, [(r.station_id, r.technology_id) for r in gauge_sgts],
+                                           new_bill.bill_month, new_bill.bill_year)
+        # compare-and-set: a bill entered for this gauge meanwhile has already moved its reading on
+        if billing.advance_final_readings(db.session, [(account_number, gauge.final_reading,
+                                                        new_bill.current_reading)]):
+            db.session.rollback()
+            if idempotency_key:
+                # a concurrent retry with the same key may have committed first
+                replay = idempotency.lookup(db.session, idempotency_key, req_hash)
+                if replay is not None:
+                    return replay
+            return jsonify({"error": "القراءة السابقة غير مطابقة لآخر قراءة مسجلة لدينا"}), 410
         db.session.add(new_bill)
+
+        # --- skip audit for the automatic updates
+        g.skip_audit_tables = (TechnologyBill.__tablename__, IdempotencyKey.__tablename__,
+                               AllocationJob.__tablename__)
+
+        response = {
+            "response": {
+                "success": "تم إضافة الفاتورة بنجاح"
+            }
+        }
+        status = 200
+        job_id = None
+        if allocation_queue.enabled:
+            # the related tech bills are updated by a background job once the bill is committed (jobs.py)
+            job_id = allocation_queue.enqueue(db.session, "gauge_bill", gauge_bill_payload(new_bill),
+                                              current_username()).job_id
+            response["job_id"] = job_id
+            status = 202
+        else:
+            with db.session.no_autoflush:
+                calculated = allocate_gauge_bill(db.session, new_bill, gauge_sgts, month_bills)
+            if gauge_sgts[0].is_source:
+                if calculated:
+                    response = {
+                        "response": {
+                            "success": "تم اضافة الفاتورة بنجاح"
+                        }
+                    }
+                else:
+                    response = {"success": True}
+
+        if idempotency_key:
+            idempotency.remember(db.session, idempotency_key, req_hash, status, response)
         try:
             db.session.commit()
         except IntegrityError as e:
             print(e)
             db.session.rollback()
+            if idempotency_key:
+                # a concurrent retry with the same key may have committed first
+                replay = idempotency.lookup(db.session, idempotency_key, req_hash)
+                if replay is not None:
+                    return replay
             return jsonify(
                 {"error": "خطأ في تكامل البيانات: قد تكون البيانات مكررة أو غير صالحة", "details": str(e)}), 400
         except DataError as e:
@@ -1246,177 +1326,159 @@ def add_new_bill(account_number):
         except Exception as e:
             db.session.rollback()
             return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
-        else:
-            new_bill.guage.final_reading = new_bill.current_reading
-            db.session.commit()
+        # import requests
+        # FCM_SERVER_KEY = "YOUR_FCM_KEY"
+        #
+        # def send_push(token, title, body):
+        #     headers = {
+        #         'Authorization': 'key=' + FCM_SERVER_KEY,
+        #         'Content-Type': 'application/json'
+        #     }
+        #     payload = {
+        #         'to': token,
+        #         'notification': {'title': title, 'body': body}
+        #     }
+        #     requests.post('https://fcm.googleapis.com/fcm/send', headers=headers, json=payload)
+        # the final_reading UPDATE is a Core statement, the session's audit hooks don't see it
+        audit_writer.enqueue([{
+            "username": current_username(), "action": "UPDATE", "table_name": Gauge.__tablename__,
+            "old_data": {"final_reading": data['prev_reading'], "account_number": account_number},
+            "new_data": {"final_reading": data['current_reading'], "account_number": account_number},
+        }])
+        if job_id:
+            allocation_queue.dispatch(job_id)
+        return jsonify(response), status
+    gauge_sgt_list = [r.to_dict() for r in db.session.query(StationGaugeTechnology).options(
+        joinedload(StationGaugeTechnology.station).joinedload(Station.branch),
+        joinedload(StationGaugeTechnology.technology),
+        joinedload(StationGaugeTechnology.guage),
+    ).filter(StationGaugeTechnology.station_guage_technology_id.in_([r.relation_id for r in gauge_sgts]))]
+    print(gauge_sgt_list)
+    return jsonify(gauge_sgt_list=gauge_sgt_list)  #, show_percent=show_percent
 
-            # --- skip audit for the automatic updates
-            g.skip_audit = True
 
-            if gauge_sgts[0].is_source:
-                related_bills = []
-                for g_sgt in gauge_sgts:
-                    bill = TechnologyBill.query.filter(
-                        TechnologyBill.station_id == g_sgt.station_id,
-                        TechnologyBill.technology_id == g_sgt.technology_id,
-                        TechnologyBill.bill_month == new_bill.bill_month,
-                        TechnologyBill.bill_year == new_bill.bill_year
-                    ).first()
-                    if bill:
-                        related_bills.append(bill)
-                    else:
-                        break
-                if len(gauge_sgts) == len(related_bills):
-                    should_calculate = True
-                    total_water = 0
-                    for related_bill in related_bills:
-                        if related_bill.technology_water_amount == None or related_bill.technology_bill_percentage == None:
-                            should_calculate = False
-                            break
-                        else:
-                            total_water += related_bill.technology_water_amount
-                    if should_calculate:
-                        for r_b in related_bills:
-                            if total_water:
-                                if r_b.technology_power_consump == None:
-                                    r_b.technology_power_consump = new_bill.power_consump * r_b.technology_water_amount / total_water
-                                    r_b.technology_bill_total = new_bill.bill_total * Decimal(r_b.technology_water_amount / total_water)
-                                else:
-                                    r_b.technology_power_consump += new_bill.power_consump * r_b.technology_water_amount / total_water
-                                    r_b.technology_bill_total += new_bill.bill_total * Decimal(r_b.technology_water_amount / total_water)
-                            else:
-                                if r_b.technology_power_consump == None:
-                                    r_b.technology_power_consump = new_bill.power_consump / len(gauge_sgts)
-                                    r_b.technology_bill_total = new_bill.bill_total / Decimal(len(gauge_sgts))
-                                else:
-                                    r_b.technology_power_consump += new_bill.power_consump / len(gauge_sgts)
-                                    r_b.technology_bill_total += new_bill.bill_total / Decimal(len(gauge_sgts))
-                        try:
-                            db.session.commit()
-                        except IntegrityError as e:
-                            print(e)
-                            db.session.rollback()
-                            return jsonify(
-                                {"error": "خطأ في تكامل البيانات: قد تكون البيانات مكررة أو غير صالحة",
-                                 "details": str(e)}), 400
-                        except DataError as e:
-                            print(e)
-                            db.session.rollback()
-                            return jsonify({"error": "خطأ في نوع البيانات أو الحجم", "details": str(e)}), 404
-                        except SQLAlchemyError as e:
-                            print(e)
-                            db.session.rollback()
-                            return jsonify({"error": "خطأ في قاعدة البيانات", "details": str(e)}), 500
-                        except Exception as e:
-                            print(e)
-                            db.session.rollback()
-                            return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
-                        else:
-                            for r_b in related_bills:
-                                print(r_b.to_dict())
-                            response = {
-                                "response": {
-                                    "success": "تم اضافة الفاتورة بنجاح"
-                                }
-                            }
-                            return jsonify(response), 200
-                        finally:
-                            g.skip_audit = False
+@bp.route("/bills/import", methods=["POST"])
+@private_route([1, 3])
+def import_bills(current_user):
+    """
+    multipart form: file (.csv/.xlsx statement), bill_month, bill_year and
+    optional dry_run.  Invalid rows are returned with their errors; the valid
+    ones are stored in one transaction (see billing.py).
+    """
+    upload = request.files.get('file')
+    try:
+        bill_month = int(request.form['bill_month'])
+        bill_year = int(request.form['bill_year'])
+        if not upload or bill_month not in range(1, 13):
+            raise ValueError("file, bill_month (1-12) and bill_year are required")
+        df = billing.read_bill_file(upload)
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": "ملف الفواتير أو بيانات الشهر غير صالحة", "details": str(e)}), 400
+    dry_run = request.form.get('dry_run', '').lower() in ('1', 'true', 'yes')
 
-                g.skip_audit = False
-                return jsonify({"success": True}), 200
-            else:
-                #  search station gauge technology relation then insert in technology bill the corresponding data
-                # one to one relations or many to one relations
-                if len(gauge_sgts) == 1:
-                    # check if a single or multi gauges are providing for same tech
-                    current_tech_bill = db.session.query(TechnologyBill).filter(
-                        TechnologyBill.station_id == gauge_sgts[0].station_id,
-                        TechnologyBill.technology_id == gauge_sgts[0].technology_id,
-                        TechnologyBill.bill_month == new_bill.bill_month,
-                        TechnologyBill.bill_year == new_bill.bill_year).first()
-                    if current_tech_bill:
-                        # current_tech_bill.technology_bill_percentage = 100
-                        if current_tech_bill.technology_power_consump != None:
-                            current_tech_bill.technology_power_consump += new_bill.power_consump
-                            current_tech_bill.technology_bill_total += new_bill.bill_total
-                        else:
-                            current_tech_bill.technology_power_consump = new_bill.power_consump
-                            current_tech_bill.technology_bill_total = new_bill.bill_total
-                    else:
-                        tech_bill = TechnologyBill(
-                            station_id=gauge_sgts[0].station_id,
-                            technology_id=gauge_sgts[0].technology_id,
-                            bill_month=new_bill.bill_month,
-                            bill_year=new_bill.bill_year,
-                            technology_power_consump=new_bill.power_consump,
-                            technology_bill_total=new_bill.bill_total,
-                            technology_bill_percentage=100
-                        )
-                        db.session.add(tech_bill)
-                # one to many and many to many relations
-                else:
-                    for i in range(len(gauge_sgts)):
-                        # check if a single or multi gauges are providing for same tech
-                        current_tech_bill = db.session.query(TechnologyBill).filter(
-                            TechnologyBill.station_id == gauge_sgts[i].station_id,
-                            TechnologyBill.technology_id == gauge_sgts[i].technology_id,
-                            TechnologyBill.bill_month == new_bill.bill_month,
-                            TechnologyBill.bill_year == new_bill.bill_year).first()
-                        if current_tech_bill:
-                            if not current_tech_bill.technology_bill_percentage:
-                                if current_tech_bill.technology_power_consump != None:
-                                    current_tech_bill.technology_power_consump += new_bill.power_consump  #add it any way and divide it according to water amount
-                                    current_tech_bill.technology_bill_total += new_bill.bill_total  #add it any way and divide it according to water amount
-                                else:
-                                    current_tech_bill.technology_power_consump = new_bill.power_consump  # add it any way and divide it according to water amount
-                                    current_tech_bill.technology_bill_total = new_bill.bill_total  # add it any way and divide it according to water amount
-                            else:
-                                if current_tech_bill.technology_power_consump != None:
-                                    current_tech_bill.technology_power_consump += new_bill.power_consump * current_tech_bill.technology_bill_percentage / 100
-                                    current_tech_bill.technology_bill_total += new_bill.bill_total * Decimal(current_tech_bill.technology_bill_percentage / 100)
-                                else:
-                                    current_tech_bill.technology_power_consump = new_bill.power_consump * current_tech_bill.technology_bill_percentage / 100
-                                    current_tech_bill.technology_bill_total = new_bill.bill_total * Decimal(current_tech_bill.technology_bill_percentage / 100)
-                        else:
-                            tech_bill = TechnologyBill(
-                                station_id=gauge_sgts[i].station_id,
-                                technology_id=gauge_sgts[i].technology_id,
-                                bill_month=new_bill.bill_month,
-                                bill_year=new_bill.bill_year,
-                                technology_power_consump=new_bill.power_consump,    #add it any way and divide it according to water amount
-                                technology_bill_total=new_bill.bill_total           #add it any way and divide it according to water amount
-                            )
-                            db.session.add(tech_bill)
-                db.session.commit()
+    try:
+        valid, errors = billing.validate_bills(db.session, df, bill_month, bill_year)
+        summary, audit_entries = billing.import_bills(db.session, valid, bill_month, bill_year,
+                                                      current_user.username, dry_run=dry_run)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        return jsonify({"error": "خطأ في تكامل البيانات: قد تكون البيانات مكررة أو غير صالحة", "details": str(e)}), 400
+    except DataError as e:
+        db.session.rollback()
+        return jsonify({"error": "خطأ في نوع البيانات أو الحجم", "details": str(e)}), 404
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify({"error": "خطأ في قاعدة البيانات", "details": str(e)}), 500
+    except ValueError as e:
+        # a gauge's reading was advanced by another entry while the file was being imported
+        db.session.rollback()
+        return jsonify({"error": "القراءة السابقة غير مطابقة لآخر قراءة مسجلة لدينا", "details": str(e)}), 410
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
 
-                # --- # ensure it’s turned back off
-                g.skip_audit = False
+    # Core executemany statements bypass the session's audit hooks
+    audit_writer.enqueue(audit_entries)
+    row_errors = [
+        {"row": int(row), "account_number": None if pd.isna(df.at[row, 'account_number']) else str(df.at[row, 'account_number']),
+         "errors": [{"code": code, "error": message} for code, message in messages]}
+        for row, messages in sorted(errors.items())
+    ]
+    response = {
+        "response": {
+            "success": "تم التحقق من الفواتير" if dry_run else "تم استيراد الفواتير بنجاح"
+        },
+        "dry_run": dry_run,
+        "rejected": len(row_errors),
+        **summary,
+        "errors": row_errors,
+    }
+    return jsonify(response), 200 if summary["imported"] or not row_errors else 400
 
-                response = {
-                    "response": {
-                        "success": "تم إضافة الفاتورة بنجاح"
-                    }
-                }
-                # import requests
-                # FCM_SERVER_KEY = "YOUR_FCM_KEY"
-                #
-                # def send_push(token, title, body):
-                #     headers = {
-                #         'Authorization': 'key=' + FCM_SERVER_KEY,
-                #         'Content-Type': 'application/json'
-                #     }
-                #     payload = {
-                #         'to': token,
-                #         'notification': {'title': title, 'body': body}
-                #     }
-                #     requests.post('https://fcm.googleapis.com/fcm/send', headers=headers, json=payload)
-                return jsonify(response), 200
-    return jsonify(gauge_sgt_list=gauge_sgt_list)  #, show_percent=show_percent
 
+@bp.route("/bills/rollback", methods=["POST"])
+@private_route([1, 3])
+def rollback_bills(current_user):
+    """
+    JSON: bill_month, bill_year, optional branch_id and dry_run.  Deletes the
+    month's gauge bills and reverses their allocation and final readings in
+    one transaction (see billing.rollback_month); dry_run only reports.
+    """
+    data = request.get_json() or {}
+    try:
+        bill_month = int(data['bill_month'])
+        bill_year = int(data['bill_year'])
+        branch_id = None if data.get('branch_id') in (None, '') else int(data['branch_id'])
+        if bill_month not in range(1, 13):
+            raise ValueError("bill_month must be 1-12")
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": "بيانات الشهر غير صالحة", "details": str(e)}), 400
+    dry_run = bool(data.get('dry_run'))
+
+    # the deleted bills and restored readings are audited below; the allocation changes are not
+    g.skip_audit = True
+    try:
+        summary, audit_entries = billing.rollback_month(db.session, bill_month, bill_year,
+                                                        current_user.username, branch_id=branch_id)
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({"error": "لا يمكن إلغاء فواتير هذا الشهر", "details": str(e)}), 409
+    except IntegrityError as e:
+        db.session.rollback()
+        return jsonify({"error": "خطأ في تكامل البيانات: قد تكون البيانات مكررة أو غير صالحة", "details": str(e)}), 400
+    except DataError as e:
+        db.session.rollback()
+        return jsonify({"error": "خطأ في نوع البيانات أو الحجم", "details": str(e)}), 404
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify({"error": "خطأ في قاعدة البيانات", "details": str(e)}), 500
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
+    finally:
+        g.skip_audit = False
+
+    if not dry_run:
+        audit_writer.enqueue(audit_entries)
+    response = {
+        "response": {
+            "success": "تم التحقق من الفواتير" if dry_run else "تم إلغاء فواتير الشهر بنجاح"
+        },
+        "dry_run": dry_run,
+        **summary,
+    }
+    return jsonify(response), 200
 
 
-@app.route("/view-bills", methods=["GET"])
+@bp.route("/view-bills", methods=["GET"])
 @private_route([1, 3])
 def view_bills(current_user):
     bills = db.session.query(GuageBill).all()
@@ -1425,7 +1487,7 @@ def view_bills(current_user):
     return jsonify(bills_list)
 
 
-@app.route("/delete-bill/<path:account_number>", methods=['GET'])
+@bp.route("/delete-bill/<path:account_number>", methods=['GET'])
 @private_route([1, 3])
 def delete_bill(account_number, current_user):
     wrong_bill = (
@@ -1434,55 +1496,40 @@ def delete_bill(account_number, current_user):
         .order_by(GuageBill.bill_year.desc(), GuageBill.bill_month.desc())
         .first()
     )
-    source_stg = StationGaugeTechnology.query.filter(
-        StationGaugeTechnology.account_number == account_number,
-        StationGaugeTechnology.is_source == True
-    ).first()
-    if source_stg:
+    topology = topology_cache.get()
+    if topology.is_intake_meter(account_number):
         return jsonify({"error": "عداد مأخذ، لم يتم الحذف"}), 404
-    gauge_sgts = db.session.query(StationGaugeTechnology).filter(
-        and_(
-            StationGaugeTechnology.account_number == account_number,
-            StationGaugeTechnology.relation_status == True,
-            StationGaugeTechnology.is_source == False
-        )
-    ).all()
-    tech_bills_related = []
-    for rel in gauge_sgts:
-        tech_bill = db.session.query(TechnologyBill).filter(
-            TechnologyBill.station_id == rel.station_id,
-            TechnologyBill.technology_id == rel.technology_id,
-            TechnologyBill.bill_month == wrong_bill.bill_month,
-            TechnologyBill.bill_year == wrong_bill.bill_year
-        ).first()
-        if tech_bill:
-            tech_bills_related.append(tech_bill)
-
-    # --- skip audit for the automatic updates
-    g.skip_audit = True
-
-    for t_b in tech_bills_related:
-        if t_b.technology_bill_percentage == None or t_b.technology_bill_percentage == 100:
-            t_b.technology_power_consump -= wrong_bill.power_consump
-            t_b.technology_bill_total -= wrong_bill.bill_total
-        else:
-            t_b.technology_power_consump -= wrong_bill.power_consump * t_b.technology_bill_percentage / 100
-            t_b.technology_bill_total -= Decimal(float(str(wrong_bill.bill_total)) * t_b.technology_bill_percentage / 100)
-    db.session.commit()
-    gauge = db.session.get(Gauge, account_number)
-    gauge.final_reading = wrong_bill.prev_reading
-    db.session.commit()
-
-    # --- skip audit for the automatic updates
-    g.skip_audit = False
-
+    job = allocation_queue.latest(db.session, "gauge_bill", gauge_bill_payload(wrong_bill))
+    if job and job.status in ("pending", "running"):
+        # its allocation has not been applied yet, there would be nothing to take back
+        return jsonify({"error": "جاري توزيع الفاتورة على التكنولوجيات، برجاء المحاولة بعد قليل"}), 409
+    if job and job.status == "failed":
+        # nothing was added; rerun the job (/jobs/<job_id>/retry) or the bill can't be taken back consistently
+        return jsonify({"error": "فشل توزيع الفاتورة على التكنولوجيات، برجاء إعادة تشغيل المهمة أولا",
+                        "job_id": job.job_id}), 409
+    # bills allocated inline have no job; a job that found nothing to allocate to added nothing
+    allocated = job is None or json.loads(job.result or "{}").get("allocated") is True
+    gauge_sgts = topology.relations(account_number, is_source=False) if allocated else []
+
+    # one transaction: compare-and-set the reading back first, a reading entered after this bill is not
+    # this bill's to take back
+    if billing.advance_final_readings(db.session, [(account_number, wrong_bill.current_reading,
+                                                    wrong_bill.prev_reading)]):
+        db.session.rollback()
+        return jsonify({"error": "تم تسجيل قراءة أحدث لهذا العداد، لم يتم الحذف"}), 410
+    # take the bill back out in place (its share of rows already split by percentage), like it was added;
+    # both are Core UPDATEs and not audited, the bill's delete is
+    add_to_tech_bills(db.session, wrong_bill.bill_month, wrong_bill.bill_year, [
+        {"b_station_id": rel.station_id, "b_technology_id": rel.technology_id,
+         "b_power": -wrong_bill.power_consump, "b_total": -wrong_bill.bill_total} for rel in gauge_sgts
+    ], by_percentage=True)
     print(wrong_bill.to_dict())
     db.session.delete(wrong_bill)
     db.session.commit()
     return jsonify({"response": "تم حذف الفاتورة بنجاح"}), 200
 
 
-@app.route("/tech-bills")
+@bp.route("/tech-bills")
 @private_route([1, 2, 7])
 def show_null_tech_bills(current_user):
     # Comprehensive check for various "empty" values
@@ -1494,7 +1541,79 @@ def show_null_tech_bills(current_user):
     return jsonify(tech_bills_list)
 
 
-@app.route("/edit-tech-bill/<tech_bill_id>", methods=["GET", "POST"])
+def propagate_tech_bill_entry(bill, on_conflict=None):
+    """
+    Commit a technology bill's water/chemical entry, then its follow-up
+    (allocation.propagate_tech_bill): as a background job when ALLOCATION_ASYNC
+    is on, answered with 202 and the job id, else inline in a second commit.
+    If the entry's commit hits an IntegrityError, on_conflict() (when given)
+    answers instead of the 400, after the rollback.
+    """
+    payload = tech_bill_payload(bill)
+    job_id = None
+    if allocation_queue.enabled:
+        job_id = allocation_queue.enqueue(db.session, "tech_bill", payload, current_username()).job_id
+        g.skip_audit_tables = (AllocationJob.__tablename__,)
+
+    try:
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        print(e)
+        if on_conflict is not None:
+            return on_conflict()
+        return jsonify(
+            {"error": "خطأ في تكامل البيانات: قد تكون البيانات مكررة أو غير صالحة", "details": str(e)}), 400
+    except DataError as e:
+        db.session.rollback()
+        return jsonify({"error": "خطأ في نوع البيانات أو الحجم", "details": str(e)}), 404
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(e)
+        return jsonify({"error": "خطأ في قاعدة البيانات", "details": str(e)}), 500
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
+
+    response = {
+        "response": {
+            "success": "تم ادخال البيانات بنجاح"
+        }
+    }
+    if job_id:
+        allocation_queue.dispatch(job_id)
+        response["job_id"] = job_id
+        return jsonify(response), 202
+
+    propagate_tech_bill(db.session, **payload)
+
+    # --- skip audit for the automatic updates
+    g.skip_audit = True
+
+    try:
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        return jsonify(
+            {"error": "خطأ في تكامل البيانات: قد تكون البيانات مكررة أو غير صالحة", "details": str(e)}), 400
+    except DataError as e:
+        db.session.rollback()
+        return jsonify({"error": "خطأ في نوع البيانات أو الحجم", "details": str(e)}), 404
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(e)
+        return jsonify({"error": "خطأ في قاعدة البيانات", "details": str(e)}), 500
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
+    else:
+        return jsonify(response), 200
+    finally:
+        # ✅ Always re-enable auditing for future commits
+        g.skip_audit = False
+
+
+@bp.route("/edit-tech-bill/<tech_bill_id>", methods=["GET", "POST"])
 @private_route([1, 2])
 def edit_tech_bill(tech_bill_id, current_user):
     bill = db.session.query(TechnologyBill).filter(TechnologyBill.tech_bill_id == tech_bill_id).first()
@@ -1507,10 +1626,6 @@ def edit_tech_bill(tech_bill_id, current_user):
         if data['technology_water_amount'] != data['measured_water'] + data['calculated_water']:
             return jsonify({"error": "كمية المياه الاجمالية غير مطابقة لمجموع المقاس والمحسوب"}), 405
 
-        g.skip_audit = True
-        bill.power_per_water = bill.technology.power_per_water
-        g.skip_audit = False
-
         # if data['technology_water_amount'] == 0:
         #     return jsonify({"error": "يجب أن تكون كمية المياه المنتجة اكبر من صفر"})
         # if data['technology_chlorine_consump'] == 0:
@@ -1521,184 +1636,70 @@ def edit_tech_bill(tech_bill_id, current_user):
         bill.technology_water_amount = data['technology_water_amount']
         bill.measured_water = data['measured_water']
         bill.calculated_water = data['calculated_water']
-
-        try:
-            db.session.commit()
-        except IntegrityError as e:
-            db.session.rollback()
-            return jsonify(
-                {"error": "خطأ في تكامل البيانات: قد تكون البيانات مكررة أو غير صالحة", "details": str(e)}), 400
-        except DataError as e:
-            db.session.rollback()
-            return jsonify({"error": "خطأ في نوع البيانات أو الحجم", "details": str(e)}), 404
-        except SQLAlchemyError as e:
-            db.session.rollback()
-            print(e)
-            return jsonify({"error": "خطأ في قاعدة البيانات", "details": str(e)}), 500
-        except Exception as e:
-            db.session.rollback()
-            return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
-
-        current_season = get_season(bill.bill_month)
-        current_water_source = bill.station.water_source_id
-        chemicals_ref = db.session.query(AlumChlorineReference).filter(
-            AlumChlorineReference.technology_id == bill.technology_id,
-            AlumChlorineReference.season == current_season,
-            AlumChlorineReference.water_source_id == current_water_source).first()
-        if chemicals_ref:
-            bill.chlorine_range_from = chemicals_ref.chlorine_range_from
-            bill.chlorine_range_to = chemicals_ref.chlorine_range_to
-            bill.liquid_alum_range_from = chemicals_ref.liquid_alum_range_from
-            bill.liquid_alum_range_to = chemicals_ref.liquid_alum_range_to
-            bill.solid_alum_range_from = chemicals_ref.solid_alum_range_from
-            bill.solid_alum_range_to = chemicals_ref.solid_alum_range_to
-
-        if not bill.technology_bill_percentage:
-            # get related tech bills of related gauge
-            sgt = db.session.query(StationGaugeTechnology).filter(
-                StationGaugeTechnology.station_id == bill.station_id,
-                StationGaugeTechnology.technology_id == bill.technology_id,
-                StationGaugeTechnology.relation_status == True,
-                StationGaugeTechnology.is_source == False).first()
-            print(sgt.to_dict())
-            gauge_sgts = db.session.query(StationGaugeTechnology).filter(
-                StationGaugeTechnology.account_number == sgt.account_number,
-                StationGaugeTechnology.relation_status == True,
-                StationGaugeTechnology.is_source == False).all()
-            print(gauge_sgts)
-            related_bills = []
-            for gauge_sgt in gauge_sgts:
-                related_bill = db.session.query(TechnologyBill).filter(
-                    TechnologyBill.station_id == gauge_sgt.station_id,
-                    TechnologyBill.technology_id == gauge_sgt.technology_id,
-                    TechnologyBill.bill_month == bill.bill_month,
-                    TechnologyBill.bill_year == bill.bill_year
-                ).first()
-                related_bills.append(related_bill)
-            print(related_bills)
-            # check if all bills have water amount values
-            # calculate total amount
-            should_calculate = True
-            total_water_amount = 0
-            for this_bill in related_bills:
-                if this_bill.technology_water_amount != None:
-                    total_water_amount += this_bill.technology_water_amount
-                else:
-                    should_calculate = False
-
-            # calculate percent for each tech bill
-            # apply for power and bill
-            if should_calculate:
-                for each_bill in related_bills:
-                    if total_water_amount == 0:
-                        each_bill.technology_bill_percentage = 100 / len(related_bills)
-                    else:
-                        each_bill.technology_bill_percentage = each_bill.technology_water_amount / total_water_amount * 100
-                    each_bill.technology_power_consump = each_bill.technology_bill_percentage * each_bill.technology_power_consump
-                    each_bill.technology_bill_total = Decimal(str(each_bill.technology_bill_percentage)) * each_bill.technology_bill_total
-
-        #TODO: add rource power if exists
-        should_calc_source = True
-        source_stg = StationGaugeTechnology.query.filter(
-            StationGaugeTechnology.station_id == bill.station_id,
-            StationGaugeTechnology.technology_id == bill.technology_id,
-            StationGaugeTechnology.relation_status == True,
-            StationGaugeTechnology.is_source == True
-        ).first()
-        if not source_stg:
-            should_calc_source = False
-        else:
-            current_gauge_bill = GuageBill.query.filter(
-                GuageBill.account_number == source_stg.account_number,
-                GuageBill.bill_month == bill.bill_month,
-                GuageBill.bill_year == bill.bill_year
-            ).first()
-            if not current_gauge_bill:
-                should_calc_source = False
-            else:
-                source_gauge_stg = StationGaugeTechnology.query.filter(
-                    StationGaugeTechnology.account_number == current_gauge_bill.account_number,
-                    StationGaugeTechnology.relation_status == True,
-                    StationGaugeTechnology.is_source == True
-                ).all()
-                source_related_bills = []
-                total_water_for_resource = 0
-                for each_rel in source_gauge_stg:
-                    s_b = TechnologyBill.query.filter(
-                        TechnologyBill.station_id == each_rel.station_id,
-                        TechnologyBill.technology_id == each_rel.technology_id,
-                        TechnologyBill.bill_month == bill.bill_month,
-                        TechnologyBill.bill_year == bill.bill_year
-                    ).first()
-                    if s_b:
-                        if s_b.technology_water_amount != None and s_b.technology_bill_percentage != None:
-                            source_related_bills.append(s_b)
-                            total_water_for_resource += s_b.technology_water_amount
-                        else:
-                            should_calc_source = False
-                            break
-                    else:
-                        should_calc_source = False
-                        break
-                if should_calc_source and (len(source_gauge_stg) == len(source_related_bills)):
-                    for s_r_b in source_related_bills:
-                        if total_water_for_resource:
-                            if s_r_b.technology_power_consump != None:
-                                s_r_b.technology_power_consump += current_gauge_bill.power_consump * s_r_b.technology_water_amount / total_water_for_resource
-                                s_r_b.technology_bill_total += current_gauge_bill.bill_total * Decimal(
-                                    s_r_b.technology_water_amount / total_water_for_resource)
-                            else:
-                                s_r_b.technology_power_consump = current_gauge_bill.power_consump * s_r_b.technology_water_amount / total_water_for_resource
-                                s_r_b.technology_bill_total = current_gauge_bill.bill_total * Decimal(
-                                    s_r_b.technology_water_amount / total_water_for_resource)
-                        else:
-                            if s_r_b.technology_power_consump != None:
-                                s_r_b.technology_power_consump += current_gauge_bill.power_consump / len(source_related_bills)
-                                s_r_b.technology_bill_total += current_gauge_bill.bill_total / Decimal(len(source_related_bills))
-                            else:
-                                s_r_b.technology_power_consump = current_gauge_bill.power_consump / len(
-                                    source_related_bills)
-                                s_r_b.technology_bill_total = current_gauge_bill.bill_total / Decimal(
-                                    len(source_related_bills))
-
-
-        # --- skip audit for the automatic updates
-        g.skip_audit = True
-
-        try:
-            db.session.commit()
-        except IntegrityError as e:
-            db.session.rollback()
-            return jsonify(
-                {"error": "خطأ في تكامل البيانات: قد تكون البيانات مكررة أو غير صالحة", "details": str(e)}), 400
-        except DataError as e:
-            db.session.rollback()
-            return jsonify({"error": "خطأ في نوع البيانات أو الحجم", "details": str(e)}), 404
-        except SQLAlchemyError as e:
-            db.session.rollback()
-            print(e)
-            return jsonify({"error": "خطأ في قاعدة البيانات", "details": str(e)}), 500
-        except Exception as e:
-            db.session.rollback()
-            return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
-        else:
-            response = {
-                "response": {
-                    "success": "تم ادخال البيانات بنجاح"
-                }
-            }
-            return jsonify(response), 200
-        finally:
-            # ✅ Always re-enable auditing for future commits
-            g.skip_audit = False
+        return propagate_tech_bill_entry(bill)
     return jsonify(bill.to_dict())
 
 
-@app.route("/insert-or-edit-tech-bill", methods=["GET", "POST"])
+def enter_tech_bill(data, retry=True):
+    """insert_or_edit_tech_bill's POST: the month's water and chemicals of one station technology."""
+    bill = db.session.query(TechnologyBill).filter(
+        TechnologyBill.bill_year == data["bill_year"],
+        TechnologyBill.bill_month == data["bill_month"],
+        TechnologyBill.station_id == data["station_id"],
+        TechnologyBill.technology_id == data["technology_id"],
+    ).first()
+    # print(data['technology_water_amount'])
+    # print(data['measured_water'])
+    # print(data['calculated_water'])
+    if data['technology_water_amount'] != data['measured_water'] + data['calculated_water']:
+        return jsonify({"error": "كمية المياه الاجمالية غير مطابقة لمجموع المقاس والمحسوب"}), 405
+
+    if bill:
+        if bill.technology_water_amount != None:
+            return jsonify({"error": "تم إدخال بيانات المحطة من قبل"}), 404
+        else:
+            # if data['technology_water_amount'] == 0:
+            #     return jsonify({"error": "يجب أن تكون كمية المياه المنتجة اكبر من صفر"})
+            # if data['technology_chlorine_consump'] == 0:
+            #     return jsonify({"error": "يجب أن تكون كمية الكلور المستهلكة اكبر من صفر"})
+            bill.technology_liquid_alum_consump = data['technology_liquid_alum_consump'] * 1000
+            bill.technology_solid_alum_consump = data['technology_solid_alum_consump'] * 1000
+            bill.technology_chlorine_consump = data['technology_chlorine_consump'] * 1000
+            bill.technology_water_amount = data['technology_water_amount']
+            bill.measured_water = data['measured_water']
+            bill.calculated_water = data['calculated_water']
+    else:
+        # print("else")
+        bill = TechnologyBill(
+            bill_year=data["bill_year"],
+            bill_month=data["bill_month"],
+            station_id=data["station_id"],
+            technology_id=data["technology_id"],
+            technology_liquid_alum_consump=data["technology_liquid_alum_consump"] * 1000,
+            technology_solid_alum_consump=data["technology_solid_alum_consump"] * 1000,
+            technology_chlorine_consump=data["technology_chlorine_consump"] * 1000,
+            technology_water_amount=data["technology_water_amount"],
+            measured_water=data["measured_water"],
+            calculated_water=data["calculated_water"],
+        )
+        sgt = topology_cache.get().station_meter(bill.station_id, bill.technology_id)
+        if not sgt:
+            return jsonify({"error": "هذه المحطة غير مربوطة بعداد، برجاء ربط المحطة أولا"}), 405
+        # print(sgt.to_dict())
+        gauge_sgts = topology_cache.get().relations(sgt.account_number, is_source=False)
+        if len(gauge_sgts) == 1:
+            bill.technology_bill_percentage = 100
+        db.session.add(bill)
+        if retry:
+            # the gauge bill's allocation job may insert this row first: enter the water into its row then
+            return propagate_tech_bill_entry(bill, on_conflict=lambda: enter_tech_bill(data, retry=False))
+    return propagate_tech_bill_entry(bill)
+
+
+@bp.route("/insert-or-edit-tech-bill", methods=["GET", "POST"])
 @private_route([1, 2])
 def insert_or_edit_tech_bill(current_user):
-    branches = db.session.query(Branch).all()
-    branches_list = [branch.to_dict() for branch in branches]
+    branches_list = assets.catalog("branches")
     stations = db.session.query(Station).all()
     stations_list = []
     for i in range(len(stations)):
@@ -1711,247 +1712,100 @@ def insert_or_edit_tech_bill(current_user):
     if request.method == "POST":
         data = request.get_json()
         print(data)
-        bill = db.session.query(TechnologyBill).filter(
-            TechnologyBill.bill_year == data["bill_year"],
-            TechnologyBill.bill_month == data["bill_month"],
-            TechnologyBill.station_id == data["station_id"],
-            TechnologyBill.technology_id == data["technology_id"],
-        ).first()
-        # print(data['technology_water_amount'])
-        # print(data['measured_water'])
-        # print(data['calculated_water'])
-        if data['technology_water_amount'] != data['measured_water'] + data['calculated_water']:
-            return jsonify({"error": "كمية المياه الاجمالية غير مطابقة لمجموع المقاس والمحسوب"}), 405
+        return enter_tech_bill(data)
 
-        if bill:
-            if bill.technology_water_amount != None:
-                return jsonify({"error": "تم إدخال بيانات المحطة من قبل"}), 404
-            else:
-                # if data['technology_water_amount'] == 0:
-                #     return jsonify({"error": "يجب أن تكون كمية المياه المنتجة اكبر من صفر"})
-                # if data['technology_chlorine_consump'] == 0:
-                #     return jsonify({"error": "يجب أن تكون كمية الكلور المستهلكة اكبر من صفر"})
-                bill.technology_liquid_alum_consump = data['technology_liquid_alum_consump'] * 1000
-                bill.technology_solid_alum_consump = data['technology_solid_alum_consump'] * 1000
-                bill.technology_chlorine_consump = data['technology_chlorine_consump'] * 1000
-                bill.technology_water_amount = data['technology_water_amount']
-                bill.measured_water = data['measured_water']
-                bill.calculated_water = data['calculated_water']
-        else:
-            # print("else")
-            bill = TechnologyBill(
-                bill_year=data["bill_year"],
-                bill_month=data["bill_month"],
-                station_id=data["station_id"],
-                technology_id=data["technology_id"],
-                technology_liquid_alum_consump=data["technology_liquid_alum_consump"] * 1000,
-                technology_solid_alum_consump=data["technology_solid_alum_consump"] * 1000,
-                technology_chlorine_consump=data["technology_chlorine_consump"] * 1000,
-                technology_water_amount=data["technology_water_amount"],
-                measured_water=data["measured_water"],
-                calculated_water=data["calculated_water"],
-            )
-            sgt = db.session.query(StationGaugeTechnology).filter(
-                StationGaugeTechnology.station_id == bill.station_id,
-                StationGaugeTechnology.technology_id == bill.technology_id,
-                StationGaugeTechnology.relation_status == True,
-                StationGaugeTechnology.is_source == False).first()
-            if not sgt:
-                return jsonify({"error": "هذه المحطة غير مربوطة بعداد، برجاء ربط المحطة أولا"}), 405
-            # print(sgt.to_dict())
-            gauge_sgts = db.session.query(StationGaugeTechnology).filter(
-                StationGaugeTechnology.account_number == sgt.account_number,
-                StationGaugeTechnology.relation_status == True,
-                StationGaugeTechnology.is_source == False).all()
-            if len(gauge_sgts) == 1:
-                bill.technology_bill_percentage = 100
-            db.session.add(bill)
+    return jsonify(branches=branches_list, stations=stations_list)
 
 
-        try:
-            db.session.commit()
-        except IntegrityError as e:
-            db.session.rollback()
-            print(e)
-            return jsonify(
-                {"error": "خطأ في تكامل البيانات: قد تكون البيانات مكررة أو غير صالحة", "details": str(e)}), 400
-        except DataError as e:
-            db.session.rollback()
-            return jsonify({"error": "خطأ في نوع البيانات أو الحجم", "details": str(e)}), 404
-        except SQLAlchemyError as e:
-            db.session.rollback()
-            print(e)
-            return jsonify({"error": "خطأ في قاعدة البيانات", "details": str(e)}), 500
-        except Exception as e:
-            db.session.rollback()
-            return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
+@bp.route("/jobs/<job_id>")
+@private_route([1, 2, 3])
+def job_status(job_id, current_user):
+    job = db.session.get(AllocationJob, job_id)
+    if not job:
+        return jsonify({"error": "المهمة غير موجودة"}), 404
+    return jsonify(job.to_dict())
 
-        g.skip_audit = True
-        bill.power_per_water = bill.technology.power_per_water
-        g.skip_audit = False
 
-        current_season = get_season(bill.bill_month)
-        current_water_source = bill.station.water_source_id
-        chemicals_ref = db.session.query(AlumChlorineReference).filter(
-            AlumChlorineReference.technology_id == bill.technology_id,
-            AlumChlorineReference.season == current_season,
-            AlumChlorineReference.water_source_id == current_water_source).first()
-        if chemicals_ref:
-            bill.chlorine_range_from = chemicals_ref.chlorine_range_from
-            bill.chlorine_range_to = chemicals_ref.chlorine_range_to
-            bill.liquid_alum_range_from = chemicals_ref.liquid_alum_range_from
-            bill.liquid_alum_range_to = chemicals_ref.liquid_alum_range_to
-            bill.solid_alum_range_from = chemicals_ref.solid_alum_range_from
-            bill.solid_alum_range_to = chemicals_ref.solid_alum_range_to
-
-        if not bill.technology_bill_percentage:
-            # get related tech bills of related gauge
-            sgt = db.session.query(StationGaugeTechnology).filter(
-                StationGaugeTechnology.station_id == bill.station_id,
-                StationGaugeTechnology.technology_id == bill.technology_id,
-                StationGaugeTechnology.relation_status == True,
-                StationGaugeTechnology.is_source == False
-            ).first()
-            print(sgt.to_dict())
-            gauge_sgts = db.session.query(StationGaugeTechnology).filter(
-                StationGaugeTechnology.account_number == sgt.account_number,
-                StationGaugeTechnology.relation_status == True,
-                StationGaugeTechnology.is_source == False).all()
-            print(gauge_sgts)
-            related_bills = []
-            for gauge_sgt in gauge_sgts:
-                related_bill = db.session.query(TechnologyBill).filter(
-                    TechnologyBill.station_id == gauge_sgt.station_id,
-                    TechnologyBill.technology_id == gauge_sgt.technology_id,
-                    TechnologyBill.bill_month == bill.bill_month,
-                    TechnologyBill.bill_year == bill.bill_year
-                ).first()
-                if related_bill:
-                    related_bills.append(related_bill)
-            print(related_bills)
-            # check if all bills have water amount values
-            # calculate total amount
-            total_water_amount = 0
-            if len(gauge_sgts) == len(related_bills):
-                should_calculate = True
-                for this_bill in related_bills:
-                    if this_bill.technology_water_amount != None:
-                        total_water_amount += this_bill.technology_water_amount
-                    else:
-                        should_calculate = False
-            else:
-                should_calculate = False
-
-            # calculate percent for each tech bill
-            # apply for power and bill
-            if should_calculate:
-                for each_bill in related_bills:
-                    if total_water_amount == 0:
-                        each_bill.technology_bill_percentage = 100 / len(related_bills)
-                    else:
-                        each_bill.technology_bill_percentage = each_bill.technology_water_amount / total_water_amount * 100
-                    if each_bill.technology_power_consump != None:
-                        each_bill.technology_power_consump = each_bill.technology_bill_percentage * each_bill.technology_power_consump
-                        each_bill.technology_bill_total = Decimal(str(each_bill.technology_bill_percentage)) * each_bill.technology_bill_total
+@bp.route("/jobs/<job_id>/retry", methods=["POST"])
+@private_route([1, 3])
+def retry_job(job_id, current_user):
+    """Rerun a failed allocation job once whatever made it fail is fixed."""
+    if not db.session.get(AllocationJob, job_id):
+        return jsonify({"error": "المهمة غير موجودة"}), 404
+    if not allocation_queue.retry(db.session, job_id):
+        db.session.rollback()
+        return jsonify({"error": "المهمة لم تفشل، لا يمكن إعادة تشغيلها"}), 409
+    g.skip_audit_tables = (AllocationJob.__tablename__,)
+    db.session.commit()
+    allocation_queue.dispatch(job_id)
+    return jsonify({"response": {"success": "تم إعادة تشغيل المهمة"}, "job_id": job_id}), 202
 
-        # --- skip audit for the automatic updates
-        g.skip_audit = True
-
-        # add source power if exist
-        should_calc_source = True
-        source_stg = StationGaugeTechnology.query.filter(
-            StationGaugeTechnology.station_id == bill.station_id,
-            StationGaugeTechnology.technology_id == bill.technology_id,
-            StationGaugeTechnology.relation_status == True,
-            StationGaugeTechnology.is_source == True
-        ).first()
-        if not source_stg:
-            should_calc_source = False
-        else:
-            current_gauge_bill = GuageBill.query.filter(
-                GuageBill.account_number == source_stg.account_number,
-                GuageBill.bill_month == bill.bill_month,
-                GuageBill.bill_year == bill.bill_year
-            ).first()
-            if not current_gauge_bill:
-                should_calc_source = False
-            else:
-                source_gauge_stg = StationGaugeTechnology.query.filter(
-                    StationGaugeTechnology.account_number == current_gauge_bill.account_number,
-                    StationGaugeTechnology.relation_status == True,
-                    StationGaugeTechnology.is_source == True
-                ).all()
-                source_related_bills = []
-                total_water_for_resource = 0
-                for each_rel in source_gauge_stg:
-                    s_b = TechnologyBill.query.filter(
-                        TechnologyBill.station_id == each_rel.station_id,
-                        TechnologyBill.technology_id == each_rel.technology_id,
-                        TechnologyBill.bill_month == bill.bill_month,
-                        TechnologyBill.bill_year == bill.bill_year
-                    ).first()
-                    if s_b:
-                        if s_b.technology_water_amount != None and s_b.technology_bill_percentage != None:
-                            source_related_bills.append(s_b)
-                            total_water_for_resource += s_b.technology_water_amount
-                        else:
-                            should_calc_source = False
-                            break
-                    else:
-                        should_calc_source = False
-                        break
-                if should_calc_source and (len(source_gauge_stg) == len(source_related_bills)):
-                    for s_r_b in source_related_bills:
-                        if total_water_for_resource:
-                            if s_r_b.technology_power_consump != None:
-                                s_r_b.technology_power_consump += current_gauge_bill.power_consump * s_r_b.technology_water_amount / total_water_for_resource
-                                s_r_b.technology_bill_total += current_gauge_bill.bill_total * Decimal(
-                                    s_r_b.technology_water_amount / total_water_for_resource)
-                            else:
-                                s_r_b.technology_power_consump = current_gauge_bill.power_consump * s_r_b.technology_water_amount / total_water_for_resource
-                                s_r_b.technology_bill_total = current_gauge_bill.bill_total * Decimal(
-                                    s_r_b.technology_water_amount / total_water_for_resource)
-                        else:
-                            if s_r_b.technology_power_consump != None:
-                                s_r_b.technology_power_consump += current_gauge_bill.power_consump / len(source_related_bills)
-                                s_r_b.technology_bill_total += current_gauge_bill.bill_total / Decimal(len(source_related_bills))
-                            else:
-                                s_r_b.technology_power_consump = current_gauge_bill.power_consump / len(
-                                    source_related_bills)
-                                s_r_b.technology_bill_total = current_gauge_bill.bill_total / Decimal(
-                                    len(source_related_bills))
 
-        try:
-            db.session.commit()
-        except IntegrityError as e:
-            db.session.rollback()
-            return jsonify(
-                {"error": "خطأ في تكامل البيانات: قد تكون البيانات مكررة أو غير صالحة", "details": str(e)}), 400
-        except DataError as e:
-            db.session.rollback()
-            return jsonify({"error": "خطأ في نوع البيانات أو الحجم", "details": str(e)}), 404
-        except SQLAlchemyError as e:
-            db.session.rollback()
-            print(e)
-            return jsonify({"error": "خطأ في قاعدة البيانات", "details": str(e)}), 500
-        except Exception as e:
+@bp.route("/tech-bills/import", methods=["POST"])
+@private_route([1, 2])
+def import_tech_bills(current_user):
+    """
+    multipart form: file (.csv/.xlsx water and chemicals sheet), bill_month,
+    bill_year and optional dry_run.  Invalid rows are returned with their
+    errors; the valid ones and their meters' allocation are stored in one
+    transaction (see tech_billing.py).
+    """
+    upload = request.files.get('file')
+    try:
+        bill_month = int(request.form['bill_month'])
+        bill_year = int(request.form['bill_year'])
+        if not upload or bill_month not in range(1, 13):
+            raise ValueError("file, bill_month (1-12) and bill_year are required")
+        df = tech_billing.read_tech_bill_file(upload)
+    except (KeyError, ValueError) as e:
+        return jsonify({"error": "ملف بيانات المحطات أو بيانات الشهر غير صالحة", "details": str(e)}), 400
+    dry_run = request.form.get('dry_run', '').lower() in ('1', 'true', 'yes')
+
+    # the entered rows are audited below; the allocation changes (and intake bills' is_distributed) are not
+    g.skip_audit_tables = (TechnologyBill.__tablename__, GuageBill.__tablename__)
+    try:
+        valid, errors = tech_billing.validate_tech_bills(db.session, df, bill_month, bill_year)
+        summary, audit_entries = tech_billing.import_tech_bills(db.session, valid, bill_month, bill_year,
+                                                                current_user.username)
+        if dry_run:
             db.session.rollback()
-            return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
         else:
-            response = {
-                "response": {
-                    "success": "تم ادخال البيانات بنجاح"
-                }
-            }
-            return jsonify(response), 200
-        finally:
-            # ✅ Always re-enable auditing for future commits
-            g.skip_audit = False
+            db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        return jsonify({"error": "خطأ في تكامل البيانات: قد تكون البيانات مكررة أو غير صالحة", "details": str(e)}), 400
+    except DataError as e:
+        db.session.rollback()
+        return jsonify({"error": "خطأ في نوع البيانات أو الحجم", "details": str(e)}), 404
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return jsonify({"error": "خطأ في قاعدة البيانات", "details": str(e)}), 500
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
 
-    return jsonify(branches=branches_list, stations=stations_list)
+    if not dry_run:
+        audit_writer.enqueue(audit_entries)
+    row_errors = [
+        {"row": int(row),
+         "station_id": None if pd.isna(df.at[row, 'station_id']) else str(df.at[row, 'station_id']),
+         "technology_id": None if pd.isna(df.at[row, 'technology_id']) else str(df.at[row, 'technology_id']),
+         "errors": [{"code": code, "error": message} for code, message in messages]}
+        for row, messages in sorted(errors.items())
+    ]
+    response = {
+        "response": {
+            "success": "تم التحقق من بيانات المحطات" if dry_run else "تم استيراد بيانات المحطات بنجاح"
+        },
+        "dry_run": dry_run,
+        "rejected": len(row_errors),
+        **summary,
+        "errors": row_errors,
+    }
+    return jsonify(response), 200 if summary["imported"] or not row_errors else 400
 
 
-@app.route("/view-tech-bills", methods=["GET"])
+@bp.route("/view-tech-bills", methods=["GET"])
 @private_route([1, 2, 3, 7])
 def view_tech_bills(current_user):
     tech_bills = db.session.query(TechnologyBill).filter(TechnologyBill.technology_bill_percentage.isnot(None)).all()
@@ -1985,7 +1839,7 @@ def try_commit():
         return jsonify(response), 200
 
 
-@app.route("/edit-old-tech-bills/<int:tech_bill_id>", methods=["GET", "POST"])
+@bp.route("/edit-old-tech-bills/<int:tech_bill_id>", methods=["GET", "POST"])
 @private_route([1, 2])
 def edit_old_tech_bills(tech_bill_id, current_user):
     if request.method == "POST":
@@ -2002,12 +1856,7 @@ def edit_old_tech_bills(tech_bill_id, current_user):
         bill.technology_solid_alum_consump = data['technology_solid_alum_consump'] * 1000
         bill.technology_liquid_alum_consump = data['technology_liquid_alum_consump'] * 1000
 
-        rel_to_source = StationGaugeTechnology.query.filter(
-                    StationGaugeTechnology.station_id == station_id,
-                    StationGaugeTechnology.technology_id == technology_id,
-                    StationGaugeTechnology.relation_status == True,
-                    StationGaugeTechnology.is_source == True
-                ).first()
+        rel_to_source = topology_cache.get().intake_meter(station_id, technology_id)
 
         if bill.technology_water_amount == data['technology_water_amount']:
             return try_commit()
@@ -2023,72 +1872,24 @@ def edit_old_tech_bills(tech_bill_id, current_user):
             if bill.technology_bill_percentage == None:
                 return commit_result
             else:
-                curr_rel = db.session.query(StationGaugeTechnology).filter(
-                    StationGaugeTechnology.station_id == station_id,
-                    StationGaugeTechnology.technology_id == technology_id,
-                    StationGaugeTechnology.relation_status == True,
-                    StationGaugeTechnology.is_source == False
-                ).first()
-                gauge_sgts = db.session.query(StationGaugeTechnology).filter(
-                    and_(
-                        StationGaugeTechnology.account_number == curr_rel.account_number,
-                        StationGaugeTechnology.relation_status == True,
-                        StationGaugeTechnology.is_source == False
-                    )
-                ).all()
-                tech_bills_related = []
-                for rel in gauge_sgts:
-                    tech_bill = db.session.query(TechnologyBill).filter(
-                        TechnologyBill.station_id == rel.station_id,
-                        TechnologyBill.technology_id == rel.technology_id,
-                        TechnologyBill.bill_month == month,
-                        TechnologyBill.bill_year == year
-                    ).first()
-                    if tech_bill:
-                        tech_bills_related.append(tech_bill)
+                curr_rel = topology_cache.get().station_meter(station_id, technology_id)
+                gauge_sgts = topology_cache.get().relations(curr_rel.account_number, is_source=False)
+                tech_bills_related = list(month_tech_bills(
+                    db.session, [(rel.station_id, rel.technology_id) for rel in gauge_sgts], month, year,
+                    lock=True).values())
                 if len(tech_bills_related) == 1:
                     return commit_result
                 else:
-                    total_water = 0
-                    total_power = 0
-                    total_bill = 0
-                    calc_percent_only = False
-                    for rel_bill in tech_bills_related:
-                        total_water += rel_bill.technology_water_amount
-                        if rel_bill.technology_power_consump:
-                            total_power += rel_bill.technology_power_consump
-                            total_bill += rel_bill.technology_bill_total
-                        else:
-                            calc_percent_only = True
-
-                    # --- skip audit for the automatic updates
-                    g.skip_audit = True
-
-                    if total_water == 0:
-                        for rel_bill in tech_bills_related:
-                            rel_bill.technology_bill_percentage = 100 / len(tech_bills_related)
-                            if not calc_percent_only:
-                                rel_bill.technology_power_consump = total_power * rel_bill.technology_bill_percentage / 100
-                                rel_bill.technology_bill_total = total_bill * Decimal(str(rel_bill.technology_bill_percentage)) / 100
-                    else:
-                        for rel_bill in tech_bills_related:
-                            rel_bill.technology_bill_percentage = (rel_bill.technology_water_amount / total_water) * 100
-                            if not calc_percent_only:
-                                rel_bill.technology_power_consump = total_power * rel_bill.technology_bill_percentage / 100
-                                rel_bill.technology_bill_total = total_bill * Decimal(str(rel_bill.technology_bill_percentage)) / 100
-
+                    # not audited: the split is a Core UPDATE, like the allocation's
+                    resplit_station_meter(db.session, tech_bills_related)
                     try_commit()
-
-                    # --- skip audit for the automatic updates
-                    g.skip_audit = False
-
                     return commit_result
 
     return jsonify({"response": "سبحان الله وبحمده، سبحان الله العظيم"})
 
 
 # Add route to change voltage cost
-@app.route("/voltage-costs")
+@bp.route("/voltage-costs")
 @private_route([1, 3])
 def voltage_costs(current_user):
     all_costs = db.session.query(Voltage).all()
@@ -2096,7 +1897,7 @@ def voltage_costs(current_user):
     return jsonify(costs_list)
 
 
-@app.route("/edit-v-cost/<voltage_id>", methods=["get", "post"])
+@bp.route("/edit-v-cost/<voltage_id>", methods=["get", "post"])
 @private_route([1, 3])
 def edit_voltage_cost(voltage_id, current_user):
     voltage = Voltage.query.get(voltage_id)
@@ -2131,7 +1932,7 @@ def edit_voltage_cost(voltage_id, current_user):
     return jsonify(voltage.to_dict())
 
 
-@app.route("/chemicals")
+@bp.route("/chemicals")
 @private_route([1, 4, 7])
 def chemicals(current_user):
     chemicals = db.session.query(AlumChlorineReference).all()
@@ -2139,7 +1940,7 @@ def chemicals(current_user):
     return jsonify(userschemicals_list)
 
 
-@app.route("/edit-chemical/<chemical_id>", methods=["GET", "POST"])
+@bp.route("/edit-chemical/<chemical_id>", methods=["GET", "POST"])
 @private_route([1, 4])
 def edit_chemical(chemical_id, current_user):
     chemical = db.session.query(AlumChlorineReference).filter(AlumChlorineReference.chemical_id == chemical_id).first()
@@ -2182,14 +1983,13 @@ def edit_chemical(chemical_id, current_user):
     return jsonify({"response": "اللهم صل على سيدنا محمد"})
 
 
-@app.route("/new-chemical", methods=["GET", "POST"])
+@bp.route("/new-chemical", methods=["GET", "POST"])
 @private_route([1, 4])
 def new_chemical(current_user):
     all_techs = db.session.query(Technology).all()
     techs_list = [tech.to_dict() for tech in all_techs]
 
-    water_sources = db.session.query(WaterSource).all()
-    sources_list = [source.to_dict() for source in water_sources]
+    sources_list = assets.catalog("water_sources")
     if request.method == "POST":
         data = request.get_json()
         print(data)
@@ -2264,7 +2064,7 @@ def new_chemical(current_user):
     return jsonify(techs=techs_list, water_sources=sources_list)
 
 
-@app.route("/station-techs")
+@bp.route("/station-techs")
 def show_station_techs():
     stations = db.session.query(Station).all()
     stations_list = []
@@ -2278,7 +2078,7 @@ def show_station_techs():
     return jsonify(stations_list)
 
 
-@app.route("/analysis-single/<station_id>/<tech_id>")
+@bp.route("/analysis-single/<station_id>/<tech_id>")
 def show_charts(station_id, tech_id):
     tech_bills = db.session.query(TechnologyBill).filter(
         TechnologyBill.station_id == station_id,
@@ -2308,302 +2108,11 @@ def show_charts(station_id, tech_id):
     df_bills = df_bills.sort_values('date')
     print(df_bills)
 
-    # power plot
-    plt.figure(figsize=(12, 6), dpi=120)
-    plt.title(get_display(arabic_reshaper.reshape('منحنى تغير الرقم المرجعي للكهرباء عبر الزمن')), fontsize=18)
-    plt.xticks(fontsize=14, rotation=45)
-    plt.yticks(fontsize=14)
-    ax1 = plt.gca()  # get current axes
-    ax2 = ax1.twinx()  # Create another axis that shares the same x-axis
-
-    ax1.set_xticks(df_bills.date)
-    ax1.set_xticklabels(
-        [d.strftime('%m/%Y') for d in df_bills.date],
-        rotation=45,
-        fontsize=12
-    )
-
-    ax1.plot(df_bills.date, (df_bills.technology_power_consump / df_bills.technology_water_amount), color='blue',
-             linewidth=3, marker="o", label=get_display(arabic_reshaper.reshape('الرقم المرجعي الفعلي')))
-    ax2.plot(df_bills.date, df_bills.power_per_water, 'green', linewidth=3, linestyle='dashed',
-             label=get_display(arabic_reshaper.reshape('الرقم المرجعي القياسي')))
-    ax1.grid(color='grey', linestyle='--')
-    ax1.set_xlabel('شهر/سنة', fontsize=14)
-    ax1.set_ylabel(get_display(arabic_reshaper.reshape('الرقم المرجعي الفعلي')), color='blue', fontsize=14)
-    ax2.set_ylabel(get_display(arabic_reshaper.reshape('الرقم المرجعي القياسي')), color='green', fontsize=14)
-    # ax1.set_xlim([df_bills.date.min(), df_bills.date.max()])
-    # ax1.set_ylim([
-    #     (df_bills.technology_power_consump / df_bills.technology_water_amount).min(),
-    #     (df_bills.technology_power_consump / df_bills.technology_water_amount).max()
-    # ])
-    for x, y in zip(df_bills.date, df_bills.technology_power_consump / df_bills.technology_water_amount):
-        ax1.text(x, y, f"{y:.4f}", fontsize=9, color='blue', ha='center', va='bottom')
-    # Combine y-limits
-    y_min = min((df_bills.technology_power_consump / df_bills.technology_water_amount).min(),
-                df_bills.power_per_water.min())
-    y_max = max((df_bills.technology_power_consump / df_bills.technology_water_amount).max(),
-                df_bills.power_per_water.max())
-    y_pad = (y_max - y_min) * 0.1
-    y_min -= y_pad
-    y_max += y_pad
-    ax1.set_ylim(y_min, y_max)
-    ax2.set_ylim(y_min, y_max)
-
-    # Improve ticks
-    ax1.tick_params(axis='y', labelcolor='blue')
-    ax2.tick_params(axis='y', labelcolor='green')
-
-    # Axis labels
-    ax1.set_xlabel(get_display(arabic_reshaper.reshape('شهر/سنة')), fontsize=14)
-    ax1.set_ylabel(get_display(arabic_reshaper.reshape('الرقم المرجعي الفعلي')), fontsize=14, color='blue')
-    ax2.set_ylabel(get_display(arabic_reshaper.reshape('الرقم المرجعي القياسي')), fontsize=14, color='green')
-
-    # Grid
-    ax1.grid(color='grey', linestyle='--', alpha=0.5)
-
-    # Legend (outside)
-    lines1, labels1 = ax1.get_legend_handles_labels()
-    lines2, labels2 = ax2.get_legend_handles_labels()
-    ax1.legend(
-        lines1 + lines2,
-        labels1 + labels2,
-        loc='center left',
-        bbox_to_anchor=(1.05, 1),
-        fontsize=12
-    )
-
-    # Make room for legend
-    plt.subplots_adjust(right=0.78)
-    img = io.BytesIO()
-    plt.savefig(img, format='png', bbox_inches='tight', dpi=120)
-    img.seek(0)
-    power_plot = base64.b64encode(img.read()).decode('utf-8')
-    plt.close()
-    ###########################################################################################################
-    # chlorine plot
-    plt.figure(figsize=(12, 6), dpi=120)
-    plt.title(get_display(arabic_reshaper.reshape('منحنى تغير نسبة استهلاك الكلور عبر الزمن')), fontsize=18)
-    plt.xticks(fontsize=14, rotation=45)
-    plt.yticks(fontsize=14)
-    ax1 = plt.gca()  # get current axes
-    ax2 = ax1.twinx()  # Create another axis that shares the same x-axis
-
-    ax1.set_xticks(df_bills.date)
-    ax1.set_xticklabels(
-        [d.strftime('%m/%Y') for d in df_bills.date],
-        rotation=45,
-        fontsize=12
-    )
-
-    ax1.plot(df_bills.date, (df_bills.technology_chlorine_consump / df_bills.technology_water_amount), color='blue',
-             linewidth=3, marker="o", label=get_display(arabic_reshaper.reshape('الكلور الفعلي')))
-    ax2.plot(df_bills.date, df_bills.chlorine_range_from, 'green', linewidth=3, linestyle='dashed',
-             label=get_display(arabic_reshaper.reshape('الحد الأدنى الموصى به')))
-    ax2.plot(df_bills.date, df_bills.chlorine_range_to, 'red', linewidth=3, linestyle='dashed',
-             label=get_display(arabic_reshaper.reshape('الحد الأقصى الموصى به')))
-    ax1.grid(color='grey', linestyle='--')
-    ax1.set_xlabel(get_display(arabic_reshaper.reshape('شهر/سنة')), fontsize=14)
-    ax1.set_ylabel(get_display(arabic_reshaper.reshape('معامل استهلاك الكلور الفعلي')), color='blue', fontsize=14)
-    ax2.set_ylabel(get_display(arabic_reshaper.reshape('معامل استهلاك الكلور القياسي')), color='green', fontsize=14)
-    ax2.set_yticks(ax1.get_yticks())
-    ax2.fill_between(df_bills.date,
-                     df_bills.chlorine_range_from,
-                     df_bills.chlorine_range_to,
-                     color='green', alpha=0.1, label=get_display(arabic_reshaper.reshape('النطاق الموصى به')))
-    for x, y in zip(df_bills.date, df_bills.technology_chlorine_consump / df_bills.technology_water_amount):
-        ax1.text(x, y, f"{y:.4f}", fontsize=9, color='blue', ha='center', va='bottom')
-        # ax1.set_xlim([df_bills.date.min(), df_bills.date.max()])
-        # Get min and max of both series
-        # Combine y-limits
-        y_min = min((df_bills.technology_chlorine_consump / df_bills.technology_water_amount).min(),
-                    df_bills.chlorine_range_from.min())
-        y_max = max((df_bills.technology_chlorine_consump / df_bills.technology_water_amount).max(),
-                    df_bills.chlorine_range_to.max())
-        y_pad = (y_max - y_min) * 0.1
-        y_min -= y_pad
-        y_max += y_pad
-        ax1.set_ylim(y_min, y_max)
-        ax2.set_ylim(y_min, y_max)
-
-        # Improve ticks
-        ax1.tick_params(axis='y', labelcolor='blue')
-        ax2.tick_params(axis='y', labelcolor='green')
-
-    # Add combined legend
-    lines, labels = ax1.get_legend_handles_labels()
-    lines2, labels2 = ax2.get_legend_handles_labels()
-    ax1.legend(
-        lines + lines2, labels + labels2,
-        loc='center left',
-        bbox_to_anchor=(1.05, 1),
-        fontsize=12,
-        borderaxespad=0.
-    )
-    img = io.BytesIO()
-    plt.savefig(img, format='png', bbox_inches='tight', dpi=120)
-    img.seek(0)
-    chlorine_plot = base64.b64encode(img.read()).decode('utf-8')
-    plt.close()
-    ###########################################################################################################
-    # solid alum plot
-    plt.figure(figsize=(12, 6), dpi=120)
-    plt.title(get_display(arabic_reshaper.reshape('منحنى تغير نسبة استهلاك الشبة الصلبة عبر الزمن')), fontsize=18)
-    plt.xticks(fontsize=14, rotation=45)
-    plt.yticks(fontsize=14)
-    ax1 = plt.gca()  # get current axes
-    ax2 = ax1.twinx()  # Create another axis that shares the same x-axis
-
-    ax1.set_xticks(df_bills.date)
-    ax1.set_xticklabels(
-        [d.strftime('%m/%Y') for d in df_bills.date],
-        rotation=45,
-        fontsize=12
-    )
-
-    ax1.plot(df_bills.date, (df_bills.technology_solid_alum_consump / df_bills.technology_water_amount), color='blue',
-             linewidth=3, marker="o", label=get_display(arabic_reshaper.reshape('الشبة الصلبة الفعلية')))
-    ax2.plot(df_bills.date, df_bills.solid_alum_range_from, 'green', linewidth=3, linestyle='dashed',
-             label=get_display(arabic_reshaper.reshape('الحد الأدنى الموصى به')))
-    ax2.plot(df_bills.date, df_bills.solid_alum_range_to, 'red', linewidth=3, linestyle='dashed',
-             label=get_display(arabic_reshaper.reshape('الحد الأقصى الموصى به')))
-    ax1.grid(color='grey', linestyle='--')
-    ax1.set_xlabel(get_display(arabic_reshaper.reshape('شهر/سنة')), fontsize=14)
-    ax1.set_ylabel(get_display(arabic_reshaper.reshape('معامل استهلاك الشبة الصلبة الفعلي')), color='blue', fontsize=14)
-    ax2.set_ylabel(get_display(arabic_reshaper.reshape('معامل استهلاك الشبة الصلبة القياسي')), color='green',
-                   fontsize=14)
-    ax2.set_yticks(ax1.get_yticks())
-    ax2.fill_between(df_bills.date,
-                     df_bills.solid_alum_range_from,
-                     df_bills.solid_alum_range_to,
-                     color='green', alpha=0.1, label=get_display(arabic_reshaper.reshape('النطاق الموصى به')))
-    for x, y in zip(df_bills.date, df_bills.technology_solid_alum_consump / df_bills.technology_water_amount):
-        ax1.text(x, y, f"{y:.4f}", fontsize=9, color='blue', ha='center', va='bottom')
-        # ax1.set_xlim([df_bills.date.min(), df_bills.date.max()])
-        # ax1.set_ylim([
-        #     (df_bills.technology_solid_alum_consump / df_bills.technology_water_amount).min(),
-        #     (df_bills.technology_solid_alum_consump / df_bills.technology_water_amount).max()
-        # ])
-        # Combine y-limits
-        y_min = min((df_bills.technology_solid_alum_consump / df_bills.technology_water_amount).min(),
-                    df_bills.solid_alum_range_from.min())
-        y_max = max((df_bills.technology_solid_alum_consump / df_bills.technology_water_amount).max(),
-                    df_bills.solid_alum_range_to.max())
-        y_pad = (y_max - y_min) * 0.1
-        y_min -= y_pad
-        y_max += y_pad
-        ax1.set_ylim(y_min, y_max)
-        ax2.set_ylim(y_min, y_max)
-
-        # Improve ticks
-        ax1.tick_params(axis='y', labelcolor='blue')
-        ax2.tick_params(axis='y', labelcolor='green')
-
-        # Add combined legend
-        lines, labels = ax1.get_legend_handles_labels()
-        lines2, labels2 = ax2.get_legend_handles_labels()
-        ax1.legend(
-            lines + lines2, labels + labels2,
-            loc='center left',
-            bbox_to_anchor=(1.05, 1),
-            fontsize=12,
-            borderaxespad=0.
-        )
-    img = io.BytesIO()
-    plt.savefig(img, format='png', bbox_inches='tight', dpi=120)
-    img.seek(0)
-    solid_alum_plot = base64.b64encode(img.read()).decode('utf-8')
-    plt.close()
-    ###########################################################################################################
-    # liquid alum plot
-    plt.figure(figsize=(12, 6), dpi=120)
-    plt.title(get_display(arabic_reshaper.reshape('منحنى تغير نسبة استهلاك الشبة السائلة عبر الزمن')), fontsize=18)
-    plt.xticks(fontsize=14, rotation=45)
-    plt.yticks(fontsize=14)
-    ax1 = plt.gca()  # get current axes
-    ax2 = ax1.twinx()  # Create another axis that shares the same x-axis
-
-    ax1.set_xticks(df_bills.date)
-    ax1.set_xticklabels(
-        [d.strftime('%m/%Y') for d in df_bills.date],
-        rotation=45,
-        fontsize=12
-    )
-
-    ax1.plot(df_bills.date, (df_bills.technology_liquid_alum_consump / df_bills.technology_water_amount), color='blue',
-             linewidth=3, marker="o", label=get_display(arabic_reshaper.reshape('الشبة السائلة الفعلية')))
-    ax2.plot(df_bills.date, df_bills.liquid_alum_range_from, 'green', linewidth=3, linestyle='dashed',
-             label=get_display(arabic_reshaper.reshape('الحد الأدنى الموصى به')))
-    ax2.plot(df_bills.date, df_bills.liquid_alum_range_to, 'red', linewidth=3, linestyle='dashed',
-             label=get_display(arabic_reshaper.reshape('الحد الأقصى الموصى به')))
-    ax1.grid(color='grey', linestyle='--')
-    ax1.set_xlabel(get_display(arabic_reshaper.reshape('شهر/سنة')), fontsize=14)
-    ax1.set_ylabel(get_display(arabic_reshaper.reshape('معامل استهلاك الشبة السائلة الفعلي')), color='blue',
-                   fontsize=14)
-    ax2.set_ylabel(get_display(arabic_reshaper.reshape('معامل استهلاك الشبة السائلة القياسي')), color='green',
-                   fontsize=14)
-    ax2.set_yticks(ax1.get_yticks())
-    ax2.fill_between(df_bills.date,
-                     df_bills.liquid_alum_range_from,
-                     df_bills.liquid_alum_range_to,
-                     color='green', alpha=0.1, label=get_display(arabic_reshaper.reshape('النطاق الموصى به')))
-    for x, y in zip(df_bills.date, df_bills.technology_liquid_alum_consump / df_bills.technology_water_amount):
-        ax1.text(x, y, f"{y:.4f}", fontsize=9, color='blue', ha='center', va='bottom')
-        # ax1.set_xlim([df_bills.date.min(), df_bills.date.max()])
-        # ax1.set_ylim([
-        #     (df_bills.technology_liquid_alum_consump / df_bills.technology_water_amount).min(),
-        #     (df_bills.technology_liquid_alum_consump / df_bills.technology_water_amount).max()
-        # ])
-        # Combine y-limits
-        y_min = min((df_bills.technology_liquid_alum_consump / df_bills.technology_water_amount).min(),
-                    df_bills.liquid_alum_range_from.min())
-        y_max = max((df_bills.technology_liquid_alum_consump / df_bills.technology_water_amount).max(),
-                    df_bills.liquid_alum_range_to.max())
-        y_pad = (y_max - y_min) * 0.1
-        y_min -= y_pad
-        y_max += y_pad
-        ax1.set_ylim(y_min, y_max)
-        ax2.set_ylim(y_min, y_max)
-
-        # Improve ticks
-        ax1.tick_params(axis='y', labelcolor='blue')
-        ax2.tick_params(axis='y', labelcolor='green')
-
-        # Add combined legend
-        lines, labels = ax1.get_legend_handles_labels()
-        lines2, labels2 = ax2.get_legend_handles_labels()
-        ax1.legend(
-            lines + lines2, labels + labels2,
-            loc='center left',
-            bbox_to_anchor=(1.05, 1),
-            fontsize=12,
-            borderaxespad=0.
-        )
-    img = io.BytesIO()
-    plt.savefig(img, format='png', bbox_inches='tight', dpi=120)
-    img.seek(0)
-    liquid_alum_plot = base64.b64encode(img.read()).decode('utf-8')
-    return jsonify(
-        {
-            "power_plot": power_plot,
-            "chlorine_plot": chlorine_plot,
-            "solid_alum_plot": solid_alum_plot,
-            "liquid_alum_plot": liquid_alum_plot
-        }
-    )
+    return jsonify(charts.consumption_charts(df_bills))
 
 
-@app.route("/financial-analysis", methods=['GET', 'POST'])
+@bp.route("/financial-analysis", methods=['GET', 'POST'])
 def financial_analysis():
-    def arabic_number(value):
-        if value >= 1_000_000_000:
-            return f"{value / 1_000_000_000:.1f} مليار"
-        elif value >= 1_000_000:
-            return f"{value / 1_000_000:.1f} مليون"
-        elif value >= 1_000:
-            return f"{value / 1000:.1f} ألف"
-        else:
-            return f"{value:,.0f}"
-
     def sunburst_charts():
         query = db.session.query(
             Branch.branch_name,
@@ -2626,240 +2135,11 @@ def financial_analysis():
 
         bills = query.all()
         df = pd.DataFrame(bills)
-
-        # Convert chlorine from grams → tons
-        df['technology_chlorine_consump'] = df['technology_chlorine_consump'] / 1_000_000
-
-        # Convert liquid alum from grams → tons (if needed)
-        df['technology_liquid_alum_consump'] = df['technology_liquid_alum_consump'] / 1_000_000
-
-        # Convert solid alum from grams → tons (if needed)
-        df['technology_solid_alum_consump'] = df['technology_solid_alum_consump'] / 1_000_000
-
-        total_water = df['technology_water_amount'].sum()
-        total_power = df['technology_power_consump'].sum()
-        total_chlorine = df['technology_chlorine_consump'].sum()
-        total_liquid_alum = df['technology_liquid_alum_consump'].sum()
-        total_solid_alum = df['technology_solid_alum_consump'].sum()
-
-        # Chart 1: Water Production
-        fig_water = px.sunburst(
-            df,
-            path=['branch_name', 'station_name', 'technology_name'],
-            values='technology_water_amount',
-            color='technology_name',
-            title='نسبة إنتاج المياه حسب الفرع والمحطة والتقنية'
-        )
-        fig_water.update_traces(
-            hovertemplate="<b>%{label}</b><br><br>كمية المياه: %{value:,.0f} م³<br>نسبة من الإجمالي: %{percentRoot:.2%}<br><extra></extra>"
-        )
-        fig_water.update_layout(
-            height=850,
-            font=dict(family="Arial", size=15),
-            coloraxis_showscale=False,
-            margin=dict(t=60, b=40, l=40, r=40)
-        )
-
-        # Chart 2: Power Consumption
-        fig_power = px.sunburst(
-            df,
-            path=['branch_name', 'station_name', 'technology_name'],
-            values='technology_power_consump',
-            color='technology_name',
-            title='نسبة استهلاك الكهرباء حسب الفرع والمحطة والتقنية'
-        )
-        fig_power.update_traces(
-            hovertemplate="<b>%{label}</b><br><br>استهلاك الكهرباء: %{value:,.0f} ك.و<br>نسبة من الإجمالي: %{percentRoot:.2%}<br><extra></extra>"
-        )
-        fig_power.update_layout(
-            height=850,
-            font=dict(family="Arial", size=15),
-            coloraxis_showscale=False,
-            margin=dict(t=60, b=40, l=40, r=40)
-        )
-
-        # Chart 3: Chlorine Consumption
-        fig_chlorine = px.sunburst(
-            df,
-            path=['branch_name', 'station_name', 'technology_name'],
-            values='technology_chlorine_consump',
-            color='technology_name',
-            title='نسبة استهلاك الكلور حسب الفرع والمحطة والتقنية'
-        )
-        fig_chlorine.update_traces(
-            hovertemplate="<b>%{label}</b><br><br>كمية الكلور: %{value:,.3f} طن<br>نسبة من الإجمالي: %{percentRoot:.2%}<br><extra></extra>"
-        )
-        fig_chlorine.update_layout(
-            height=850,
-            font=dict(family="Arial", size=15),
-            coloraxis_showscale=False,
-            margin=dict(t=60, b=40, l=40, r=40)
-        )
-
-        # Chart 4: Liquid Alum Consumption
-        fig_liquid = px.sunburst(
-            df,
-            path=['branch_name', 'station_name', 'technology_name'],
-            values='technology_liquid_alum_consump',
-            color='technology_name',
-            title='نسبة استهلاك الشبة السائلة حسب الفرع والمحطة والتقنية'
-        )
-        fig_liquid.update_traces(
-            hovertemplate="<b>%{label}</b><br><br>الشبة السائلة: %{value:,.3f} طن<br>نسبة من الإجمالي: %{percentRoot:.2%}<br><extra></extra>"
-        )
-        fig_liquid.update_layout(
-            height=850,
-            font=dict(family="Arial", size=15),
-            coloraxis_showscale=False,
-            margin=dict(t=60, b=40, l=40, r=40)
-        )
-
-        # Chart 5: Solid Alum Consumption
-        fig_solid = px.sunburst(
-            df,
-            path=['branch_name', 'station_name', 'technology_name'],
-            values='technology_solid_alum_consump',
-            color='technology_name',
-            title='نسبة استهلاك الشبة الصلبة حسب الفرع والمحطة والتقنية'
-        )
-        fig_solid.update_traces(
-            hovertemplate="<b>%{label}</b><br><br>الشبة الصلبة: %{value:,.3f} طن<br>نسبة من الإجمالي: %{percentRoot:.2%}<br><extra></extra>"
-        )
-        fig_solid.update_layout(
-            height=850,
-            font=dict(family="Arial", size=15),
-            coloraxis_showscale=False,
-            margin=dict(t=60, b=40, l=40, r=40)
-        )
-
-        # OR if you need HTML:
-        # return {
-        #     'sun_water': fig_water.to_html(full_html=False, include_plotlyjs=False),
-        #     'sun_power': fig_power.to_html(full_html=False, include_plotlyjs=False),
-        #     'sun_chlorine': fig_chlorine.to_html(full_html=False, include_plotlyjs=False),
-        #     'sun_liquid': fig_liquid.to_html(full_html=False, include_plotlyjs=False),
-        #     'sun_solid': fig_solid.to_html(full_html=False, include_plotlyjs=False)
-        # }
-        kpi_cards = f"""
-        <div class="row text-center" style="margin-top: 20px; margin-bottom: 20px;">
-
-            <div class="col-md-2">
-                <div class="card shadow-sm">
-                    <div class="card-body">
-                        <h6 class="text-secondary">إجمالي المياه</h6>
-                        <h4 class="text-primary">{arabic_number(total_water)} (م³)</h4>
-                    </div>
-                </div>
-            </div>
-
-            <div class="col-md-2">
-                <div class="card shadow-sm">
-                    <div class="card-body">
-                        <h6 class="text-secondary">إجمالي الكهرباء</h6>
-                        <h4 class="text-primary">{arabic_number(total_power)} (KW)</h4>
-                    </div>
-                </div>
-            </div>
-
-            <div class="col-md-2">
-                <div class="card shadow-sm">
-                    <div class="card-body">
-                        <h6 class="text-secondary">إجمالي الكلور</h6>
-                        <h4 class="text-primary">{arabic_number(total_chlorine)} طن</h4>
-                    </div>
-                </div>
-            </div>
-
-            <div class="col-md-3">
-                <div class="card shadow-sm">
-                    <div class="card-body">
-                        <h6 class="text-secondary">إجمالي الشبة السائلة</h6>
-                        <h4 class="text-primary">{arabic_number(total_liquid_alum)} طن</h4>
-                    </div>
-                </div>
-            </div>
-
-            <div class="col-md-3">
-                <div class="card shadow-sm">
-                    <div class="card-body">
-                        <h6 class="text-secondary">إجمالي الشبة الصلبة</h6>
-                        <h4 class="text-primary">{arabic_number(total_solid_alum)} طن</h4>
-                    </div>
-                </div>
-            </div>
-
-        </div>
-        """
-
-        tabs_html = f"""
-        <ul class="nav nav-tabs" id="dataTabs" role="tablist">
-          <li class="nav-item" role="presentation">
-            <button class="nav-link active" data-bs-toggle="tab" data-bs-target="#water" type="button">المياه</button>
-          </li>
-          <li class="nav-item" role="presentation">
-            <button class="nav-link" data-bs-toggle="tab" data-bs-target="#power" type="button">الكهرباء</button>
-          </li>
-          <li class="nav-item" role="presentation">
-            <button class="nav-link" data-bs-toggle="tab" data-bs-target="#chlorine" type="button">الكلور</button>
-          </li>
-          <li class="nav-item" role="presentation">
-            <button class="nav-link" data-bs-toggle="tab" data-bs-target="#liquid" type="button">الشبة السائلة</button>
-          </li>
-          <li class="nav-item" role="presentation">
-            <button class="nav-link" data-bs-toggle="tab" data-bs-target="#solid" type="button">الشبة الصلبة</button>
-          </li>
-        </ul>
-
-        <div class="tab-content" style="margin-top: 20px;">
-          <div class="tab-pane fade show active" id="water">{fig_water.to_html(full_html=False, include_plotlyjs='cdn')}</div>
-          <div class="tab-pane fade" id="power">{fig_power.to_html(full_html=False, include_plotlyjs=False)}</div>
-          <div class="tab-pane fade" id="chlorine">{fig_chlorine.to_html(full_html=False, include_plotlyjs=False)}</div>
-          <div class="tab-pane fade" id="liquid">{fig_liquid.to_html(full_html=False, include_plotlyjs=False)}</div>
-          <div class="tab-pane fade" id="solid">{fig_solid.to_html(full_html=False, include_plotlyjs=False)}</div>
-        </div>
-        """
-
-        full_dashboard_html = f"""
-        <html lang="ar" dir="rtl">
-        <head>
-            <meta charset="UTF-8">
-            <title>Dashboard</title>
-
-            <!-- Bootstrap -->
-            <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css" rel="stylesheet">
-
-            <style>
-                body {{
-                    background-color: #f8f9fa;
-                    font-family: 'Arial';
-                }}
-            </style>
-        </head>
-
-        <body>
-
-        <div class="container">
-
-            <h2 class="text-center mt-4 mb-4 text-primary">
-                لوحة تحليل استهلاك وإنتاج المحطات
-            </h2>
-
-            {kpi_cards}
-
-            {tabs_html}
-
-        </div>
-
-        <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js"></script>
-
-        </body>
-        </html>
-        """
-        return full_dashboard_html
+        return charts.financial_dashboard_html(df)
     return jsonify({"water_chart": sunburst_charts()})
 
 
-@app.route("/annual-bills")
+@bp.route("/annual-bills")
 @private_route([1, 3])
 def show_annual_bills(current_user):
     bills = db.session.query(AnuualBill).all()
@@ -2867,7 +2147,7 @@ def show_annual_bills(current_user):
     return jsonify(bills_list)
 
 
-@app.route("/new-annual-bill/<meter_id>", methods=["GET", "POST"])
+@bp.route("/new-annual-bill/<meter_id>", methods=["GET", "POST"])
 @private_route([1, 3])
 def new_annual_bill(meter_id, current_user):
     if request.method == "POST":
@@ -2930,7 +2210,7 @@ def new_annual_bill(meter_id, current_user):
     return jsonify({"response": "لا إله إلا الله وحده لا شريك له له الملك وله الحمد وهو على كل شيء قدير"})
 
 
-@app.route("/prediction/<station_id>", methods=["GET", "POST"])
+@bp.route("/prediction/<station_id>", methods=["GET", "POST"])
 @private_route([1, 2, 7])
 def predict(station_id, current_user):
     if request.method == "POST":
@@ -2953,28 +2233,9 @@ def predict(station_id, current_user):
         df_monthly_bills = df_monthly_bills.sort_values(by="time_index")
 
         # print(df_monthly_bills)
-        plt.figure(figsize=(8, 4), dpi=200)
-        with sns.axes_style("darkgrid"):
-            ax = sns.regplot(data=df_monthly_bills,
-                             x='time_index',
-                             y='technology_water_amount',
-                             scatter_kws={'alpha': 0.4,
-                                          'color': '#2f4b7c'},
-                             line_kws={'color': '#ff7c43'})
-        ax.set(
-            ylabel=f'{get_display(arabic_reshaper.reshape('المياه المنتجة'))}',
-            xlabel=f'{get_display(arabic_reshaper.reshape('الفترة الزمنية'))}',
-        )
-        # Save to BytesIO buffer
-        img = io.BytesIO()
-        plt.tight_layout()
-        plt.savefig(img, format='png', dpi=200, bbox_inches='tight')
-        img.seek(0)  # Rewind the buffer
+        prediction_base64 = charts.prediction_chart(df_monthly_bills)
 
-        # Encode image to Base64
-        prediction_base64 = base64.b64encode(img.read()).decode('utf-8')
-
-        regression = LinearRegression()
+        regression = linear_model.LinearRegression()
 
         # Explanatory Variable(s) or Feature(s)
         X = pd.DataFrame(df_monthly_bills, columns=['time_index'])
@@ -3028,7 +2289,7 @@ def predict(station_id, current_user):
     return jsonify({"response": "لا حول ولا قوة إلا بالله"})
 
 
-@app.route("/reports", methods=["GET", "POST"])
+@bp.route("/reports", methods=["GET", "POST"])
 @private_route([1, 2, 3, 4, 7])
 def show_reports(current_user):
     if request.method == "POST":
@@ -3707,7 +2968,7 @@ def show_reports(current_user):
 
 
 # Planning sector routes
-@app.route("/all-areas")
+@bp.route("/all-areas")
 @private_route([1, 2, 5])
 def all_areas(current_user):
     areas = db.session.query(AreaOfService).all()
@@ -3716,7 +2977,7 @@ def all_areas(current_user):
     return jsonify(areas_list)
 
 
-@app.route("/edit-area/<area_id>", methods=["GET","POST"])
+@bp.route("/edit-area/<area_id>", methods=["GET","POST"])
 @private_route([1, 5])
 def edit_area(area_id, current_user):
     current_area = db.session.get(AreaOfService, area_id)
@@ -3750,7 +3011,7 @@ def edit_area(area_id, current_user):
     return jsonify(current_area)
 
 
-@app.route("/new-area", methods=["GET","POST"])
+@bp.route("/new-area", methods=["GET","POST"])
 @private_route([1, 5])
 def add_new_area(current_user):
     if request.method == "POST":
@@ -3785,7 +3046,7 @@ def add_new_area(current_user):
     return jsonify({"response": "يا حي يا قيوم برحمتك أستغيث أصلح لي شأني كله ولا تكلني إلى نفسي طرفة عين"})
 
 
-@app.route("/place-types")
+@bp.route("/place-types")
 @private_route([1, 5])
 def place_types(current_user):
     all_types = db.session.query(PlaceType).all()
@@ -3794,7 +3055,7 @@ def place_types(current_user):
     return jsonify(all_types_list)
 
 
-@app.route("/edit-place-type/<place_type_id>", methods=["GET", "POST"])
+@bp.route("/edit-place-type/<place_type_id>", methods=["GET", "POST"])
 @private_route([1, 5])
 def edit_place_type(place_type_id, current_user):
 
@@ -3830,7 +3091,7 @@ def edit_place_type(place_type_id, current_user):
     return jsonify({"response": "بسم الله"})
 
 
-@app.route("/places")
+@bp.route("/places")
 @private_route([1, 5])
 def get_places(current_user):
     all_places = db.session.query(Place).all()
@@ -3838,14 +3099,13 @@ def get_places(current_user):
     return jsonify(all_places_list)
 
 
-@app.route("/edit-place/<place_id>", methods=["GET", "POST"])
+@bp.route("/edit-place/<place_id>", methods=["GET", "POST"])
 @private_route([1, 5])
 def edit_place(place_id, current_user):
     all_place_types = db.session.query(PlaceType).all()
     all_place_types_list = [p_type.to_dict() for p_type in all_place_types]
 
-    all_branches = db.session.query(Branch).all()
-    all_branches_list = [branch.to_dict() for branch in all_branches]
+    all_branches_list = assets.catalog("branches")
 
     all_areas = db.session.query(AreaOfService).all()
     all_areas_list = [area.to_dict() for area in all_areas]
@@ -3884,14 +3144,13 @@ def edit_place(place_id, current_user):
     return jsonify(place_types=all_place_types_list, branches=all_branches_list, areas=all_areas_list)
 
 
-@app.route("/new-place", methods=["GET", "POST"])
+@bp.route("/new-place", methods=["GET", "POST"])
 @private_route([1, 5])
 def add_new_place(current_user):
     all_place_types = db.session.query(PlaceType).all()
     all_place_types_list = [p_type.to_dict() for p_type in all_place_types]
 
-    all_branches = db.session.query(Branch).all()
-    all_branches_list = [branch.to_dict() for branch in all_branches]
+    all_branches_list = assets.catalog("branches")
 
     all_areas = db.session.query(AreaOfService).all()
     all_areas_list = [area.to_dict() for area in all_areas]
@@ -3930,7 +3189,7 @@ def add_new_place(current_user):
     return jsonify(place_types=all_place_types_list, branches=all_branches_list, areas=all_areas_list)
 
 
-@app.route("/places-population")
+@bp.route("/places-population")
 @private_route([1, 5])
 def places_population(current_user):
     p_pops = db.session.query(PlacePopulation).all()
@@ -3938,7 +3197,7 @@ def places_population(current_user):
     return jsonify(p_pop_list)
 
 
-@app.route("/edit-place-pop/<place_id>/<year>", methods=["GET", "POST"])
+@bp.route("/edit-place-pop/<place_id>/<year>", methods=["GET", "POST"])
 @private_route([1, 5])
 def edit_place_pop(place_id, year, current_user):
     current_place = db.query.get(Place, place_id)
@@ -3978,7 +3237,7 @@ def edit_place_pop(place_id, year, current_user):
     return jsonify(current_place)
 
 
-@app.route("/new-population/<place_id>", methods=["GET", "POST"])
+@bp.route("/new-population/<place_id>", methods=["GET", "POST"])
 @private_route([1, 5])
 def add_new_population(place_id, current_user):
     current_place = db.query.get(Place, place_id)
@@ -4017,11 +3276,9 @@ def add_new_population(place_id, current_user):
     return jsonify(current_place)
 
 
-@app.route("/balance-plot-calc/<area_id>", methods=["GET", "POST"])
+@bp.route("/balance-plot-calc/<area_id>", methods=["GET", "POST"])
 @private_route([1, 5])
 def balance_plot_calc(area_id, current_user):
-    import pandas as pd
-    import numpy as np
     current_area = db.session.get(AreaOfService, area_id)
     current_area_data = current_area.to_dict()
     current_area_data["stations"] = [station.to_dict() for station in current_area.stations]
@@ -4375,114 +3632,7 @@ def balance_plot_calc(area_id, current_user):
             pd.set_option('display.max_columns', None)
             pd.options.display.float_format = '{:,.5f}'.format
             print(df.head())
-            import matplotlib.pyplot as plt
-            fig, ax = plt.subplots(figsize=(12, 7))
-
-            # --------------------
-            # Plot lines
-            # --------------------
-
-            # Water need (demand)
-            ax.plot(
-                df['year'],
-                df['Q_demanded_monthly_avg'],
-                linestyle='--',
-                color='green',
-                linewidth=2.5,
-                marker='o',
-                label=get_display(arabic_reshaper.reshape('الاحتياج المائي'))
-            )
-
-            # Current production
-            ax.plot(
-                df['year'],
-                df['current_production'],
-                color='lightblue',
-                linewidth=3,
-                marker='s',
-                label=get_display(arabic_reshaper.reshape('القدرة الفعلية'))
-            )
-
-            # Max production (capacity)
-            ax.plot(
-                df['year'],
-                df['max_production'],
-                color='black',
-                linewidth=3,
-                label=get_display(arabic_reshaper.reshape('القدرة التصميمية'))
-            )
-
-            # --------------------
-            # X-axis formatting
-            # --------------------
-            ax.set_xticks(df['year'])
-            ax.set_xticklabels(df['year'], rotation=45)
-
-            # --------------------
-            # Labels & title
-            # --------------------
-            ax.set_xlabel(get_display(arabic_reshaper.reshape('السنة')), fontsize=12)
-            ax.set_ylabel(get_display(arabic_reshaper.reshape('كمية المياه (م³ / يوم)')), fontsize=12)
-
-            if data["calc_type"] == "equation":
-                ax.set_title(
-                    get_display(
-                        arabic_reshaper.reshape(f" منحنى الاتزان ل{current_area.area_name} حسب معادلة نصيب الفرد ")),
-                    fontsize=16,
-                    fontweight='bold',
-                    pad=15
-                )
-            else:
-                ax.set_title(
-                    get_display(
-                        arabic_reshaper.reshape(f" منحنى الاتزان ل{current_area.area_name} حسب قرار الوزارة لتحديد نصيب الفرد ")),
-                    fontsize=16,
-                    fontweight='bold',
-                    pad=15
-                )
-
-            # --------------------
-            # Grid (soft & readable)
-            # --------------------
-            ax.grid(
-                True,
-                which='major',
-                linestyle='--',
-                linewidth=0.6,
-                alpha=0.6
-            )
-
-            # --------------------
-            # Legend (clean & clear)
-            # --------------------
-            ax.legend(
-                loc='upper left',
-                fontsize=11,
-                frameon=True,
-                shadow=True
-            )
-
-            # --------------------
-            # Visual limits (padding)
-            # --------------------
-            y_max = max(
-                df['Q_demanded_monthly_avg'].max(),
-                df['current_production'].max(),
-                df['max_production'].max()
-            )
-            ax.set_ylim(0, y_max * 1.15)
-
-            # --------------------
-            # Layout
-            # --------------------
-            plt.tight_layout()
-            # Save to BytesIO buffer
-            img = io.BytesIO()
-            plt.savefig(img, format='png', dpi=200, bbox_inches='tight')
-            img.seek(0)  # Rewind the buffer
-
-            # Encode image to Base64
-            chart_base64 = base64.b64encode(img.read()).decode('utf-8')
+            chart_base64 = charts.balance_chart(df, current_area.area_name, data["calc_type"])
 
             return jsonify(
                 {
@@ -4497,7 +3647,7 @@ def balance_plot_calc(area_id, current_user):
 # End of planning sector routes
 
 
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     if request.method == "POST":
         data = request.get_json()
@@ -4545,7 +3695,7 @@ def register():
     return jsonify({"response": "الحمد لله"})
 
 
-@app.route("/all-users")
+@bp.route("/all-users")
 @private_route([1])
 def all_users(current_user):
     users = db.session.query(User).all()
@@ -4553,7 +3703,7 @@ def all_users(current_user):
     return jsonify(users_list)
 
 
-@app.route("/edit-user/<emp_code>", methods=["GET", "POST"])
+@bp.route("/edit-user/<emp_code>", methods=["GET", "POST"])
 @private_route([1])
 def verify_user(emp_code, current_user):
     user = db.get_or_404(User, emp_code)
@@ -4567,6 +3717,8 @@ def verify_user(emp_code, current_user):
         if data['reset']:
             new_hashed_password = generate_password_hash('0000', method='pbkdf2:sha256', salt_length=8)
             user.userpassword = new_hashed_password
+        # tokens issued before this edit carry the old version and are rejected from now on
+        user.account_version = (user.account_version or 0) + 1
         try:
             db.session.commit()
         except IntegrityError as e:
@@ -4583,6 +3735,7 @@ def verify_user(emp_code, current_user):
             db.session.rollback()
             return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
         else:
+            user_cache.invalidate(user.emp_code)
             response = {
                 "response": {
                     "success": "تم تعديل بيانات المستخدم بنجاح"
@@ -4593,7 +3746,7 @@ def verify_user(emp_code, current_user):
     return jsonify(groups_list)  #   {"response": "الله أكبر"}
 
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         data = request.get_json()
@@ -4603,7 +3756,15 @@ def login():
         else:
             if user.is_active:
                 # login_user(user)
-                token = create_access_token(identity=user.emp_code)
+                token = create_access_token(
+                    identity=user.emp_code,
+                    additional_claims={
+                        "group_id": user.group_id,
+                        "username": user.username,
+                        "ver": user.account_version,
+                    }
+                )
+                user_cache.put(user)
                 return jsonify(current_user=user.to_dict(), token=token), 200
             else:
                 return jsonify({
@@ -4611,14 +3772,17 @@ def login():
     return jsonify({"response": "لا إله إلا الله"})
 
 
-@app.route("/change-password", methods=["GET", "POST"])
+@bp.route("/change-password", methods=["GET", "POST"])
 @private_route([1, 2, 3, 4, 5, 7])
 def change_password(current_user):
     if request.method == "POST":
         data = request.get_json()
-        if check_password_hash(current_user.userpassword, data['old_password']):
-            current_user.userpassword = generate_password_hash(data['new_password'], method='pbkdf2:sha256',
-                                                               salt_length=8)
+        # current_user is the cached snapshot; the password hash lives on the row
+        user = db.session.get(User, current_user.emp_code)
+        if check_password_hash(user.userpassword, data['old_password']):
+            user.userpassword = generate_password_hash(data['new_password'], method='pbkdf2:sha256',
+                                                       salt_length=8)
+            user.account_version = (user.account_version or 0) + 1
             try:
                 db.session.commit()
             except IntegrityError as e:
@@ -4636,6 +3800,7 @@ def change_password(current_user):
                 db.session.rollback()
                 return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
             else:
+                user_cache.invalidate(user.emp_code)
                 response = {
                     "response": {
                         "success": "تم تغيير كلمة المرور بنجاح"
@@ -4647,13 +3812,13 @@ def change_password(current_user):
     return jsonify({"response": "سبحان الله وبحمده، سبحان الله العظيم"})
 
 
-# @app.route("/logout")
+# @bp.route("/logout")
 # def logout():
 #     # logout_user()
 #     return jsonify({"response": "لا حول ولا قوة إلا بالله العلي العظيم"})
 
 
-@app.route("/groups")
+@bp.route("/groups")
 @private_route([1])
 def groups(current_user):
     groups = db.session.query(Group).all()
@@ -4661,7 +3826,7 @@ def groups(current_user):
     return jsonify(groups_list)
 
 
-@app.route("/edit-group/<group_id>", methods=["GET", "POST"])
+@bp.route("/edit-group/<group_id>", methods=["GET", "POST"])
 @private_route([1])
 def edit_group(group_id, current_user):
     group = db.session.get(Group, group_id)
@@ -4694,7 +3859,7 @@ def edit_group(group_id, current_user):
     return jsonify({"response": "ربنا آتنا في الدنيا حسنة وفي الآخرة حسنة وقنا عذاب النار"})
 
 
-@app.route("/new-group", methods=["GET", "POST"])
+@bp.route("/new-group", methods=["GET", "POST"])
 @private_route([1])
 def add_new_group(current_user):
     if request.method == "POST":
@@ -4729,7 +3894,7 @@ def add_new_group(current_user):
     return jsonify({"response": "اللهم اعنا على ذكرك وشكرك وحسن عبادتك"})
 
 
-@app.route("/permissions")
+@bp.route("/permissions")
 @private_route([1])
 def all_permissions(current_user):
     permissions = db.session.query(Permission).all()
@@ -4737,7 +3902,7 @@ def all_permissions(current_user):
     return jsonify(permissions_list)
 
 
-@app.route("/new-permission", methods=["GET", "POST"])
+@bp.route("/new-permission", methods=["GET", "POST"])
 @private_route([1])
 def add_new_permission(current_user):
     if request.method == "POST":
@@ -4762,6 +3927,7 @@ def add_new_permission(current_user):
             db.session.rollback()
             return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
         else:
+            permission_matrix.invalidate()
             response = {
                 "response": {
                     "success": "تم إضافة الصلاحية بنجاح"
@@ -4771,7 +3937,7 @@ def add_new_permission(current_user):
     return jsonify({"response": "سبحان الله"})
 
 
-@app.route("/delete-permission/<permission_id>", methods=["GET", "POST"])
+@bp.route("/delete-permission/<permission_id>", methods=["GET", "POST"])
 @private_route([1])
 def delete_permission(permission_id, current_user):
     permission = db.session.get(Permission, permission_id)
@@ -4792,6 +3958,7 @@ def delete_permission(permission_id, current_user):
         db.session.rollback()
         return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
     else:
+        permission_matrix.invalidate()
         response = {
             "response": {
                 "success": "تم حذف الصلاحية من قاعدة البيانات بنجاح"
@@ -4800,7 +3967,7 @@ def delete_permission(permission_id, current_user):
         return jsonify(response), 200
 
 
-@app.route("/group-permissions")
+@bp.route("/group-permissions")
 @private_route([1])
 def all_group_permissions(current_user):
     group_permissions = db.session.query(Permission).all()
@@ -4808,7 +3975,7 @@ def all_group_permissions(current_user):
     return jsonify(group_permissions_list)
 
 
-@app.route("/new-group-permission", methods=["GET", "POST"])
+@bp.route("/new-group-permission", methods=["GET", "POST"])
 @private_route([1])
 def new_group_permission(current_user):
     groups = db.session.query(Group).all()
@@ -4838,6 +4005,7 @@ def new_group_permission(current_user):
             db.session.rollback()
             return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
         else:
+            permission_matrix.invalidate()
             response = {
                 "response": {
                     "success": "تم إضافة الصلاحية للمجموعة بنجاح"
@@ -4848,7 +4016,7 @@ def new_group_permission(current_user):
     return jsonify(groups=groups_list, permissions=permissions_list)
 
 
-@app.route("/delete-group-permission/<group_id>/<permission_id>", methods=["GET", "post"])
+@bp.route("/delete-group-permission/<group_id>/<permission_id>", methods=["GET", "post"])
 @private_route([1])
 def delete_group_permission(group_id, permission_id, current_user):
     g_p = db.session.get(GroupPermission, (group_id, permission_id))
@@ -4869,6 +4037,7 @@ def delete_group_permission(group_id, permission_id, current_user):
         db.session.rollback()
         return jsonify({"error": "حدث خطأ غير متوقع", "details": str(e)}), 503
     else:
+        permission_matrix.invalidate()
         response = {
             "response": {
                 "success": "تم حذف الصلاحية من المجموعة بنجاح"
@@ -4877,7 +4046,105 @@ def delete_group_permission(group_id, permission_id, current_user):
         return jsonify(response), 200
 
 
-# @app.route("/test-delete", methods=["GET"])
+@bp.route("/audit")
+@private_route([1])
+def audit_log(current_user):
+    args = request.args
+    try:
+        limit = min(int(args.get('limit', AUDIT_PAGE_SIZE)), AUDIT_MAX_PAGE_SIZE)
+        date_from = parse_audit_date(args['date_from']) if args.get('date_from') else None
+        date_to = parse_audit_date(args['date_to'], end_of_day=True) if args.get('date_to') else None
+        rows, next_cursor = query_audit_log(
+            db.session,
+            table_name=args.get('table'),
+            action=args.get('action'),
+            username=args.get('user'),
+            date_from=date_from,
+            date_to=date_to,
+            cursor=args.get('cursor'),
+            limit=max(limit, 1),
+        )
+    except ValueError as e:
+        return jsonify({"error": "معاملات البحث غير صالحة", "details": str(e)}), 400
+    except SQLAlchemyError as e:
+        return jsonify({"error": "خطأ في قاعدة البيانات", "details": str(e)}), 500
+    return jsonify({
+        "items": rows,
+        "next_cursor": next_cursor,
+    })
+
+
+@bp.route("/audit-daily-summary")
+@private_route([1])
+def audit_daily_summary(current_user):
+    """Archived entry counts per day/table/user/action (filled by `flask audit-archive`)."""
+    args = request.args
+    query = db.session.query(AuditingDailyRollup)
+    try:
+        if args.get('date_from'):
+            query = query.filter(AuditingDailyRollup.audit_day >= parse_audit_date(args['date_from']).date())
+        if args.get('date_to'):
+            query = query.filter(AuditingDailyRollup.audit_day <= parse_audit_date(args['date_to']).date())
+    except ValueError as e:
+        return jsonify({"error": "معاملات البحث غير صالحة", "details": str(e)}), 400
+    if args.get('table'):
+        query = query.filter(AuditingDailyRollup.table_name == args['table'])
+    if args.get('user'):
+        query = query.filter(AuditingDailyRollup.username == args['user'])
+    rows = query.order_by(AuditingDailyRollup.audit_day.desc()).limit(AUDIT_MAX_PAGE_SIZE * 10).all()
+    return jsonify([row.to_dict() for row in rows])
+
+
+@bp.route("/metrics")
+def metrics():
+    # scraped by Prometheus, which has no JWT, so a static token is required instead; off without one
+    token = current_app.config.get('METRICS_TOKEN')
+    if not token:
+        abort(404)
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return jsonify({'error': 'Access forbidden'}), 403
+    pool = pool_stats.snapshot(db.engine)
+    audit = audit_writer.stats()
+    allocation = allocation_queue.stats()
+    gauges = {
+        "db_pool_checked_out": pool.get("checked_out", 0),
+        "db_pool_overflow": pool.get("overflow", 0),
+        "db_pool_wait_seconds_max": pool["wait_max_ms"] / 1000,
+        "audit_queue_depth": audit["queue_depth"],
+        "audit_entries_dropped": audit["dropped"],
+        "allocation_jobs_in_flight": allocation["in_flight"],
+        "allocation_jobs_failed": allocation["failed"],
+    }
+    response = make_response(request_metrics.render(gauges))
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
+@bp.route("/slow-queries")
+@private_route([1])
+def slow_queries(current_user):
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({
+        "threshold_ms": slow_query_log.threshold_ms,
+        "plan_threshold_ms": slow_query_log.plan_threshold_ms,
+        "top": slow_query_log.top(limit),
+        "recent": slow_query_log.latest(limit),
+    })
+
+
+@bp.route("/pool-stats")
+@private_route([1])
+def pool_stats_view(current_user):
+    return jsonify(pool_stats.snapshot(db.engine))
+
+
+@bp.route("/audit-queue-stats")
+@private_route([1])
+def audit_queue_stats(current_user):
+    return jsonify(audit_writer.stats())
+
+
+# @bp.route("/test-delete", methods=["GET"])
 # def test_delete():
 #     test_tech = db.session.query(Technology).filter(Technology.technology_name == "test-delete").first()
 #     db.session.delete(test_tech)
@@ -4885,7 +4152,7 @@ def delete_group_permission(group_id, permission_id, current_user):
 #     return jsonify({"success": True})
 
 
-@app.route("/test-sunburst")
+@bp.route("/test-sunburst")
 def test_sunburst():
     query = db.session.query(
         Branch.branch_name,
@@ -4930,6 +4197,52 @@ def test_sunburst():
     return jsonify({"chart": fig_json})
 
 
+@bp.cli.command("init-db")
+def init_db_command():
+    """Create missing tables (run once per deploy instead of on every worker boot)."""
+    db.create_all()
+    print("database tables created")
+
+
+def create_app(config=None):
+    """
+    Build the Flask app. config is an object (like config.Config) or a dict of
+    overrides applied on top of Config.
+    """
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+
+    CORS(app)
+    CORS(app, supports_credentials=True, origins=app.config['CORS_ORIGINS'])
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    db.init_app(app)
+    with app.app_context():
+        attach_pool_stats(db.engine)
+        request_metrics.attach(db.engine)
+        slow_query_log.attach(db.engine)
+    request_metrics.init_app(app)
+    slow_query_log.init_app(app)
+    jwt.init_app(app)
+    migrate.init_app(app, db, include_object=include_object)  # audit archive tables are not migration-managed
+    audit_writer.init_app(app)
+    allocation_queue.init_app(app)
+    topology_cache.invalidate()   # the index belongs to the database this app points at
+    app.register_blueprint(bp)
+    precompute_mapper_infos(db.Model)
+
+    if app.config['CREATE_ALL_ON_STARTUP']:
+        with app.app_context():
+            db.create_all()
+    if app.config['PRELOAD_ASSETS']:
+        assets.preload(app)
+    return app
+
+
 if __name__ == '__main__':
-    # create_indexes_mssql()
+    app = create_app({'CREATE_ALL_ON_STARTUP': True})
+    # create_indexes_mssql(app)
     app.run(host='0.0.0.0', port=5000, debug=True)
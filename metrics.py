@@ -0,0 +1,186 @@
+"""
+Per-endpoint request metrics in Prometheus text format (/metrics).
+
+For every request: latency histogram, number of SQL statements and the time
+spent in them (counted by before/after_cursor_execute on the engine), and
+response size.  A request running more than METRICS_QUERY_THRESHOLD
+statements is counted in http_requests_over_query_threshold_total and
+logged with its path; that is where N+1 loops (to_dict() walking
+relationships per row) show up.
+
+Metrics are per process: with several workers each one reports its own
+numbers, so scrape every worker or sum them on the Prometheus side.
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+from flask import g, request, has_request_context
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+METRICS_QUERY_THRESHOLD = 50
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, n in zip(self.buckets, self.counts):
+            cumulative += n
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_bucket{{{labels},le="+Inf"}} {self.count}'
+        yield f"{name}_sum{{{labels}}} {self.total}"
+        yield f"{name}_count{{{labels}}} {self.count}"
+
+
+class EndpointMetrics:
+    __slots__ = ("latency", "queries", "size", "sql_seconds", "over_threshold", "statuses")
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_COUNT_BUCKETS)
+        self.size = Histogram(SIZE_BUCKETS)
+        self.sql_seconds = 0.0
+        self.over_threshold = 0
+        self.statuses = defaultdict(int)   # (method, status) -> count
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RequestMetrics:
+    def __init__(self, query_threshold=METRICS_QUERY_THRESHOLD):
+        self.query_threshold = query_threshold
+        self.app = None
+        self._lock = threading.Lock()
+        self._endpoints = defaultdict(EndpointMetrics)
+
+    def init_app(self, app):
+        self.app = app
+        self.query_threshold = app.config.get("METRICS_QUERY_THRESHOLD", self.query_threshold)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+
+    def attach(self, engine):
+        """Count statements and their time for the current request."""
+        if getattr(engine, "_request_metrics_attached", False):
+            return
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        engine._request_metrics_attached = True
+
+    # --- hooks ---------------------------------------------------------------
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @staticmethod
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("metrics_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        if has_request_context() and "metrics_start" in g:
+            g.metrics_sql_count += 1
+            g.metrics_sql_seconds += elapsed
+
+    @staticmethod
+    def _before_request():
+        g.metrics_start = time.perf_counter()
+        g.metrics_sql_count = 0
+        g.metrics_sql_seconds = 0.0
+
+    def _after_request(self, response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or "unmatched"
+        sql_count = g.get("metrics_sql_count", 0)
+        size = response.calculate_content_length() or 0
+
+        with self._lock:
+            metrics = self._endpoints[endpoint]
+            metrics.latency.observe(elapsed)
+            metrics.queries.observe(sql_count)
+            metrics.size.observe(size)
+            metrics.sql_seconds += g.get("metrics_sql_seconds", 0.0)
+            metrics.statuses[(request.method, response.status_code)] += 1
+            if sql_count > self.query_threshold:
+                metrics.over_threshold += 1
+
+        if sql_count > self.query_threshold:
+            self.app.logger.warning(f"[METRICS] {request.method} {request.path} ran {sql_count} SQL statements "
+                                    f"(threshold {self.query_threshold})")
+        response.headers["X-Query-Count"] = str(sql_count)
+        return response
+
+    # --- exposition ------------------------------------------------------------
+
+    def render(self, gauges=None):
+        """Prometheus text exposition; gauges is an optional {name: value} of extra process gauges."""
+        with self._lock:
+            snapshot = list(self._endpoints.items())
+            lines = [
+                "# HELP http_requests_total Requests by endpoint, method and status.",
+                "# TYPE http_requests_total counter",
+            ]
+            for endpoint, m in snapshot:
+                for (method, status), n in sorted(m.statuses.items()):
+                    lines.append(f'http_requests_total{{endpoint="{_escape(endpoint)}",method="{method}",'
+                                 f'status="{status}"}} {n}')
+
+            for name, attr, help_text in (
+                ("http_request_duration_seconds", "latency", "Request latency."),
+                ("http_request_sql_queries", "queries", "SQL statements per request."),
+                ("http_response_size_bytes", "size", "Response body size."),
+            ):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for endpoint, m in snapshot:
+                    lines.extend(getattr(m, attr).lines(name, f'endpoint="{_escape(endpoint)}"'))
+
+            lines.append("# HELP http_request_sql_seconds_total Time spent executing SQL.")
+            lines.append("# TYPE http_request_sql_seconds_total counter")
+            for endpoint, m in snapshot:
+                lines.append(f'http_request_sql_seconds_total{{endpoint="{_escape(endpoint)}"}} {m.sql_seconds}')
+
+            lines.append("# HELP http_requests_over_query_threshold_total Requests above METRICS_QUERY_THRESHOLD "
+                         "SQL statements.")
+            lines.append("# TYPE http_requests_over_query_threshold_total counter")
+            for endpoint, m in snapshot:
+                lines.append(f'http_requests_over_query_threshold_total{{endpoint="{_escape(endpoint)}"}} '
+                             f'{m.over_threshold}')
+
+        for name, value in (gauges or {}).items():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+request_metrics = RequestMetrics()
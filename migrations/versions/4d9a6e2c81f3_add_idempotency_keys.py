@@ -0,0 +1,32 @@
+"""add idempotency_keys
+
+Revision ID: 4d9a6e2c81f3
+Revises: b71d0e93c5a2
+Create Date: 2026-10-17 18:40:52.117204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d9a6e2c81f3'
+down_revision = 'b71d0e93c5a2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('idempotency_key', sa.String(length=100), nullable=False),
+        sa.Column('request_hash', sa.String(length=64), nullable=False),
+        sa.Column('response_status', sa.Integer(), nullable=False),
+        sa.Column('response_body', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('idempotency_key'),
+    )
+
+
+def downgrade():
+    op.drop_table('idempotency_keys')
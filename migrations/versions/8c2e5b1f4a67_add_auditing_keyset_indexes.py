@@ -0,0 +1,30 @@
+"""add auditing keyset indexes
+
+Revision ID: 8c2e5b1f4a67
+Revises: 3f1c2a9d7b40
+Create Date: 2026-10-17 13:40:02.771930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2e5b1f4a67'
+down_revision = '3f1c2a9d7b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('auditing', schema=None) as batch_op:
+        batch_op.create_index('idx_auditing_date_id', ['audit_date', 'audit_id'], unique=False)
+        batch_op.create_index('idx_auditing_table_date_id', ['table_name', 'audit_date', 'audit_id'], unique=False)
+        batch_op.create_index('idx_auditing_user_date_id', ['username', 'audit_date', 'audit_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('auditing', schema=None) as batch_op:
+        batch_op.drop_index('idx_auditing_user_date_id')
+        batch_op.drop_index('idx_auditing_table_date_id')
+        batch_op.drop_index('idx_auditing_date_id')
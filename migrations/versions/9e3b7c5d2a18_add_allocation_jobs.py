@@ -0,0 +1,43 @@
+"""add allocation_jobs
+
+Revision ID: 9e3b7c5d2a18
+Revises: 4d9a6e2c81f3
+Create Date: 2026-10-17 21:12:35.402816
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e3b7c5d2a18'
+down_revision = '4d9a6e2c81f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'allocation_jobs',
+        sa.Column('job_id', sa.String(length=32), nullable=False),
+        sa.Column('kind', sa.String(length=30), nullable=False),
+        sa.Column('job_key', sa.String(length=100), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(length=10), nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('result', sa.Text(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_by', sa.String(length=30), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('job_id'),
+    )
+    op.create_index('idx_allocation_jobs_status', 'allocation_jobs', ['status', 'created_at'])
+    op.create_index('idx_allocation_jobs_key', 'allocation_jobs', ['job_key'])
+
+
+def downgrade():
+    op.drop_index('idx_allocation_jobs_key', table_name='allocation_jobs')
+    op.drop_index('idx_allocation_jobs_status', table_name='allocation_jobs')
+    op.drop_table('allocation_jobs')
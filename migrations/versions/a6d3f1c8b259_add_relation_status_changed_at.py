@@ -0,0 +1,27 @@
+"""add station_guage_technology.status_changed_at
+
+Revision ID: a6d3f1c8b259
+Revises: d2f6b9a41c85
+Create Date: 2026-10-18 13:02:41.217436
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d3f1c8b259'
+down_revision = 'd2f6b9a41c85'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing relations stay NULL: their history isn't known, so they don't block recompute-month
+    with op.batch_alter_table('station_guage_technology', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('status_changed_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('station_guage_technology', schema=None) as batch_op:
+        batch_op.drop_column('status_changed_at')
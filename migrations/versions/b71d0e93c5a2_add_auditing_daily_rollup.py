@@ -0,0 +1,32 @@
+"""add auditing_daily_rollup
+
+Revision ID: b71d0e93c5a2
+Revises: 8c2e5b1f4a67
+Create Date: 2026-10-17 15:02:19.508113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71d0e93c5a2'
+down_revision = '8c2e5b1f4a67'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'auditing_daily_rollup',
+        sa.Column('audit_day', sa.Date(), nullable=False),
+        sa.Column('table_name', sa.String(length=100), nullable=False),
+        sa.Column('username', sa.String(length=30), nullable=False),
+        sa.Column('action', sa.String(length=10), nullable=False),
+        sa.Column('entry_count', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('audit_day', 'table_name', 'username', 'action'),
+    )
+
+
+def downgrade():
+    op.drop_table('auditing_daily_rollup')
@@ -0,0 +1,43 @@
+"""add guage_bill.is_distributed
+
+Revision ID: c4a8e1f07d36
+Revises: 9e3b7c5d2a18
+Create Date: 2026-10-18 10:04:51.227390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a8e1f07d36'
+down_revision = '9e3b7c5d2a18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('guage_bill', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('is_distributed', sa.Boolean(), nullable=False, server_default='0'))
+    # intake bills the previous code has distributed: every technology they feed had its water amount
+    op.execute("""
+        UPDATE guage_bill SET is_distributed = 1
+        WHERE EXISTS (
+            SELECT 1 FROM station_guage_technology r
+            WHERE r.account_number = guage_bill.account_number AND r.is_source = 1 AND r.relation_status = 1
+        ) AND NOT EXISTS (
+            SELECT 1 FROM station_guage_technology r
+            WHERE r.account_number = guage_bill.account_number AND r.is_source = 1 AND r.relation_status = 1
+              AND NOT EXISTS (
+                  SELECT 1 FROM technology_bill t
+                  WHERE t.station_id = r.station_id AND t.technology_id = r.technology_id
+                    AND t.bill_month = guage_bill.bill_month AND t.bill_year = guage_bill.bill_year
+                    AND t.technology_water_amount IS NOT NULL AND t.technology_bill_percentage IS NOT NULL
+              )
+        )
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('guage_bill', schema=None) as batch_op:
+        batch_op.drop_column('is_distributed', mssql_drop_default=True)
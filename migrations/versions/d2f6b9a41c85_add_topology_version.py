@@ -0,0 +1,30 @@
+"""add topology_version
+
+Revision ID: d2f6b9a41c85
+Revises: c4a8e1f07d36
+Create Date: 2026-10-18 11:26:09.583104
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f6b9a41c85'
+down_revision = 'c4a8e1f07d36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    table = op.create_table(
+        'topology_version',
+        sa.Column('version_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('version_id'),
+    )
+    op.bulk_insert(table, [{'version_id': 1, 'version': 1}])
+
+
+def downgrade():
+    op.drop_table('topology_version')
@@ -0,0 +1,47 @@
+"""add allocation_jobs.bill_month and bill_year
+
+Revision ID: e7c14b9d3f62
+Revises: a6d3f1c8b259
+Create Date: 2026-10-18 14:20:57.608113
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7c14b9d3f62'
+down_revision = 'a6d3f1c8b259'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('allocation_jobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('bill_month', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('bill_year', sa.Integer(), nullable=True))
+
+    # every job's payload carries its period
+    jobs = sa.table('allocation_jobs', sa.column('job_id', sa.String), sa.column('payload', sa.Text),
+                    sa.column('bill_month', sa.Integer), sa.column('bill_year', sa.Integer))
+    conn = op.get_bind()
+    periods = [{"b_job_id": job_id, "b_month": payload["bill_month"], "b_year": payload["bill_year"]}
+               for job_id, payload in ((row.job_id, json.loads(row.payload))
+                                       for row in conn.execute(sa.select(jobs.c.job_id, jobs.c.payload)))]
+    if periods:
+        conn.execute(jobs.update().where(jobs.c.job_id == sa.bindparam("b_job_id"))
+                     .values(bill_month=sa.bindparam("b_month"), bill_year=sa.bindparam("b_year")), periods)
+
+    with op.batch_alter_table('allocation_jobs', schema=None) as batch_op:
+        batch_op.alter_column('bill_month', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('bill_year', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_index('idx_allocation_jobs_period', ['bill_year', 'bill_month', 'status'])
+
+
+def downgrade():
+    with op.batch_alter_table('allocation_jobs', schema=None) as batch_op:
+        batch_op.drop_index('idx_allocation_jobs_period')
+        batch_op.drop_column('bill_year')
+        batch_op.drop_column('bill_month')
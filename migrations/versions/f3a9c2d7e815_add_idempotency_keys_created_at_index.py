@@ -0,0 +1,25 @@
+"""add idx_idempotency_keys_created_at
+
+Revision ID: f3a9c2d7e815
+Revises: e7c14b9d3f62
+Create Date: 2026-10-18 16:05:12.843907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9c2d7e815'
+down_revision = 'e7c14b9d3f62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # lets `flask idempotency-purge` find the expired keys without scanning the table
+    op.create_index('idx_idempotency_keys_created_at', 'idempotency_keys', ['created_at'])
+
+
+def downgrade():
+    op.drop_index('idx_idempotency_keys_created_at', table_name='idempotency_keys')
@@ -1,8 +1,9 @@
+import json
 from decimal import Decimal
 
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase, relationship
-from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Float, ForeignKey, NVARCHAR, Numeric, DECIMAL
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, Float, ForeignKey, NVARCHAR, Numeric, DECIMAL, Index
 from flask_login import UserMixin
 
 
@@ -155,6 +156,8 @@ class StationGaugeTechnology(db.Model):
     account_number = db.Column(NVARCHAR(50), db.ForeignKey('guages.account_number'), primary_key=True)
     relation_status = db.Column(Boolean, nullable=False)
     is_source = db.Column(Boolean, nullable=False)
+    # set by /new-relation and /edit-relation; months that ended before it can't be recomputed (recompute.py)
+    status_changed_at = db.Column(db.DateTime, nullable=True)
 
     station = db.relationship('Station', back_populates='station_techs')
     technology = db.relationship('Technology', back_populates='station_techs')
@@ -203,6 +206,8 @@ class GuageBill(db.Model):
     notes = db.Column(NVARCHAR(4000), nullable=True)
     delay_month = db.Column(Integer, nullable=True)
     delay_year = db.Column(Integer, nullable=True)
+    # intake (is_source) bills: its distribution over the technologies it feeds is applied (allocation.py)
+    is_distributed = db.Column(Boolean, nullable=False, default=False, server_default='0')
 
     guage = db.relationship('Gauge', back_populates='bills')
     voltage = db.relationship('Voltage', back_populates='bills')
@@ -446,6 +451,8 @@ class User(UserMixin, db.Model):
     userpassword = db.Column(NVARCHAR(300), nullable=False)
     group_id = db.Column(Integer, db.ForeignKey('groups.group_id'))
     is_active = db.Column(Boolean, nullable=False)
+    # bumped on every account edit so tokens minted before the edit are detected as stale
+    account_version = db.Column(Integer, nullable=False, default=1, server_default='1')
 
     group = db.relationship('Group', back_populates='users')
     audits = db.relationship("Auditing", back_populates="user")
@@ -465,6 +472,12 @@ class User(UserMixin, db.Model):
 
 class Auditing(db.Model):
     __tablename__ = "auditing"
+    # keyset pagination of /audit walks (audit_date, audit_id) descending, optionally per table or user
+    __table_args__ = (
+        Index("idx_auditing_date_id", "audit_date", "audit_id"),
+        Index("idx_auditing_table_date_id", "table_name", "audit_date", "audit_id"),
+        Index("idx_auditing_user_date_id", "username", "audit_date", "audit_id"),
+    )
 
     audit_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     username = db.Column(db.String(30), db.ForeignKey("users.username"), nullable=False)
@@ -487,4 +500,87 @@ class Auditing(db.Model):
             "table_name": self.table_name,
             "old_data": self.old_data,
             "new_data": self.new_data,
-        }
\ No newline at end of file
+        }
+
+class AuditingDailyRollup(db.Model):
+    """Entry counts per day/table/user/action, kept after the rows themselves are archived."""
+    __tablename__ = "auditing_daily_rollup"
+
+    audit_day = db.Column(db.Date, primary_key=True)
+    table_name = db.Column(db.String(100), primary_key=True)
+    username = db.Column(db.String(30), primary_key=True)
+    action = db.Column(db.String(10), primary_key=True)
+    entry_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def to_dict(self):
+        return {
+            "audit_day": self.audit_day.isoformat() if self.audit_day else None,
+            "table_name": self.table_name,
+            "username": self.username,
+            "action": self.action,
+            "entry_count": self.entry_count,
+        }
+
+
+class IdempotencyKey(db.Model):
+    """Stored response of a write made with an Idempotency-Key header (see idempotency.py)."""
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        Index("idx_idempotency_keys_created_at", "created_at"),
+    )
+
+    idempotency_key = db.Column(db.String(100), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)      # sha256 of method, path and body
+    response_status = db.Column(db.Integer, nullable=False)
+    response_body = db.Column(db.Text, nullable=False)           # JSON
+    created_at = db.Column(db.DateTime, nullable=False)
+
+
+class AllocationJob(db.Model):
+    """Deferred technology bill allocation, run by the background queue (see jobs.py)."""
+    __tablename__ = "allocation_jobs"
+    __table_args__ = (
+        Index("idx_allocation_jobs_status", "status", "created_at"),
+        Index("idx_allocation_jobs_key", "job_key"),
+        Index("idx_allocation_jobs_period", "bill_year", "bill_month", "status"),
+    )
+
+    job_id = db.Column(db.String(32), primary_key=True)            # uuid4 hex, known before the insert
+    kind = db.Column(db.String(30), nullable=False)                # gauge_bill / tech_bill
+    job_key = db.Column(db.String(100), nullable=False)            # the row it propagates, e.g. gauge_bill:<acct>:3:2025
+    bill_month = db.Column(db.Integer, nullable=False)             # the row's period, copied from the payload
+    bill_year = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=False)                   # JSON
+    status = db.Column(db.String(10), nullable=False)              # pending / running / done / failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    result = db.Column(db.Text, nullable=True)                     # JSON returned by the handler
+    error = db.Column(db.Text, nullable=True)
+    created_by = db.Column(db.String(30), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "job_key": self.job_key,
+            "bill_month": self.bill_month,
+            "bill_year": self.bill_year,
+            "status": self.status,
+            "attempts": self.attempts,
+            "result": json.loads(self.result) if self.result else None,
+            "error": self.error,
+            "created_by": self.created_by,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class TopologyVersion(db.Model):
+    """One row, bumped with every station_guage_technology change so all workers reload it (see topology.py)."""
+    __tablename__ = "topology_version"
+
+    version_id = db.Column(db.Integer, primary_key=True, autoincrement=False)   # always 1
+    version = db.Column(db.BigInteger, nullable=False)
@@ -0,0 +1,133 @@
+"""
+Group/permission matrix used by private_route.
+
+group_premessions is loaded once into one integer bitmask per group, with
+every permession_name mapped to a bit index.  A request check is then a
+dict lookup plus a bit test, with no query.  The matrix is reloaded lazily
+after the permission admin routes commit (invalidate()) and at most every
+PERMISSION_MATRIX_MAX_AGE seconds so sibling workers pick up edits too.
+
+Permission names match route function names (e.g. "add_new_bill").  Routes
+whose name has no row in premessions keep using the group list passed to
+private_route, so the matrix can be rolled out one route at a time
+(see `flask seed-permissions`).
+"""
+
+import threading
+import time
+
+from models import db, Group, Permission, GroupPermission
+
+PERMISSION_MATRIX_MAX_AGE = 300  # seconds
+
+
+class PermissionMatrix:
+    def __init__(self, max_age=PERMISSION_MATRIX_MAX_AGE):
+        self.max_age = max_age
+        self._state = ({}, {})  # (permession_name -> bit index, group_id -> int bitmask), swapped as one
+        self._loaded_at = None
+        self._generation = 0    # bumped by invalidate(); a load that overlaps one doesn't count as fresh
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self.declared = {}     # route permission name -> default group list from private_route
+
+    def declare(self, name, allowed_groups):
+        self.declared[name] = list(allowed_groups)
+
+    def load(self):
+        generation = self._generation
+        permissions = db.session.query(Permission.permession_id, Permission.permession_name).all()
+        pairs = db.session.query(GroupPermission.group_id, GroupPermission.permession_id).all()
+
+        bits = {}
+        bit_by_id = {}
+        for index, (permession_id, name) in enumerate(permissions):
+            bits[name] = index
+            bit_by_id[permession_id] = index
+
+        masks = {}
+        for group_id, permession_id in pairs:
+            bit = bit_by_id.get(permession_id)
+            if bit is not None:
+                masks[group_id] = masks.get(group_id, 0) | (1 << bit)
+
+        with self._lock:
+            self._state = (bits, masks)
+            if generation == self._generation:
+                self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._loaded_at = None
+
+    def _stale(self):
+        loaded_at = self._loaded_at
+        return loaded_at is None or time.monotonic() - loaded_at > self.max_age
+
+    def ensure_loaded(self):
+        if self._stale():
+            # one request reloads, the others wait for it instead of loading too
+            with self._load_lock:
+                if self._stale():
+                    self.load()
+
+    def knows(self, name):
+        return name in self._state[0]
+
+    def allows(self, group_id, name):
+        bits, masks = self._state
+        bit = bits.get(name)
+        if bit is None:
+            return False
+        return bool(masks.get(group_id, 0) >> bit & 1)
+
+    def is_allowed(self, group_id, name, allowed_groups):
+        """Matrix decision when the permission is defined, else the decorator's group list."""
+        self.ensure_loaded()
+        bits, masks = self._state   # one snapshot, not two reads across a reload
+        bit = bits.get(name)
+        if bit is None:
+            return group_id in allowed_groups
+        return bool(masks.get(group_id, 0) >> bit & 1)
+
+    def allowed_groups(self, name, allowed_groups):
+        """The groups is_allowed() lets through for name."""
+        bits, masks = self._state
+        bit = bits.get(name)
+        if bit is None:
+            return list(allowed_groups)
+        return sorted(group_id for group_id, mask in masks.items() if mask >> bit & 1)
+
+
+permission_matrix = PermissionMatrix()
+
+
+def seed_permissions():
+    """
+    Insert a premessions row per private_route and grant it to the groups in
+    its decorator list.  Existing rows are left alone; returns the number of
+    (permissions, grants) added.
+    """
+    existing = {name: pid for pid, name in db.session.query(Permission.permession_id, Permission.permession_name)}
+    group_ids = {gid for (gid,) in db.session.query(Group.group_id)}
+    granted = set(db.session.query(GroupPermission.group_id, GroupPermission.permession_id).all())
+
+    added_permissions = 0
+    added_grants = 0
+    for name, allowed_groups in sorted(permission_matrix.declared.items()):
+        if name not in existing:
+            permission = Permission(permession_name=name)
+            db.session.add(permission)
+            db.session.flush()
+            existing[name] = permission.permession_id
+            added_permissions += 1
+        for group_id in allowed_groups:
+            key = (group_id, existing[name])
+            if group_id in group_ids and key not in granted:
+                db.session.add(GroupPermission(group_id=group_id, permession_id=existing[name]))
+                granted.add(key)
+                added_grants += 1
+    db.session.commit()
+    permission_matrix.invalidate()
+    return added_permissions, added_grants
@@ -0,0 +1,121 @@
+"""
+Engine/pool configuration and pool telemetry.
+
+engine_options() turns the DB_* settings into SQLALCHEMY_ENGINE_OPTIONS:
+QueuePool sizing, recycle and pre-ping, plus pyodbc fast_executemany for
+mssql+pyodbc URLs.  The pool is a TimedQueuePool, which records how long
+checkouts wait for a free connection; attach() adds pool event listeners
+that count connects/checkouts/checkins/invalidations.  /pool-stats reports
+both together with the pool's live status.
+"""
+
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+SLOW_CHECKOUT_SECONDS = 0.01
+
+
+class PoolStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.counters = {
+            "connects": 0,
+            "checkouts": 0,
+            "checkins": 0,
+            "invalidations": 0,
+            "timeouts": 0,
+            "slow_checkouts": 0,
+        }
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.wait_count = 0
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total += seconds
+            if seconds > self.wait_max:
+                self.wait_max = seconds
+            if seconds >= SLOW_CHECKOUT_SECONDS:
+                self.counters["slow_checkouts"] += 1
+
+    def snapshot(self, engine=None):
+        with self._lock:
+            data = dict(self.counters)
+            data["wait_count"] = self.wait_count
+            data["wait_total_ms"] = round(self.wait_total * 1000, 3)
+            data["wait_avg_ms"] = round(self.wait_total / self.wait_count * 1000, 3) if self.wait_count else 0.0
+            data["wait_max_ms"] = round(self.wait_max * 1000, 3)
+        if engine is not None:
+            pool = engine.pool
+            data["pool_class"] = type(pool).__name__
+            data["status"] = pool.status()
+            if isinstance(pool, QueuePool):
+                data["size"] = pool.size()
+                data["checked_in"] = pool.checkedin()
+                data["checked_out"] = pool.checkedout()
+                data["overflow"] = pool.overflow()
+        return data
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that reports the time each checkout waited for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.count("timeouts")
+            raise
+        finally:
+            pool_stats.record_wait(time.perf_counter() - start)
+
+
+def _is_memory_sqlite(uri):
+    return uri.startswith("sqlite") and (uri in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in uri)
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS from the DB_* settings; explicit engine options win."""
+    uri = config.get("SQLALCHEMY_DATABASE_URI") or ""
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    options.setdefault("pool_pre_ping", config["DB_POOL_PRE_PING"])
+
+    # an in-memory SQLite DB is per connection, so it keeps Flask-SQLAlchemy's static pool
+    if not _is_memory_sqlite(uri):
+        options.setdefault("poolclass", TimedQueuePool)
+        options.setdefault("pool_size", config["DB_POOL_SIZE"])
+        options.setdefault("max_overflow", config["DB_MAX_OVERFLOW"])
+        options.setdefault("pool_timeout", config["DB_POOL_TIMEOUT"])
+        options.setdefault("pool_recycle", config["DB_POOL_RECYCLE"])
+
+    if uri.startswith("mssql+pyodbc") and config["DB_FAST_EXECUTEMANY"]:
+        # executemany() sends parameter arrays instead of one round trip per row
+        options.setdefault("fast_executemany", True)
+    return options
+
+
+def attach(engine):
+    """Count pool events of engine (listeners survive engine.dispose())."""
+    if getattr(engine, "_pool_stats_attached", False):
+        return
+    event.listen(engine, "connect", lambda dbapi_conn, record: pool_stats.count("connects"))
+    event.listen(engine, "checkout", lambda dbapi_conn, record, proxy: pool_stats.count("checkouts"))
+    event.listen(engine, "checkin", lambda dbapi_conn, record: pool_stats.count("checkins"))
+    event.listen(engine, "invalidate", lambda dbapi_conn, record, exc: pool_stats.count("invalidations"))
+    engine._pool_stats_attached = True
@@ -0,0 +1,237 @@
+"""
+Month recompute of technology bill allocations (`flask recompute-month`).
+
+The billing routes keep technology_power_consump, technology_bill_total and
+technology_bill_percentage up to date incrementally, one gauge bill or water
+entry at a time.  recompute_month() rebuilds them for a whole month (or one
+branch of it) from the gauge bills, active relations and water amounts,
+loaded with one query each and allocated in one vectorized pass:
+
+  station gauge, one relation     100% of its bill to that technology
+  station gauge, n relations      split by the technologies' water share when
+                                  every one has its water amount (equally when
+                                  the water is all zero), else by their stored
+                                  percentages, else the full bill to each with
+                                  no percentage (add_new_bill's "not split yet")
+  intake (is_source) gauge        split by water share; skipped until every
+                                  related technology has its water amount
+                                  and percentage (allocation.intake_ready),
+                                  and its bill's is_distributed set to match
+
+Percentages come from the station gauges; technologies fed only by intake
+gauges keep theirs.  Technology bills that receive nothing get NULL power
+and cost, and station-gauge targets without a row for the month are created
+as add_new_bill would.  The relations used are the ones active now, so a
+period that ended before one of its relations was created or toggled
+(status_changed_at) was allocated with different ones and is refused
+unless current_relations asks for today's anyway.  Changed rows are written
+back with executemany statements in the session's transaction; the caller
+commits.
+
+Money is summed in float64 and rounded to the column's 4 decimals.
+"""
+
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy import select, and_, bindparam
+
+from allocation import INTAKE_REQUIRED_COLUMNS
+from lazy_imports import np, pd
+from models import Station, StationGaugeTechnology, GuageBill, TechnologyBill
+
+RECOMPUTE_TOLERANCE = 1e-6   # changes smaller than this are not written
+
+# load_month()'s name for each technology_bill column an intake split waits for
+_TECH_BILL_FRAME = {"technology_water_amount": "water", "technology_bill_percentage": "percentage"}
+_INTAKE_REQUIRED = [_TECH_BILL_FRAME[column] for column in INTAKE_REQUIRED_COLUMNS]
+
+
+def _frame(session, statement, columns):
+    return pd.DataFrame(session.execute(statement).all(), columns=columns)
+
+
+def load_month(session, year, month, branch_id=None, current_relations=False):
+    """
+    (gauge bills, active relations, technology bills) of the period as
+    DataFrames.  Raises ValueError when a relation in scope changed after the
+    period, unless current_relations.
+    """
+    relations = _frame(session, select(
+        StationGaugeTechnology.account_number, StationGaugeTechnology.station_id,
+        StationGaugeTechnology.technology_id, StationGaugeTechnology.is_source, Station.branch_id,
+        StationGaugeTechnology.relation_status, StationGaugeTechnology.status_changed_at,
+    ).join(Station, Station.station_id == StationGaugeTechnology.station_id),
+        ["account_number", "station_id", "technology_id", "is_source", "branch_id", "active", "changed_at"])
+    if branch_id is not None:
+        # a gauge's stations all belong to one branch, so whole gauges stay together
+        relations = relations[relations["branch_id"] == branch_id]
+    if not current_relations:
+        period_end = datetime(year + month // 12, month % 12 + 1, 1)
+        changed = relations[pd.to_datetime(relations["changed_at"]) >= period_end]
+        if len(changed):
+            raise ValueError(f"relations of {', '.join(sorted(set(changed['account_number'])))} changed after "
+                             f"{month}/{year}; the month was allocated with different ones")
+    relations = relations[relations["active"].astype(bool)].drop(columns=["active", "changed_at"])
+
+    bills = _frame(session, select(
+        GuageBill.account_number, GuageBill.power_consump, GuageBill.bill_total, GuageBill.is_distributed,
+    ).where(GuageBill.bill_year == year, GuageBill.bill_month == month),
+        ["account_number", "power_consump", "bill_total", "is_distributed"])
+    bills = bills[bills["account_number"].isin(relations["account_number"])]
+
+    tech_bills = _frame(session, select(
+        TechnologyBill.station_id, TechnologyBill.technology_id, TechnologyBill.technology_water_amount,
+        TechnologyBill.technology_bill_percentage, TechnologyBill.technology_power_consump,
+        TechnologyBill.technology_bill_total,
+    ).where(TechnologyBill.bill_year == year, TechnologyBill.bill_month == month),
+        ["station_id", "technology_id", "water", "percentage", "power", "total"])
+    if branch_id is not None:
+        stations = session.scalars(select(Station.station_id).where(Station.branch_id == branch_id)).all()
+        tech_bills = tech_bills[tech_bills["station_id"].isin(stations)]
+
+    bills["bill_total"] = bills["bill_total"].astype(float)
+    for column in ("water", "percentage", "power", "total"):
+        tech_bills[column] = tech_bills[column].astype(float)
+    relations["is_source"] = relations["is_source"].astype(bool)
+    return bills, relations, tech_bills
+
+
+def allocate_month(bills, relations, tech_bills):
+    """
+    The recomputed technology bills: one row per (station_id, technology_id)
+    with power, total, percentage and an `exists` flag.
+    """
+    keys = ["station_id", "technology_id"]
+    shares = bills.merge(relations[["account_number"] + keys + ["is_source"]], on="account_number")
+    shares = shares.merge(tech_bills[keys + ["water", "percentage"]], on=keys, how="left", indicator=True)
+    shares["has_row"] = shares.pop("_merge") == "both"
+
+    by_gauge = shares.groupby("account_number")
+    n = by_gauge["station_id"].transform("size")
+    all_water = (shares["water"].notna() & shares["has_row"]).groupby(shares["account_number"]).transform("all")
+    all_pct = shares["percentage"].notna().groupby(shares["account_number"]).transform("all")
+    intake_ready = (shares[_INTAKE_REQUIRED].notna().all(axis=1) & shares["has_row"]).groupby(
+        shares["account_number"]).transform("all")
+    total_water = by_gauge["water"].transform("sum")
+    water_share = np.where(total_water > 0, shares["water"] / total_water.where(total_water > 0, 1), 1 / n)
+
+    source = shares["is_source"]
+    single = ~source & (n == 1)
+    weight = np.select(
+        [single, ~source & all_water, ~source & all_pct, ~source, intake_ready],
+        [1.0, water_share, shares["percentage"] / 100, 1.0, water_share],
+        default=0.0,   # intake gauge still waiting for water amounts
+    )
+    percentage = np.select(
+        [single, ~source & all_water, ~source & all_pct],
+        [100.0, water_share * 100, shares["percentage"]],
+        default=np.nan,
+    )
+    shares["power"] = shares["power_consump"] * weight
+    shares["total"] = shares["bill_total"] * weight
+    shares["new_percentage"] = percentage
+    shares["counts"] = ~source | intake_ready
+
+    shares = shares[shares["counts"]]
+    station_shares = shares[~shares["is_source"]]
+    result = shares.groupby(keys, as_index=False)[["power", "total"]].sum()
+    pct = station_shares.groupby(keys, as_index=False)["new_percentage"].last()
+    result = result.merge(pct, on=keys, how="left")
+
+    result = tech_bills[keys + ["percentage"]].merge(result, on=keys, how="outer", indicator=True)
+    result["exists"] = result.pop("_merge") != "right_only"   # new rows only come from station gauges
+    fed_by_station = result.set_index(keys).index.isin(station_shares.set_index(keys).index)
+    result["percentage"] = np.where(fed_by_station, result["new_percentage"], result["percentage"])
+    result["total"] = result["total"].round(4)
+    return result.drop(columns="new_percentage").reset_index(drop=True)
+
+
+def intake_distribution(bills, relations, tech_bills):
+    """is_distributed per intake gauge bill: every technology it feeds is intake_ready."""
+    keys = ["station_id", "technology_id"]
+    sources = bills[["account_number"]].merge(
+        relations[relations["is_source"]][["account_number"] + keys], on="account_number")
+    sources = sources.merge(tech_bills[keys + _INTAKE_REQUIRED], on=keys, how="left")
+    return sources[_INTAKE_REQUIRED].notna().all(axis=1).groupby(sources["account_number"]).all()
+
+
+def _changed(new, old):
+    both_null = new.isna() & old.isna()
+    return ~both_null & (new.isna() | old.isna() | ((new - old).abs() > RECOMPUTE_TOLERANCE))
+
+
+def _value(value, decimal=False):
+    if pd.isna(value):
+        return None
+    return Decimal(str(round(float(value), 4))) if decimal else float(value)
+
+
+def recompute_month(session, year, month, branch_id=None, dry_run=False, current_relations=False):
+    """Recompute and write back the period's allocations; returns a summary dict."""
+    start = time.perf_counter()
+    bills, relations, tech_bills = load_month(session, year, month, branch_id, current_relations)
+    result = allocate_month(bills, relations, tech_bills)
+
+    keys = ["station_id", "technology_id"]
+    current = tech_bills[keys + ["power", "total", "percentage"]].rename(
+        columns={"power": "old_power", "total": "old_total", "percentage": "old_percentage"})
+    existing = result[result["exists"]].merge(current, on=keys)
+    changed = existing[_changed(existing["power"], existing["old_power"])
+                       | _changed(existing["total"], existing["old_total"])
+                       | _changed(existing["percentage"], existing["old_percentage"])]
+    created = result[~result["exists"]]
+    distributed = intake_distribution(bills, relations, tech_bills)
+    marked = bills.set_index("account_number")["is_distributed"].astype(bool).reindex(distributed.index)
+    remarked = distributed[distributed != marked]
+
+    summary = {
+        "gauge_bills": len(bills),
+        "tech_bills": int(result["exists"].sum()),
+        "updated": len(changed),
+        "created": len(created),
+        "intake_bills_marked": len(remarked),
+        "dry_run": dry_run,
+    }
+
+    if not dry_run:
+        techs = TechnologyBill.__table__
+        if len(changed):
+            session.execute(
+                techs.update().where(and_(
+                    techs.c.station_id == bindparam("b_station_id"),
+                    techs.c.technology_id == bindparam("b_technology_id"),
+                    techs.c.bill_month == month,
+                    techs.c.bill_year == year,
+                )).values(
+                    technology_power_consump=bindparam("b_power"),
+                    technology_bill_total=bindparam("b_total"),
+                    technology_bill_percentage=bindparam("b_percentage"),
+                ),
+                [{"b_station_id": int(row.station_id), "b_technology_id": int(row.technology_id),
+                  "b_power": _value(row.power), "b_total": _value(row.total, decimal=True),
+                  "b_percentage": _value(row.percentage)} for row in changed.itertuples()],
+            )
+        if len(created):
+            session.execute(techs.insert(), [{
+                "station_id": int(row.station_id), "technology_id": int(row.technology_id),
+                "bill_month": month, "bill_year": year,
+                "technology_power_consump": _value(row.power),
+                "technology_bill_total": _value(row.total, decimal=True),
+                "technology_bill_percentage": _value(row.percentage),
+            } for row in created.itertuples()])
+        if len(remarked):
+            bills_table = GuageBill.__table__
+            session.execute(
+                bills_table.update().where(and_(
+                    bills_table.c.account_number == bindparam("b_account_number"),
+                    bills_table.c.bill_month == month,
+                    bills_table.c.bill_year == year,
+                )).values(is_distributed=bindparam("b_is_distributed")),
+                [{"b_account_number": account_number, "b_is_distributed": bool(flag)}
+                 for account_number, flag in remarked.items()],
+            )
+
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    return summary
@@ -0,0 +1,253 @@
+"""
+Slow-query recorder.
+
+Every statement slower than SLOW_QUERY_MS is recorded with its duration,
+the route that ran it and the types of its bound parameters (never their
+values, which include logins and tokens): into an in-memory ring buffer,
+into a per-statement aggregate (count / total / max time) and as a JSON
+line in a rotating log file.  Statements slower than SLOW_QUERY_PLAN_MS also
+get their query plan captured once per PLAN_REFRESH_SECONDS: EXPLAIN QUERY
+PLAN on SQLite, right away on the statement's own connection; SHOWPLAN_TEXT
+on SQL Server, later on the plan thread over a connection opened outside
+the pool, so a slow query never waits on a second pooled connection.
+/slow-queries lists the top offenders by total time.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+
+SLOW_QUERY_MS = 200
+SLOW_QUERY_PLAN_MS = 500
+SLOW_QUERY_BUFFER = 500
+SLOW_QUERY_MAX_STATEMENTS = 1000   # distinct statements aggregated before the least costly are dropped
+PLAN_REFRESH_SECONDS = 600
+PLAN_QUEUE_SIZE = 100              # SQL Server plans waiting for the plan thread; more are skipped
+MAX_PARAMS_REPR = 500
+
+file_logger = logging.getLogger("slow_queries")
+file_logger.propagate = False
+logger = logging.getLogger(__name__)
+
+
+def _types_repr(parameters):
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    return "(" + ", ".join(type(value).__name__ for value in parameters or ()) + ")"
+
+
+def _params_repr(parameters, executemany):
+    """The shape of the bound parameters: their types, never their values."""
+    if executemany and isinstance(parameters, (list, tuple)):
+        first = _types_repr(parameters[0]) if parameters else "()"
+        text = f"{len(parameters)} rows of {first}"
+    else:
+        text = _types_repr(parameters)
+    return text if len(text) <= MAX_PARAMS_REPR else text[:MAX_PARAMS_REPR] + "..."
+
+
+def _is_select(statement):
+    head = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return head in ("SELECT", "WITH")
+
+
+def capture_plan(conn, statement, parameters):
+    """
+    Plan rows of statement as text, explained on a second cursor of the
+    statement's own SQLite connection.  Other dialects return None here;
+    SQL Server plans come from capture_mssql_plan() on the plan thread.
+    """
+    if conn.dialect.name == "sqlite":
+        cursor = conn.connection.dbapi_connection.cursor()
+        try:
+            cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())
+            return "\n".join(" | ".join(str(col) for col in row) for row in cursor.fetchall())
+        finally:
+            cursor.close()
+    return None
+
+
+def capture_mssql_plan(engine, statement, parameters):
+    """
+    SHOWPLAN_TEXT of statement on a DBAPI connection of its own, opened with
+    the engine's URL but outside its pool: pyodbc without MARS allows one
+    active cursor per connection, and the connection is closed afterwards
+    rather than returned to the pool in showplan mode.
+    """
+    cargs, cparams = engine.dialect.create_connect_args(engine.url)
+    raw = engine.dialect.connect(*cargs, **cparams)
+    try:
+        cursor = raw.cursor()
+        cursor.execute("SET SHOWPLAN_TEXT ON")
+        cursor.execute(statement, parameters or ())
+        lines = []
+        while True:
+            lines.extend(str(row[0]) for row in cursor.fetchall())
+            if not cursor.nextset():
+                break
+        return "\n".join(lines)
+    finally:
+        raw.close()
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms=SLOW_QUERY_MS, plan_threshold_ms=SLOW_QUERY_PLAN_MS,
+                 buffer_size=SLOW_QUERY_BUFFER):
+        self.threshold_ms = threshold_ms
+        self.plan_threshold_ms = plan_threshold_ms
+        self._lock = threading.Lock()
+        self.recent = deque(maxlen=buffer_size)
+        self.statements = {}   # statement text -> aggregate dict
+        self._plans = None     # (engine, statement, parameters, agg, entry) for the plan thread
+        self._plan_thread = None
+        self._pid = None
+
+    def init_app(self, app):
+        self.threshold_ms = app.config.get("SLOW_QUERY_MS", self.threshold_ms)
+        self.plan_threshold_ms = app.config.get("SLOW_QUERY_PLAN_MS", self.plan_threshold_ms)
+        self.recent = deque(maxlen=app.config.get("SLOW_QUERY_BUFFER", SLOW_QUERY_BUFFER))
+        log_file = app.config.get("SLOW_QUERY_LOG_FILE")
+        if log_file and not file_logger.handlers:
+            os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+            handler = RotatingFileHandler(log_file, maxBytes=10 * 1024 * 1024, backupCount=5, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            file_logger.addHandler(handler)
+            file_logger.setLevel(logging.INFO)
+
+    def attach(self, engine):
+        if getattr(engine, "_slow_query_log_attached", False):
+            return
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        engine._slow_query_log_attached = True
+
+    @staticmethod
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("slow_query_start")
+        if not starts:
+            return
+        duration_ms = (time.perf_counter() - starts.pop()) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+        try:
+            self.record(conn, statement, parameters, executemany, duration_ms)
+        except Exception as e:
+            # never let diagnostics break the query that triggered them
+            logger.error(f"[SLOW QUERY] recording failed: {e}")
+
+    def record(self, conn, statement, parameters, executemany, duration_ms):
+        route = f"{request.method} {request.path} ({request.endpoint})" if has_request_context() else None
+        entry = {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "duration_ms": round(duration_ms, 3),
+            "route": route,
+            "statement": statement,
+            "parameters": _params_repr(parameters, executemany),
+        }
+
+        with self._lock:
+            agg = self.statements.get(statement)
+            if agg is None:
+                if len(self.statements) >= SLOW_QUERY_MAX_STATEMENTS:
+                    cheapest = min(self.statements, key=lambda s: self.statements[s]["total_ms"])
+                    del self.statements[cheapest]
+                agg = self.statements[statement] = {
+                    "statement": statement, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                    "routes": set(), "last_parameters": None, "plan": None, "plan_at": 0.0,
+                }
+            agg["count"] += 1
+            agg["total_ms"] += duration_ms
+            agg["max_ms"] = max(agg["max_ms"], duration_ms)
+            agg["last_parameters"] = entry["parameters"]
+            if route:
+                agg["routes"].add(route)
+            need_plan = (duration_ms >= self.plan_threshold_ms and not executemany and _is_select(statement)
+                         and time.monotonic() - agg["plan_at"] > PLAN_REFRESH_SECONDS)
+            if need_plan:
+                agg["plan_at"] = time.monotonic()
+
+        if need_plan and conn.dialect.name == "mssql":
+            self._defer_plan(conn.engine, statement, parameters, agg, entry)
+        elif need_plan:
+            try:
+                plan = capture_plan(conn, statement, parameters)
+            except Exception as e:
+                plan = f"plan capture failed: {e}"
+            entry["plan"] = plan
+            with self._lock:
+                agg["plan"] = plan
+
+        with self._lock:
+            self.recent.append(entry)
+        if file_logger.handlers:
+            file_logger.info(json.dumps(entry, ensure_ascii=False, default=str))
+
+    # --- SQL Server plan thread ----------------------------------------------
+
+    def _defer_plan(self, engine, statement, parameters, agg, entry):
+        self._ensure_plan_thread()
+        try:
+            self._plans.put_nowait((engine, statement, parameters, agg, entry))
+        except queue.Full:
+            with self._lock:
+                agg["plan_at"] = 0.0   # try again with the next slow run
+
+    def _ensure_plan_thread(self):
+        if self._pid == os.getpid() and self._plan_thread is not None and self._plan_thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # forked worker: the parent's thread and queue don't exist here
+                self._plans = queue.Queue(maxsize=PLAN_QUEUE_SIZE)
+                self._plan_thread = None
+                self._pid = os.getpid()
+            if self._plan_thread is None or not self._plan_thread.is_alive():
+                self._plan_thread = threading.Thread(target=self._run_plans, name="slow-query-plans", daemon=True)
+                self._plan_thread.start()
+
+    def _run_plans(self):
+        while True:
+            engine, statement, parameters, agg, entry = self._plans.get()
+            try:
+                plan = capture_mssql_plan(engine, statement, parameters)
+            except Exception as e:
+                plan = f"plan capture failed: {e}"
+            with self._lock:
+                agg["plan"] = plan
+                entry["plan"] = plan
+            if file_logger.handlers:
+                file_logger.info(json.dumps({"at": datetime.now().isoformat(timespec="seconds"),
+                                             "statement": statement, "plan": plan}, ensure_ascii=False))
+
+    def top(self, limit=20):
+        with self._lock:
+            rows = sorted(self.statements.values(), key=lambda a: a["total_ms"], reverse=True)[:limit]
+            return [{
+                "statement": a["statement"],
+                "count": a["count"],
+                "total_ms": round(a["total_ms"], 3),
+                "avg_ms": round(a["total_ms"] / a["count"], 3),
+                "max_ms": round(a["max_ms"], 3),
+                "routes": sorted(a["routes"]),
+                "last_parameters": a["last_parameters"],
+                "plan": a["plan"],
+            } for a in rows]
+
+    def latest(self, limit=50):
+        with self._lock:
+            return list(self.recent)[-limit:][::-1]
+
+
+slow_query_log = SlowQueryLog()
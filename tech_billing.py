@@ -0,0 +1,186 @@
+"""
+Monthly water and chemicals import (`/tech-bills/import`): the stations'
+sheets for a month as CSV/XLSX, one row per station technology, in the
+units of /insert-or-edit-tech-bill's form (chemicals are stored * 1000).
+
+The whole file is validated in one vectorized pandas pass, with the checks
+insert_or_edit_tech_bill makes for a single entry:
+
+  405  technology_water_amount != measured_water + calculated_water
+  404  the month's water was already entered for this station technology
+  405  a new station technology has no station meter relation
+
+The valid rows are written with their power per water and the season's
+chemical ranges from one preloaded reference lookup.  Then every station
+meter touched by the file is split by water share and every touched intake
+meter's bill is distributed (allocation.py) once per meter instead of once
+per row, all in the caller's transaction.
+"""
+
+from collections import defaultdict
+
+from sqlalchemy import select
+
+from billing import read_sheet
+from lazy_imports import np, pd
+from models import Station, Technology, TechnologyBill, GuageBill, AlumChlorineReference
+from allocation import get_season, set_chemical_ranges, split_station_meter, distribute_intake_bill
+from topology import topology_cache
+
+REQUIRED_COLUMNS = ["station_id", "technology_id", "technology_water_amount", "measured_water",
+                    "calculated_water", "technology_chlorine_consump"]
+OPTIONAL_COLUMNS = {"technology_solid_alum_consump": 0, "technology_liquid_alum_consump": 0}
+CHEMICAL_COLUMNS = ["technology_chlorine_consump", "technology_solid_alum_consump",
+                    "technology_liquid_alum_consump"]
+NUMERIC_COLUMNS = REQUIRED_COLUMNS[2:] + list(OPTIONAL_COLUMNS)
+ENTRY_COLUMNS = ["technology_water_amount", "measured_water", "calculated_water"] + CHEMICAL_COLUMNS
+WATER_TOLERANCE = 1e-6   # spreadsheet floats: 0.1 + 0.2 is not exactly 0.3
+
+ERRORS = {
+    "missing_ids": (400, "رقم المحطة أو التكنولوجيا غير صحيح في الصف"),
+    "duplicate": (400, "المحطة والتكنولوجيا مكررة في الملف"),
+    "wrong_month": (400, "شهر أو سنة البيانات غير مطابقة لشهر الاستيراد"),
+    "not_numeric": (400, "قيمة غير رقمية أو فارغة في الأعمدة: {}"),
+    "water_total": (405, "كمية المياه الاجمالية غير مطابقة لمجموع المقاس والمحسوب"),
+    "entered": (404, "تم إدخال بيانات المحطة من قبل"),
+    "no_meter": (405, "هذه المحطة غير مربوطة بعداد، برجاء ربط المحطة أولا"),
+}
+
+
+def read_tech_bill_file(file_storage):
+    """DataFrame of an uploaded .csv/.xlsx water and chemicals sheet."""
+    return read_sheet(file_storage, REQUIRED_COLUMNS, OPTIONAL_COLUMNS)
+
+
+def validate_tech_bills(session, df, bill_month, bill_year):
+    """(valid rows, {row number: [(code, message), ...]}) for a sheet frame."""
+    errors = defaultdict(list)
+
+    def fail(mask, key, *args):
+        code, message = ERRORS[key]
+        message = message.format(*args)
+        for row in df.index[mask]:
+            errors[row].append((code, message))
+
+    df = df.copy()
+    for column in ("station_id", "technology_id"):
+        df[column] = pd.to_numeric(df[column], errors="coerce")
+    bad_ids = (df[["station_id", "technology_id"]].isna().any(axis=1)
+               | (df["station_id"] % 1 != 0) | (df["technology_id"] % 1 != 0))
+    fail(bad_ids, "missing_ids")
+    df.loc[bad_ids, ["station_id", "technology_id"]] = -1
+    df[["station_id", "technology_id"]] = df[["station_id", "technology_id"]].astype("int64")
+    fail(df.duplicated(["station_id", "technology_id"], keep=False) & ~bad_ids, "duplicate")
+    for column, expected in (("bill_month", bill_month), ("bill_year", bill_year)):
+        if column in df.columns:
+            fail(pd.to_numeric(df[column], errors="coerce") != expected, "wrong_month")
+
+    for column in NUMERIC_COLUMNS:
+        df[column] = pd.to_numeric(df[column], errors="coerce")
+    not_numeric = df[NUMERIC_COLUMNS].isna()
+    for row in df.index[not_numeric.any(axis=1)]:
+        columns = ", ".join(not_numeric.columns[not_numeric.loc[row]])
+        errors[row].append((ERRORS["not_numeric"][0], ERRORS["not_numeric"][1].format(columns)))
+    checkable = ~bad_ids & ~not_numeric.any(axis=1)
+    fail(checkable & ~np.isclose(df["technology_water_amount"], df["measured_water"] + df["calculated_water"],
+                                 rtol=0, atol=WATER_TOLERANCE), "water_total")
+
+    existing = pd.DataFrame(session.execute(
+        select(TechnologyBill.station_id, TechnologyBill.technology_id, TechnologyBill.technology_water_amount)
+        .where(TechnologyBill.bill_month == bill_month, TechnologyBill.bill_year == bill_year)
+    ).all(), columns=["station_id", "technology_id", "existing_water"])
+    existing["exists"] = True
+    df = df.join(existing.set_index(["station_id", "technology_id"]), on=["station_id", "technology_id"])
+    df["exists"] = df["exists"].notna()
+    fail(~bad_ids & df["exists"] & df["existing_water"].notna(), "entered")
+
+    topology = topology_cache.get()
+    has_meter = [topology.station_meter(s, t) is not None for s, t in zip(df["station_id"], df["technology_id"])]
+    fail(~bad_ids & ~df["exists"] & ~np.array(has_meter, dtype=bool), "no_meter")
+
+    valid = df[~df.index.isin(list(errors))]
+    return valid, dict(errors)
+
+
+def import_tech_bills(session, valid, bill_month, bill_year, username):
+    """
+    Write the validated rows and run their meters' allocation in session's
+    transaction (the caller commits, or rolls back for a dry run).
+
+    Returns (summary counts, audit entries for the entered rows).  The
+    allocation changes are not audited, like insert_or_edit_tech_bill's
+    automatic updates.
+    """
+    topology = topology_cache.get()
+    month_bills = {(b.station_id, b.technology_id): b for b in session.query(TechnologyBill).filter(
+        TechnologyBill.bill_month == bill_month, TechnologyBill.bill_year == bill_year)}
+    power_per_water = dict(session.execute(select(Technology.technology_id, Technology.power_per_water)).all())
+    water_sources = dict(session.execute(select(Station.station_id, Station.water_source_id)).all())
+    chemicals_refs = {(ref.technology_id, ref.water_source_id): ref for ref in session.query(AlumChlorineReference)
+                      .filter(AlumChlorineReference.season == get_season(bill_month))}
+
+    audit_entries = []
+    station_meters, intake_meters = set(), set()
+    created = 0
+    with session.no_autoflush:
+        for row in valid.itertuples():
+            key = (int(row.station_id), int(row.technology_id))
+            entry = {column: float(getattr(row, column)) for column in ENTRY_COLUMNS}
+            for column in CHEMICAL_COLUMNS:
+                entry[column] *= 1000
+            bill = month_bills.get(key)
+            if bill is None:
+                bill = month_bills[key] = TechnologyBill(station_id=key[0], technology_id=key[1],
+                                                         bill_month=bill_month, bill_year=bill_year)
+                sgt = topology.station_meter(*key)
+                if len(topology.relations(sgt.account_number, is_source=False)) == 1:
+                    bill.technology_bill_percentage = 100
+                session.add(bill)
+                created += 1
+                old_data = None
+            else:
+                old_data = {column: getattr(bill, column) for column in ENTRY_COLUMNS}
+            for column, value in entry.items():
+                setattr(bill, column, value)
+            bill.power_per_water = power_per_water.get(key[1])
+            set_chemical_ranges(bill, chemicals_refs.get((key[1], water_sources.get(key[0]))))
+
+            ids = {"station_id": key[0], "technology_id": key[1], "bill_month": bill_month, "bill_year": bill_year}
+            audit_entries.append({
+                "username": username, "action": "INSERT" if old_data is None else "UPDATE",
+                "table_name": TechnologyBill.__tablename__,
+                "old_data": None if old_data is None else {**old_data, **ids},
+                "new_data": {**entry, **ids},
+            })
+
+            sgt = topology.station_meter(*key)
+            if sgt and not bill.technology_bill_percentage:
+                station_meters.add(sgt.account_number)
+            source_stg = topology.intake_meter(*key)
+            if source_stg:
+                intake_meters.add(source_stg.account_number)
+
+        session.flush()   # the entries go out before the splits and intake shares are applied in SQL
+        split = sum(split_station_meter(session, topology.relations(account_number, is_source=False), month_bills)
+                    for account_number in sorted(station_meters))
+
+    distributed = 0
+    if intake_meters:
+        # locked like the allocation jobs do, so each bill is distributed once (is_distributed)
+        gauge_bills = session.query(GuageBill).filter(
+            GuageBill.account_number.in_(intake_meters),
+            GuageBill.bill_month == bill_month,
+            GuageBill.bill_year == bill_year,
+        ).with_for_update().with_hint(GuageBill, "WITH (UPDLOCK, ROWLOCK)", "mssql").populate_existing().all()
+        distributed = sum(distribute_intake_bill(session, gauge_bill,
+                                                 topology.relations(gauge_bill.account_number, is_source=True),
+                                                 month_bills)
+                          for gauge_bill in gauge_bills)
+
+    summary = {
+        "imported": len(valid),
+        "tech_bills_created": created,
+        "station_meters_split": split,
+        "intake_bills_distributed": distributed,
+    }
+    return summary, audit_entries
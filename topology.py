@@ -0,0 +1,140 @@
+"""
+In-process index of the station/gauge/technology topology.
+
+The billing routes keep asking the same questions of station_guage_technology:
+which active relations a meter has, and which meter (station meter or intake
+meter) feeds a station technology.  The whole table is small, so it is read
+once into an immutable Topology snapshot and those questions become dict
+lookups.
+
+Every load gets a new version number.  /new-relation and /edit-relation
+bump the topology_version row in their transaction (bump_version()) and
+call invalidate() after they commit, so the next request in this worker
+rebuilds the snapshot.  Other workers compare the row with the one their
+snapshot was loaded at before serving it (one primary key read, once per
+request), so the write paths never allocate with relations another worker
+has just cancelled or added.  TOPOLOGY_MAX_AGE still bounds a snapshot's
+life.
+"""
+
+import threading
+import time
+from collections import namedtuple
+
+from flask import g, has_request_context
+from sqlalchemy import select, update
+
+from models import db, StationGaugeTechnology, TopologyVersion
+
+TOPOLOGY_MAX_AGE = 60  # seconds
+
+Relation = namedtuple("Relation", "relation_id station_id technology_id account_number is_source")
+
+
+def stored_version(session):
+    """The topology_version row's version (0 before the first relation change on a fresh database)."""
+    return session.scalar(select(TopologyVersion.version).where(TopologyVersion.version_id == 1)) or 0
+
+
+def bump_version(session):
+    """Call in the transaction that changes station_guage_technology; every worker reloads after it commits."""
+    bumped = session.execute(update(TopologyVersion).where(TopologyVersion.version_id == 1)
+                             .values(version=TopologyVersion.version + 1)).rowcount
+    if not bumped:
+        session.add(TopologyVersion(version_id=1, version=1))
+
+
+class Topology:
+    """Read-only snapshot; relations are ordered by (station_id, technology_id)."""
+
+    def __init__(self, version, relations, stored_version=0):
+        self.version = version
+        self.stored_version = stored_version   # topology_version's row when the relations were read
+        self._by_account = {}
+        self._station_meter = {}
+        self._intake_meter = {}
+        self._source_accounts = set()
+
+        for rel in relations:
+            if rel.is_source:
+                self._source_accounts.add(rel.account_number)   # inactive intake relations count here too
+            if not rel.relation_status:
+                continue
+            relation = Relation(rel.station_guage_technology_id, rel.station_id, rel.technology_id,
+                                rel.account_number, bool(rel.is_source))
+            self._by_account.setdefault(relation.account_number, []).append(relation)
+            meters = self._intake_meter if relation.is_source else self._station_meter
+            meters.setdefault((relation.station_id, relation.technology_id), relation)
+
+        self._by_account = {account: tuple(rels) for account, rels in self._by_account.items()}
+
+    def relations(self, account_number, is_source=None):
+        """Active relations of a meter, optionally only intake (True) or station (False) ones."""
+        relations = self._by_account.get(account_number, ())
+        if is_source is None:
+            return relations
+        return tuple(r for r in relations if r.is_source == is_source)
+
+    def station_meter(self, station_id, technology_id):
+        """The first active station (non-intake) relation of a station technology, or None."""
+        return self._station_meter.get((station_id, technology_id))
+
+    def intake_meter(self, station_id, technology_id):
+        """The active intake relation of a station technology, or None."""
+        return self._intake_meter.get((station_id, technology_id))
+
+    def is_intake_meter(self, account_number):
+        """True if the meter has ever been related as an intake (is_source) meter."""
+        return account_number in self._source_accounts
+
+
+class TopologyCache:
+    def __init__(self, max_age=TOPOLOGY_MAX_AGE):
+        self.max_age = max_age
+        self._topology = None
+        self._loaded_at = None
+        self._version = 0
+        self._generation = 0   # bumped by invalidate(), so a load racing with it is not installed
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            generation = self._generation
+            self._version += 1
+            version = self._version
+        stored = stored_version(db.session)
+        relations = db.session.query(
+            StationGaugeTechnology.station_guage_technology_id, StationGaugeTechnology.station_id,
+            StationGaugeTechnology.technology_id, StationGaugeTechnology.account_number,
+            StationGaugeTechnology.relation_status, StationGaugeTechnology.is_source,
+        ).order_by(
+            StationGaugeTechnology.station_id, StationGaugeTechnology.technology_id,
+            StationGaugeTechnology.account_number,
+        ).all()
+        topology = Topology(version, relations, stored)
+        with self._lock:
+            if generation == self._generation:
+                self._topology = topology
+                self._loaded_at = time.monotonic()
+        return topology
+
+    def get(self):
+        topology, loaded_at = self._topology, self._loaded_at
+        if topology is None or loaded_at is None or time.monotonic() - loaded_at > self.max_age:
+            return self.load()
+        if has_request_context() and g.get("topology_checked") is topology:
+            return topology
+        if stored_version(db.session) != topology.stored_version:
+            return self.load()   # another worker changed the relations
+        if has_request_context():
+            g.topology_checked = topology
+        return topology
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._topology = None
+            self._loaded_at = None
+
+
+topology_cache = TopologyCache()
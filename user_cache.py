@@ -0,0 +1,108 @@
+"""
+In-process cache of active users for private_route.
+
+Tokens minted by /login carry the user's group_id, username and
+account_version ("ver") as claims.  private_route resolves the caller from
+this cache while the cached account_version matches the token's claim, so a
+protected request costs no user query.  A token whose claim is older than
+the account_version (the password, group or status changed after it was
+issued) is rejected; the database is only consulted when the entry is
+missing/expired or the token is newer than the entry.
+
+Each process has its own cache and the edit routes only invalidate their
+own, so other workers keep serving an edited or deactivated account, and
+accepting its old tokens, for up to USER_CACHE_TTL seconds.
+"""
+
+import threading
+import time
+
+USER_CACHE_TTL = 60           # seconds an entry is trusted before re-reading the DB
+USER_CACHE_MAX_ENTRIES = 5000
+
+
+class CachedUser:
+    """Read-only snapshot of the columns private_route and the audit listeners need."""
+
+    __slots__ = ("emp_code", "username", "group_id", "is_active", "account_version")
+
+    def __init__(self, emp_code, username, group_id, is_active, account_version):
+        self.emp_code = emp_code
+        self.username = username
+        self.group_id = group_id
+        self.is_active = is_active
+        self.account_version = account_version
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            emp_code=user.emp_code,
+            username=user.username,
+            group_id=user.group_id,
+            is_active=bool(user.is_active),
+            account_version=user.account_version or 0,
+        )
+
+    def get_id(self):
+        return str(self.emp_code)
+
+
+class UserCache:
+    def __init__(self, ttl=USER_CACHE_TTL, max_entries=USER_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # emp_code -> (expires_at, CachedUser)
+        self._lock = threading.Lock()
+
+    def get(self, emp_code):
+        entry = self._entries.get(emp_code)
+        if entry is None:
+            return None
+        expires_at, cached = entry
+        if expires_at < time.monotonic():
+            with self._lock:
+                self._entries.pop(emp_code, None)
+            return None
+        return cached
+
+    def put(self, user):
+        cached = user if isinstance(user, CachedUser) else CachedUser.from_user(user)
+        with self._lock:
+            if len(self._entries) >= self.max_entries and cached.emp_code not in self._entries:
+                # Drop the entry closest to expiry rather than growing without bound
+                oldest = min(self._entries, key=lambda k: self._entries[k][0])
+                self._entries.pop(oldest, None)
+            self._entries[cached.emp_code] = (time.monotonic() + self.ttl, cached)
+        return cached
+
+    def invalidate(self, emp_code=None):
+        with self._lock:
+            if emp_code is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(emp_code, None)
+
+
+user_cache = UserCache()
+
+
+def resolve_user(emp_code, claims, load_user):
+    """
+    Return a CachedUser for the token identity, or None if the user no
+    longer exists or the token's "ver" claim is older than its account.
+
+    load_user(emp_code) is only called when there is no cached entry or the
+    token is newer than it (edited in another worker); its result refreshes
+    the cache.
+    """
+    version = claims.get("ver")
+    cached = user_cache.get(emp_code)
+    if cached is not None and (version is None or version <= cached.account_version):
+        return cached if version == cached.account_version else None
+
+    user = load_user(emp_code)
+    if user is None:
+        user_cache.invalidate(emp_code)
+        return None
+    cached = user_cache.put(user)
+    return cached if version == cached.account_version else None
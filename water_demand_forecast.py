@@ -781,7 +781,8 @@ def find_saturation_for_area(best_pipeline, features, feature_set,
 # MAIN ENTRY POINT
 # ═══════════════════════════════════════════════════════════════════════
 
-def run_forecast(df, area_capacities, requested_area_id, area_names=None):
+def run_forecast(df, area_capacities, requested_area_id, area_names=None,
+                 stage_hook=None):
     """
     Combined time-based forecast for all service areas.
 
@@ -792,6 +793,9 @@ def run_forecast(df, area_capacities, requested_area_id, area_names=None):
     area_capacities   : dict {area_id: capacity}
     requested_area_id : int — area from the POST request
     area_names        : dict {area_id: name} — optional
+    stage_hook        : callable(stage_name) — optional, called as each
+                        stage starts and with None when the run ends
+                        (benchmarks/bench_forecast.py times stages with it)
 
     Returns
     -------
@@ -802,8 +806,10 @@ def run_forecast(df, area_capacities, requested_area_id, area_names=None):
     print(f"  WATER DEMAND FORECAST — Combined Model")
     print(f"  Requested area : {requested_area_id}")
     print(f"{'═' * 60}")
+    stage = stage_hook or (lambda name: None)
 
     # ── 1. Data quality report ────────────────────────────────────────
+    stage("data_quality")
     quality = data_quality_report(df)
 
     # ── 2. Area names ─────────────────────────────────────────────────
@@ -812,6 +818,7 @@ def run_forecast(df, area_capacities, requested_area_id, area_names=None):
         area_names = {aid: str(aid) for aid in all_area_ids_raw}
 
     # ── 3. Feature engineering ────────────────────────────────────────
+    stage("feature_engineering")
     original_df  = df.copy()
     original_df  = original_df.sort_values(
         ["year", "month", "area_id"]
@@ -828,47 +835,58 @@ def run_forecast(df, area_capacities, requested_area_id, area_names=None):
     print(f"  CV splits : {n_splits}")
 
     # ── 5. Feature set selection ──────────────────────────────────────
+    stage("feature_selection")
     feature_set = select_feature_set(df, cv)
 
     # ── 6. Validate CV folds ──────────────────────────────────────────
+    stage("cv_validation")
     area_dummy_cols = [c for c in df.columns if c.startswith("area_id_")]
     validate_cv_folds(df, cv,
                       ["year", "month_sin", "month_cos", "log_capacity"]
                       + area_dummy_cols)
 
     # ── 7. Model race ─────────────────────────────────────────────────
+    stage("model_race")
     race_results, best_name = run_model_race(df, feature_set, cv)
     best_info               = race_results[best_name]
 
     # ── 8. Tune best model ────────────────────────────────────────────
+    stage("tuning")
     best_pipeline = tune_best_model(best_name, best_info, df, cv)
 
     # ── 9. Final evaluation ───────────────────────────────────────────
+    stage("holdout_evaluation")
     smearing_factor, final_r2, final_mae = evaluate_final_model(
         best_pipeline, best_info, df
     )
 
     # Refit on ALL data so predictions use maximum information
+    stage("refit")
     best_pipeline.fit(df[best_info["features"]], best_info["target"])
 
     # ── 10. Meaningful metrics ────────────────────────────────────────
+    stage("trend_accuracy")
     trend_acc  = evaluate_trend_accuracy(
         best_pipeline, best_info, original_df,
         all_area_ids, smearing_factor, feature_set, area_names
     )
+    stage("utilization_accuracy")
     util_err   = evaluate_utilization_accuracy(
         best_pipeline, best_info, original_df,
         all_area_ids, smearing_factor, feature_set, area_names
     )
+    stage("mape")
     mape       = evaluate_mape(
         best_pipeline, best_info, original_df,
         all_area_ids, smearing_factor, feature_set, area_names
     )
 
     # ── 11. Feature importance ────────────────────────────────────────
+    stage("feature_importance")
     print_feature_importance(best_name, best_pipeline, best_info["features"])
 
     # ── 12. Save model ────────────────────────────────────────────────
+    stage("save_model")
     joblib.dump(best_pipeline, MODEL_PATH)
     joblib.dump({
         "features":        best_info["features"],
@@ -882,6 +900,7 @@ def run_forecast(df, area_capacities, requested_area_id, area_names=None):
     print(f"\n✓ Model saved → {MODEL_PATH}")
 
     # ── 13. Per-area saturation ───────────────────────────────────────
+    stage("saturation")
     print(f"\n── Saturation analysis ─────────────────────────────────────")
 
     all_areas_saturation  = {}
@@ -907,6 +926,7 @@ def run_forecast(df, area_capacities, requested_area_id, area_names=None):
             requested_area_result = sat
 
     # ── 14. Rank by urgency ───────────────────────────────────────────
+    stage("ranking")
     def sort_key(item):
         sat = item[1]
         if feature_set == "year":
@@ -952,6 +972,7 @@ def run_forecast(df, area_capacities, requested_area_id, area_names=None):
     print(f"  Data reliable     : {'✓ YES' if quality['reliable'] else '✗ NO — ' + str(quality['n_months']) + ' months (need 24)'}")
     print(f"  Requested area    : {requested_area_result}")
     print(f"{'═' * 60}\n")
+    stage(None)
 
     return {
         "best_model":                best_name,
@@ -0,0 +1,9 @@
+"""
+Production entry point:
+
+    flask --app main init-db          # once per deploy: create missing tables
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+from main import create_app
+
+app = create_app()